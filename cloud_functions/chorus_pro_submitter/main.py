@@ -1,21 +1,18 @@
 import functions_framework
-from supabase import create_client, Client
 import os
+import sys
 import requests
 import logging
 from datetime import datetime, timedelta
 import base64
 import json
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.supabase_client import get_supabase
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # Chorus Pro API configuration
 # Test environment URLs
 CHORUS_PRO_TEST_API_URL = "https://sandbox.chorus-pro.gouv.fr/api/v1"
@@ -321,7 +318,7 @@ def submit_to_chorus_pro(request):
         if action == 'submit':
             # Fetch invoice data from Supabase
             logger.info(f"Fetching invoice {invoice_id} from database")
-            invoice_response = supabase.table('invoices').select(
+            invoice_response = get_supabase().table('invoices').select(
                 'invoice_number, facturx_xml_url, total_ttc, invoice_date, client:clients(siret)'
             ).eq('id', invoice_id).single().execute()
 
@@ -357,7 +354,7 @@ def submit_to_chorus_pro(request):
 
             # Update invoice in database
             if result['success']:
-                supabase.table('invoices').update({
+                get_supabase().table('invoices').update({
                     'chorus_pro_id': result['chorus_invoice_id'],
                     'chorus_pro_status': result['status'],
                     'chorus_pro_submitted_at': datetime.utcnow().isoformat(),
@@ -366,7 +363,7 @@ def submit_to_chorus_pro(request):
 
                 logger.info(f"Invoice {invoice_id} successfully submitted to Chorus Pro")
             else:
-                supabase.table('invoices').update({
+                get_supabase().table('invoices').update({
                     'chorus_pro_status': 'FAILED',
                     'chorus_pro_error': result.get('error')
                 }).eq('id', invoice_id).execute()
@@ -375,7 +372,7 @@ def submit_to_chorus_pro(request):
 
         elif action == 'check_status':
             # Get Chorus Pro invoice ID from database
-            invoice_response = supabase.table('invoices').select('chorus_pro_id').eq('id', invoice_id).single().execute()
+            invoice_response = get_supabase().table('invoices').select('chorus_pro_id').eq('id', invoice_id).single().execute()
 
             if not invoice_response.data or not invoice_response.data.get('chorus_pro_id'):
                 return {'success': False, 'error': 'Invoice not submitted to Chorus Pro'}, 400, headers
@@ -387,7 +384,7 @@ def submit_to_chorus_pro(request):
 
             # Update database
             if result['success']:
-                supabase.table('invoices').update({
+                get_supabase().table('invoices').update({
                     'chorus_pro_status': result['status'],
                     'chorus_pro_last_check': datetime.utcnow().isoformat()
                 }).eq('id', invoice_id).execute()
@@ -396,7 +393,7 @@ def submit_to_chorus_pro(request):
 
         elif action == 'get_details':
             # Get Chorus Pro invoice ID from database
-            invoice_response = supabase.table('invoices').select('chorus_pro_id').eq('id', invoice_id).single().execute()
+            invoice_response = get_supabase().table('invoices').select('chorus_pro_id').eq('id', invoice_id).single().execute()
 
             if not invoice_response.data or not invoice_response.data.get('chorus_pro_id'):
                 return {'success': False, 'error': 'Invoice not submitted to Chorus Pro'}, 400, headers
@@ -417,7 +414,7 @@ def submit_to_chorus_pro(request):
         # Update invoice status to failed
         try:
             if invoice_id:
-                supabase.table('invoices').update({
+                get_supabase().table('invoices').update({
                     'chorus_pro_status': 'FAILED',
                     'chorus_pro_error': str(e)
                 }).eq('id', invoice_id).execute()
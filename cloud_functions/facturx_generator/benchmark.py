@@ -0,0 +1,343 @@
+"""
+Factur-X XML benchmark: precompiled skeleton serializer vs lxml tree builder.
+
+Builds the EN16931 XML of synthetic invoices with a growing number of line
+items with both FacturXGenerator.generate_en16931_xml (skeleton) and
+generate_en16931_xml_tree below (lxml tree builder, the reference), reports
+the best time of each over --repeat runs, and checks that both outputs are
+byte-identical and valid against the Factur-X BASIC schema. The streaming
+writer (write_en16931_xml) is measured too, by its peak traced memory, which
+stays flat as lines grow, and so are all profiles (MINIMUM to EXTENDED)
+serialized from one normalized invoice, which costs far less than one
+generate_en16931_xml call per profile.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --lines 1,100,5000 --repeat 20
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from lxml import etree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared.facturx_xml import BASIC_GUIDELINE, NAMESPACES, FacturXGenerator, _amount, _number, _payment_description
+from shared.facturx_model import normalize_invoice
+
+
+def generate_en16931_xml_tree(invoice_data: dict, seller_info: dict, buyer_info: dict) -> bytes:
+    """
+    Build the same BASIC XML as generate_en16931_xml with an lxml tree.
+    Reference implementation the skeleton serializer is checked against.
+    """
+    invoice = normalize_invoice(invoice_data, seller_info, buyer_info)
+    summary = invoice.summary
+    nsmap = NAMESPACES
+
+    # Root element
+    root = etree.Element(
+        '{urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100}CrossIndustryInvoice',
+        nsmap=nsmap
+    )
+
+    # Exchange Context
+    exchange_context = etree.SubElement(root, '{%s}ExchangedDocumentContext' % nsmap['rsm'])
+    guideline_context = etree.SubElement(exchange_context, '{%s}GuidelineSpecifiedDocumentContextParameter' % nsmap['ram'])
+    guideline_id = etree.SubElement(guideline_context, '{%s}ID' % nsmap['ram'])
+    guideline_id.text = BASIC_GUIDELINE
+
+    # Exchanged Document (Invoice Header)
+    exchanged_doc = etree.SubElement(root, '{%s}ExchangedDocument' % nsmap['rsm'])
+
+    doc_id = etree.SubElement(exchanged_doc, '{%s}ID' % nsmap['ram'])
+    doc_id.text = invoice.invoice_number
+
+    doc_type = etree.SubElement(exchanged_doc, '{%s}TypeCode' % nsmap['ram'])
+    doc_type.text = '380'  # Commercial invoice
+
+    doc_issue_date = etree.SubElement(exchanged_doc, '{%s}IssueDateTime' % nsmap['ram'])
+    issue_date = etree.SubElement(doc_issue_date, '{%s}DateTimeString' % nsmap['udt'], format='102')
+    issue_date.text = invoice.issue_date  # YYYYMMDD format
+
+    # Supply Chain Trade Transaction
+    transaction = etree.SubElement(root, '{%s}SupplyChainTradeTransaction' % nsmap['rsm'])
+
+    # Line items (children in schema order: document, product, agreement, delivery, settlement)
+    for item in invoice.line_items:
+        line_item = etree.SubElement(transaction, '{%s}IncludedSupplyChainTradeLineItem' % nsmap['ram'])
+
+        # Line ID
+        line_doc = etree.SubElement(line_item, '{%s}AssociatedDocumentLineDocument' % nsmap['ram'])
+        line_id = etree.SubElement(line_doc, '{%s}LineID' % nsmap['ram'])
+        line_id.text = item.line_id
+
+        # Product description
+        product = etree.SubElement(line_item, '{%s}SpecifiedTradeProduct' % nsmap['ram'])
+        product_name = etree.SubElement(product, '{%s}Name' % nsmap['ram'])
+        product_name.text = item.name
+
+        # Line pricing
+        line_agreement = etree.SubElement(line_item, '{%s}SpecifiedLineTradeAgreement' % nsmap['ram'])
+        net_price = etree.SubElement(line_agreement, '{%s}NetPriceProductTradePrice' % nsmap['ram'])
+        charge_amount = etree.SubElement(net_price, '{%s}ChargeAmount' % nsmap['ram'])
+        charge_amount.text = _amount(item.unit_price)
+
+        # Line delivery
+        line_delivery = etree.SubElement(line_item, '{%s}SpecifiedLineTradeDelivery' % nsmap['ram'])
+        billed_qty = etree.SubElement(line_delivery, '{%s}BilledQuantity' % nsmap['ram'], unitCode='C62')
+        billed_qty.text = _number(item.quantity)
+
+        # Line settlement
+        line_settlement = etree.SubElement(line_item, '{%s}SpecifiedLineTradeSettlement' % nsmap['ram'])
+
+        # VAT
+        line_vat = etree.SubElement(line_settlement, '{%s}ApplicableTradeTax' % nsmap['ram'])
+        vat_type = etree.SubElement(line_vat, '{%s}TypeCode' % nsmap['ram'])
+        vat_type.text = 'VAT'
+        vat_category = etree.SubElement(line_vat, '{%s}CategoryCode' % nsmap['ram'])
+        vat_category.text = item.category
+        vat_percent = etree.SubElement(line_vat, '{%s}RateApplicablePercent' % nsmap['ram'])
+        vat_percent.text = _number(item.vat_rate)
+
+        # Line monetary summation
+        line_summation = etree.SubElement(line_settlement, '{%s}SpecifiedTradeSettlementLineMonetarySummation' % nsmap['ram'])
+        line_total = etree.SubElement(line_summation, '{%s}LineTotalAmount' % nsmap['ram'])
+        line_total.text = _amount(item.line_total)
+
+    # Trade Agreement (Seller & Buyer)
+    agreement = etree.SubElement(transaction, '{%s}ApplicableHeaderTradeAgreement' % nsmap['ram'])
+
+    # Seller
+    seller = invoice.seller
+    seller_party = etree.SubElement(agreement, '{%s}SellerTradeParty' % nsmap['ram'])
+    seller_name_elem = etree.SubElement(seller_party, '{%s}Name' % nsmap['ram'])
+    seller_name_elem.text = seller.name
+
+    # Seller SIRET as legal registration identifier
+    if seller.siret:
+        seller_legal = etree.SubElement(seller_party, '{%s}SpecifiedLegalOrganization' % nsmap['ram'])
+        seller_id = etree.SubElement(seller_legal, '{%s}ID' % nsmap['ram'], schemeID='0002')
+        seller_id.text = seller.siret
+
+    seller_address = etree.SubElement(seller_party, '{%s}PostalTradeAddress' % nsmap['ram'])
+    seller_postal = etree.SubElement(seller_address, '{%s}PostcodeCode' % nsmap['ram'])
+    seller_postal.text = seller.postal_code
+    seller_address_line = etree.SubElement(seller_address, '{%s}LineOne' % nsmap['ram'])
+    seller_address_line.text = seller.address
+    seller_city = etree.SubElement(seller_address, '{%s}CityName' % nsmap['ram'])
+    seller_city.text = seller.city
+    seller_country = etree.SubElement(seller_address, '{%s}CountryID' % nsmap['ram'])
+    seller_country.text = seller.country
+
+    # Seller VAT ID
+    if seller.vat_number:
+        seller_vat = etree.SubElement(seller_party, '{%s}SpecifiedTaxRegistration' % nsmap['ram'])
+        seller_vat_id = etree.SubElement(seller_vat, '{%s}ID' % nsmap['ram'], schemeID='VA')
+        seller_vat_id.text = seller.vat_number
+
+    # Buyer
+    buyer = invoice.buyer
+    buyer_party = etree.SubElement(agreement, '{%s}BuyerTradeParty' % nsmap['ram'])
+    buyer_name_elem = etree.SubElement(buyer_party, '{%s}Name' % nsmap['ram'])
+    buyer_name_elem.text = buyer.name
+
+    buyer_address = etree.SubElement(buyer_party, '{%s}PostalTradeAddress' % nsmap['ram'])
+    buyer_postal = etree.SubElement(buyer_address, '{%s}PostcodeCode' % nsmap['ram'])
+    buyer_postal.text = buyer.postal_code
+    buyer_address_line = etree.SubElement(buyer_address, '{%s}LineOne' % nsmap['ram'])
+    buyer_address_line.text = buyer.address
+    buyer_city = etree.SubElement(buyer_address, '{%s}CityName' % nsmap['ram'])
+    buyer_city.text = buyer.city
+    buyer_country = etree.SubElement(buyer_address, '{%s}CountryID' % nsmap['ram'])
+    buyer_country.text = buyer.country
+
+    # Trade Delivery
+    etree.SubElement(transaction, '{%s}ApplicableHeaderTradeDelivery' % nsmap['ram'])
+
+    # Trade Settlement (Payment terms, totals)
+    settlement = etree.SubElement(transaction, '{%s}ApplicableHeaderTradeSettlement' % nsmap['ram'])
+
+    # Currency
+    currency = etree.SubElement(settlement, '{%s}InvoiceCurrencyCode' % nsmap['ram'])
+    currency.text = 'EUR'
+
+    # Payment means
+    payment_means = etree.SubElement(settlement, '{%s}SpecifiedTradeSettlementPaymentMeans' % nsmap['ram'])
+    payment_type = etree.SubElement(payment_means, '{%s}TypeCode' % nsmap['ram'])
+    payment_type.text = '30'  # Credit transfer
+
+    # VAT breakdown, one entry per category and rate
+    for group in summary.tax_groups:
+        tax_total = etree.SubElement(settlement, '{%s}ApplicableTradeTax' % nsmap['ram'])
+        tax_amount = etree.SubElement(tax_total, '{%s}CalculatedAmount' % nsmap['ram'])
+        tax_amount.text = _amount(group.amount)
+        tax_type = etree.SubElement(tax_total, '{%s}TypeCode' % nsmap['ram'])
+        tax_type.text = 'VAT'
+        tax_basis = etree.SubElement(tax_total, '{%s}BasisAmount' % nsmap['ram'])
+        tax_basis.text = _amount(group.basis)
+        tax_category = etree.SubElement(tax_total, '{%s}CategoryCode' % nsmap['ram'])
+        tax_category.text = group.category
+        tax_percent = etree.SubElement(tax_total, '{%s}RateApplicablePercent' % nsmap['ram'])
+        tax_percent.text = _number(group.rate)
+
+    # Payment terms
+    payment_terms_elem = etree.SubElement(settlement, '{%s}SpecifiedTradePaymentTerms' % nsmap['ram'])
+    payment_desc = etree.SubElement(payment_terms_elem, '{%s}Description' % nsmap['ram'])
+    payment_desc.text = _payment_description(invoice.payment_terms)
+
+    # Due date
+    if invoice.due_date:
+        payment_due = etree.SubElement(payment_terms_elem, '{%s}DueDateDateTime' % nsmap['ram'])
+        due_date_str = etree.SubElement(payment_due, '{%s}DateTimeString' % nsmap['udt'], format='102')
+        due_date_str.text = invoice.due_date
+
+    # Monetary summation
+    monetary_summation = etree.SubElement(settlement, '{%s}SpecifiedTradeSettlementHeaderMonetarySummation' % nsmap['ram'])
+
+    line_total_amount = etree.SubElement(monetary_summation, '{%s}LineTotalAmount' % nsmap['ram'])
+    line_total_amount.text = _amount(summary.line_total)
+
+    tax_basis_total = etree.SubElement(monetary_summation, '{%s}TaxBasisTotalAmount' % nsmap['ram'])
+    tax_basis_total.text = _amount(summary.subtotal_ht)
+
+    tax_total_amount = etree.SubElement(monetary_summation, '{%s}TaxTotalAmount' % nsmap['ram'], currencyID='EUR')
+    tax_total_amount.text = _amount(summary.total_vat)
+
+    grand_total = etree.SubElement(monetary_summation, '{%s}GrandTotalAmount' % nsmap['ram'])
+    grand_total.text = _amount(summary.total_ttc)
+
+    due_payable = etree.SubElement(monetary_summation, '{%s}DuePayableAmount' % nsmap['ram'])
+    due_payable.text = _amount(summary.balance_due)
+
+    # Generate XML bytes
+    xml_bytes = etree.tostring(
+        root,
+        pretty_print=True,
+        xml_declaration=True,
+        encoding='UTF-8'
+    )
+
+    return xml_bytes
+
+
+VARIANTS = {
+    'tree': generate_en16931_xml_tree,
+    'skeleton': FacturXGenerator.generate_en16931_xml,
+}
+
+
+def make_invoice(line_count):
+    """Build a synthetic invoice with `line_count` line items, with seller and buyer info"""
+    vat_rates = [20, 10, 5.5]
+    line_items = [
+        {
+            'description': f'Fourniture raccord laiton réf. {i:06d} & joint',
+            'quantity': i % 7 + 1,
+            'unit_price': 3.5 + (i % 13),
+            'vat_rate': vat_rates[i % len(vat_rates)],
+            'line_total': (i % 7 + 1) * (3.5 + (i % 13)),
+        }
+        for i in range(line_count)
+    ]
+    subtotal = sum(item['line_total'] for item in line_items)
+    invoice = {
+        'invoice_number': f'BENCH-{line_count}',
+        'invoice_date': '2025-11-05',
+        'due_date': '2025-12-05',
+        'payment_terms': '30',
+        'line_items': line_items,
+        'subtotal_ht': subtotal,
+        'total_vat': subtotal * 0.2,
+        'total_ttc': subtotal * 1.2,
+    }
+    seller = {
+        'company_name': 'Plomberie Benchmark',
+        'siret': '12345678900012',
+        'vat_number': 'FR12345678901',
+        'address': '1 rue des Tuyaux',
+        'postal_code': '75001',
+        'city': 'Paris',
+    }
+    buyer = {'name': 'Client Benchmark', 'address': '2 place Bellecour', 'postal_code': '69002', 'city': 'Lyon'}
+    return invoice, seller, buyer
+
+
+class NullOutput:
+    """Binary file object discarding what is written"""
+
+    def write(self, data):
+        return len(data)
+
+
+def stream_peak_kb(invoice):
+    """Return the peak traced memory (KB) of streaming the invoice XML to a discarding output"""
+    tracemalloc.start()
+    FacturXGenerator.write_en16931_xml(NullOutput(), *invoice)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def all_profiles(invoice_data, seller_info, buyer_info):
+    """XML of every profile, from one normalized invoice"""
+    return FacturXGenerator.serialize_profiles(normalize_invoice(invoice_data, seller_info, buyer_info))
+
+
+def best_time(build, args, repeat):
+    """Return (best seconds over `repeat` runs, XML bytes)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        xml_bytes = build(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, xml_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', default='1,100,5000', help='comma separated line item counts')
+    parser.add_argument('--repeat', type=int, default=10, help='runs per variant, the fastest is kept')
+    parser.add_argument('--no-xsd', action='store_true', help='skip the schema validation of the output')
+    args = parser.parse_args()
+
+    line_counts = [int(value) for value in args.lines.split(',')]
+    failures = 0
+
+    print(f"{'lines':>7} {'tree (ms)':>10} {'skeleton (ms)':>14} {'speedup':>8} {'XML (KB)':>9} "
+          f"{'stream peak (KB)':>17} {'all profiles (ms)':>18}  check")
+    for line_count in line_counts:
+        invoice = make_invoice(line_count)
+        tree_seconds, tree_xml = best_time(VARIANTS['tree'], invoice, args.repeat)
+        skeleton_seconds, skeleton_xml = best_time(VARIANTS['skeleton'], invoice, args.repeat)
+        stream_kb = stream_peak_kb(invoice)
+        streamed = io.BytesIO()
+        FacturXGenerator.write_en16931_xml(streamed, *invoice)
+        profiles_seconds, _ = best_time(all_profiles, invoice, args.repeat)
+
+        if skeleton_xml != tree_xml or streamed.getvalue() != skeleton_xml:
+            check = 'DIFFERENT OUTPUT'
+        elif args.no_xsd:
+            check = 'identical'
+        else:
+            from facturx import xml_check_xsd
+            try:
+                xml_check_xsd(skeleton_xml, level='basic')
+                check = 'identical, valid'
+            except Exception as e:
+                check = f'INVALID: {e}'
+        if not check.startswith('identical'):
+            failures += 1
+
+        print(f"{line_count:>7} {tree_seconds * 1000:>10.2f} {skeleton_seconds * 1000:>14.2f} "
+              f"{tree_seconds / skeleton_seconds:>7.1f}x {len(skeleton_xml) / 1024:>9.1f} {stream_kb:>17.1f} "
+              f"{profiles_seconds * 1000:>18.2f}  {check}")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
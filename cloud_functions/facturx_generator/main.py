@@ -1,331 +1,384 @@
 import functions_framework
-from supabase import create_client, Client
 import os
+import sys
+import json
+import hashlib
+import logging
+import dataclasses
 from datetime import datetime
-from facturx import generate_facturx_from_file
-from lxml import etree
-import tempfile
-import io
-
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
-
-
-class FacturXGenerator:
-    """Generate Factur-X compliant XML for French invoices"""
-
-    @staticmethod
-    def generate_en16931_xml(invoice_data: dict, seller_info: dict, buyer_info: dict) -> bytes:
-        """
-        Generate EN16931 (BASIC level) compliant XML
-        Reference: https://www.en16931-3-reader.de/
-        """
-
-        # Namespaces for EN16931
-        nsmap = {
-            'rsm': 'urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100',
-            'qdt': 'urn:un:unece:uncefact:data:standard:QualifiedDataType:100',
-            'udt': 'urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100',
-            'ram': 'urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100',
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.facturx_xml import PROFILES, FacturXGenerator, embed_facturx
+from shared.facturx_model import normalize_invoice
+from shared.facturx_validation import FacturXValidationError, check_facturx_xml
+from shared.supabase_client import get_supabase
+from profile_cache import SELLER_PROFILE_COLUMNS, seller_profiles
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Batch generation: invoices per request, and invoices downloaded/embedded/uploaded at once
+FACTURX_BATCH_MAX = int(os.environ.get("FACTURX_BATCH_MAX", "50"))
+FACTURX_BATCH_WORKERS = int(os.environ.get("FACTURX_BATCH_WORKERS", "4"))
+_batch_pool = None
+
+# Independent Supabase calls of one invoice (PDF download, uploads, public URLs) run concurrently on this pool
+FACTURX_IO_WORKERS = int(os.environ.get("FACTURX_IO_WORKERS", "8"))
+_io_pool = None
+
+# Bump whenever the Factur-X output changes for the same input, so stored files are not reused
+FACTURX_HASH_VERSION = "2"
+
+
+def get_batch_pool():
+    """Return the thread pool used by batch generation, creating it on first use"""
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ThreadPoolExecutor(max_workers=FACTURX_BATCH_WORKERS)
+    return _batch_pool
+
+
+def get_io_pool():
+    """Return the thread pool used for concurrent Supabase calls, creating it on first use"""
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=FACTURX_IO_WORKERS)
+    return _io_pool
+
+
+def build_invoice_data(invoice):
+    """Map an invoices row to the invoice_data expected by FacturXGenerator"""
+    line_items = invoice.get('line_items', [])
+    if isinstance(line_items, str):
+        line_items = json.loads(line_items)
+
+    return {
+        'invoice_number': invoice.get('invoice_number'),
+        'invoice_date': invoice.get('invoice_date', datetime.now().strftime('%Y-%m-%d')),
+        'due_date': invoice.get('due_date'),
+        'payment_terms': invoice.get('payment_terms', '30'),
+        'subtotal_ht': invoice.get('subtotal_ht', 0),
+        'total_vat': invoice.get('total_vat', 0),
+        'total_ttc': invoice.get('total_ttc', 0),
+        'balance_due': invoice.get('balance_due', invoice.get('total_ttc', 0)),
+        'line_items': line_items,
+    }
+
+
+def get_profile_versions(user_ids):
+    """{user_id: updated_at} of the profiles of `user_ids`, read without the other columns"""
+    rows = get_supabase().table('profiles').select('id, updated_at').in_('id', list(user_ids)).execute().data or []
+    return {row['id']: row.get('updated_at') for row in rows}
+
+
+def get_seller_info(user_id, refresh=False):
+    """
+    Seller info of a user: from the profile cache when the profile has not been
+    updated since, or one query on the columns the XML builder reads. None if the
+    user has no profile.
+    """
+    if not refresh:
+        versions = get_profile_versions([user_id])
+        if user_id not in versions:
+            return None
+        seller_info = seller_profiles.get(user_id, versions[user_id])
+        if seller_info is not None:
+            return seller_info
+
+    response = get_supabase().table('profiles').select(SELLER_PROFILE_COLUMNS).eq('id', user_id).single().execute()
+    if not response.data:
+        return None
+    return seller_profiles.put(user_id, response.data)
+
+
+def get_profile(request_json):
+    """Factur-X profile requested in the payload ('basic' by default), or None if unknown"""
+    profile = request_json.get('profile') or 'basic'
+    return profile if profile in PROFILES else None
+
+
+def compute_facturx_hash(invoice_model, profile, source_pdf):
+    """SHA-256 of the normalized invoice, the profile, the output version and the source PDF digest"""
+    canonical = json.dumps(
+        {
+            'version': FACTURX_HASH_VERSION,
+            'profile': profile,
+            'invoice': dataclasses.asdict(invoice_model),
+            'source_pdf': hashlib.sha256(source_pdf).hexdigest(),
+        },
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def find_stored_facturx(invoice, facturx_hash):
+    """(pdf_url, xml_url) of the Factur-X files an invoice row points to if they were built from facturx_hash, else None"""
+    pdf_url = invoice.get('pdf_url') or ''
+    xml_url = invoice.get('facturx_xml_url')
+    if invoice.get('facturx_hash') != facturx_hash or not xml_url or not invoice.get('is_electronic_invoice'):
+        return None
+    # The row may have been pointed back to the plain PDF since
+    if f"facturx_{invoice['id']}.pdf" not in pdf_url:
+        return None
+    return pdf_url, xml_url
+
+
+def download_source_pdf(invoice):
+    """Start downloading the stored PDF of an invoice row on the I/O pool and return its future"""
+    if not invoice.get('pdf_url'):
+        raise Exception('Invoice PDF must be generated before creating Factur-X')
+    return get_io_pool().submit(get_supabase().storage.from_('invoices').download, f"{invoice['id']}.pdf")
+
+
+def generate_invoice_facturx(invoice, seller_info, profile='basic', force_render=False, download=None):
+    """
+    Build the XML of an invoice row in `profile`, embed it into its stored PDF and upload
+    both. Nothing is left in /tmp (see embed_facturx). When the row already
+    points to files built from the same input and source PDF (same facturx_hash), their
+    URLs are returned with 'cached': True and nothing is embedded or uploaded, unless
+    force_render. `download` is the future of download_source_pdf when the caller already
+    started it. Returns {'invoice_id', 'pdf_url', 'xml_url', 'validation_errors',
+    'facturx_hash', 'cached'}; the invoice row itself is not updated. Raises
+    FacturXValidationError for invalid XML in enforce mode.
+    """
+    invoice_id = invoice['id']
+    if download is None:
+        download = download_source_pdf(invoice)
+
+    pool = get_io_pool()
+    storage = get_supabase().storage.from_('invoices')
+    pdf_path = f"facturx_{invoice_id}.pdf"
+    xml_path = f"facturx_{invoice_id}.xml"
+
+    # The invoice model is built while the PDF downloads
+    invoice_model = normalize_invoice(build_invoice_data(invoice), seller_info, invoice.get('clients') or {})
+    source_pdf = download.result()
+
+    facturx_hash = compute_facturx_hash(invoice_model, profile, source_pdf)
+    stored = None if force_render else find_stored_facturx(invoice, facturx_hash)
+    if stored:
+        pdf_url, xml_url = stored
+        return {
+            'invoice_id': invoice_id,
+            'pdf_url': pdf_url,
+            'xml_url': xml_url,
+            'validation_errors': [],
+            'facturx_hash': facturx_hash,
+            'cached': True,
         }
 
-        # Root element
-        root = etree.Element(
-            '{urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100}CrossIndustryInvoice',
-            nsmap=nsmap
-        )
+    # The XML is only serialized for invoices that are actually rebuilt
+    xml_bytes = FacturXGenerator.serialize(invoice_model, profile)
+    validation_errors = check_facturx_xml(xml_bytes, level=profile)
+    facturx_pdf = embed_facturx(source_pdf, xml_bytes, level=profile, check_xsd=False)
+
+    # Both uploads and both public URLs are independent
+    calls = [
+        pool.submit(storage.upload, pdf_path, facturx_pdf, file_options={"upsert": "true"}),
+        pool.submit(storage.upload, xml_path, xml_bytes, file_options={"upsert": "true"}),
+        pool.submit(storage.get_public_url, pdf_path),
+        pool.submit(storage.get_public_url, xml_path),
+    ]
+    _, _, pdf_url, xml_url = [call.result() for call in calls]
+
+    return {
+        'invoice_id': invoice_id,
+        'pdf_url': pdf_url,
+        'xml_url': xml_url,
+        'validation_errors': validation_errors,
+        # Files with validation errors (report mode) are not reused
+        'facturx_hash': None if validation_errors else facturx_hash,
+        'cached': False,
+    }
+
+
+def load_batch(invoice_ids, refresh_profiles=False):
+    """
+    Load the invoices (with their client) and the seller info of their distinct
+    owners in at most three queries; profiles cached at their current updated_at
+    are not read again.
+    Returns ({invoice_id: row}, {user_id: seller info}).
+    """
+    invoice_rows = get_supabase().table('invoices') \
+        .select('*, clients(*)') \
+        .in_('id', invoice_ids) \
+        .execute().data or []
+    invoices = {row['id']: row for row in invoice_rows}
+
+    user_ids = sorted({row['user_id'] for row in invoice_rows if row.get('user_id')})
+    profiles = {} if refresh_profiles or not user_ids else seller_profiles.get_many(get_profile_versions(user_ids))
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        profile_rows = get_supabase().table('profiles').select(SELLER_PROFILE_COLUMNS).in_('id', missing).execute().data or []
+        for row in profile_rows:
+            profiles[row['id']] = seller_profiles.put(row['id'], row)
+    return invoices, profiles
+
+
+def _batch_item(invoice, seller_info, profile, force_render):
+    try:
+        return {
+            'invoice_id': invoice['id'], 'success': True,
+            **generate_invoice_facturx(invoice, seller_info, profile, force_render),
+        }
+    except FacturXValidationError as e:
+        return {'invoice_id': invoice['id'], 'success': False, 'error': str(e), 'validation_errors': e.errors}
+    except Exception as e:
+        logger.warning(f"Factur-X generation failed for invoice {invoice['id']}: {e}")
+        return {'invoice_id': invoice['id'], 'success': False, 'error': str(e)}
+
+
+def mark_invoices_electronic(results):
+    """Record the Factur-X URLs and hash of the new successful results on their invoices in one call"""
+    updates = [
+        {
+            'id': result['invoice_id'],
+            'pdf_url': result['pdf_url'],
+            'facturx_xml_url': result['xml_url'],
+            'facturx_hash': result['facturx_hash'],
+        }
+        for result in results if result['success'] and not result['cached']
+    ]
+    if updates:
+        get_supabase().rpc('mark_invoices_facturx', {'p_updates': updates}).execute()
 
-        # Exchange Context
-        exchange_context = etree.SubElement(root, '{%s}ExchangedDocumentContext' % nsmap['rsm'])
-        guideline_context = etree.SubElement(exchange_context, '{%s}GuidelineSpecifiedDocumentContextParameter' % nsmap['ram'])
-        guideline_id = etree.SubElement(guideline_context, '{%s}ID' % nsmap['ram'])
-        guideline_id.text = 'urn:cen.eu:en16931:2017#compliant#urn:factur-x.eu:1p0:basic'
-
-        # Exchanged Document (Invoice Header)
-        exchanged_doc = etree.SubElement(root, '{%s}ExchangedDocument' % nsmap['rsm'])
-
-        doc_id = etree.SubElement(exchanged_doc, '{%s}ID' % nsmap['ram'])
-        doc_id.text = invoice_data.get('invoice_number', '')
-
-        doc_type = etree.SubElement(exchanged_doc, '{%s}TypeCode' % nsmap['ram'])
-        doc_type.text = '380'  # Commercial invoice
-
-        doc_issue_date = etree.SubElement(exchanged_doc, '{%s}IssueDateTime' % nsmap['ram'])
-        issue_date = etree.SubElement(doc_issue_date, '{%s}DateTimeString' % nsmap['udt'], format='102')
-        invoice_date = invoice_data.get('invoice_date', datetime.now().strftime('%Y-%m-%d'))
-        issue_date.text = invoice_date.replace('-', '')  # YYYYMMDD format
-
-        # Supply Chain Trade Transaction
-        transaction = etree.SubElement(root, '{%s}SupplyChainTradeTransaction' % nsmap['rsm'])
-
-        # Line items
-        line_items = invoice_data.get('line_items', [])
-        for idx, item in enumerate(line_items, 1):
-            line_item = etree.SubElement(transaction, '{%s}IncludedSupplyChainTradeLineItem' % nsmap['ram'])
-
-            # Line ID
-            line_doc = etree.SubElement(line_item, '{%s}AssociatedDocumentLineDocument' % nsmap['ram'])
-            line_id = etree.SubElement(line_doc, '{%s}LineID' % nsmap['ram'])
-            line_id.text = str(idx)
-
-            # Product description
-            product = etree.SubElement(line_item, '{%s}SpecifiedTradeProduct' % nsmap['ram'])
-            product_name = etree.SubElement(product, '{%s}Name' % nsmap['ram'])
-            product_name.text = item.get('description', '')
-
-            # Line settlement
-            line_settlement = etree.SubElement(line_item, '{%s}SpecifiedLineTradeSettlement' % nsmap['ram'])
-
-            # VAT
-            line_vat = etree.SubElement(line_settlement, '{%s}ApplicableTradeTax' % nsmap['ram'])
-            vat_type = etree.SubElement(line_vat, '{%s}TypeCode' % nsmap['ram'])
-            vat_type.text = 'VAT'
-            vat_category = etree.SubElement(line_vat, '{%s}CategoryCode' % nsmap['ram'])
-            vat_category.text = 'S'  # Standard rate
-            vat_percent = etree.SubElement(line_vat, '{%s}RateApplicablePercent' % nsmap['ram'])
-            vat_percent.text = str(item.get('vat_rate', 20.0))
-
-            # Line monetary summation
-            line_summation = etree.SubElement(line_settlement, '{%s}SpecifiedTradeSettlementLineMonetarySummation' % nsmap['ram'])
-            line_total = etree.SubElement(line_summation, '{%s}LineTotalAmount' % nsmap['ram'])
-            line_total.text = f"{item.get('line_total', 0):.2f}"
-
-            # Line delivery
-            line_delivery = etree.SubElement(line_item, '{%s}SpecifiedLineTradeDelivery' % nsmap['ram'])
-            billed_qty = etree.SubElement(line_delivery, '{%s}BilledQuantity' % nsmap['ram'], unitCode='C62')
-            billed_qty.text = str(item.get('quantity', 1))
-
-            # Line pricing
-            line_agreement = etree.SubElement(line_item, '{%s}SpecifiedLineTradeAgreement' % nsmap['ram'])
-            net_price = etree.SubElement(line_agreement, '{%s}NetPriceProductTradePrice' % nsmap['ram'])
-            charge_amount = etree.SubElement(net_price, '{%s}ChargeAmount' % nsmap['ram'])
-            charge_amount.text = f"{item.get('unit_price', 0):.2f}"
-
-        # Trade Agreement (Seller & Buyer)
-        agreement = etree.SubElement(transaction, '{%s}ApplicableHeaderTradeAgreement' % nsmap['ram'])
-
-        # Seller
-        seller_party = etree.SubElement(agreement, '{%s}SellerTradeParty' % nsmap['ram'])
-        seller_name_elem = etree.SubElement(seller_party, '{%s}Name' % nsmap['ram'])
-        seller_name_elem.text = seller_info.get('company_name', '')
-
-        if seller_info.get('siret'):
-            seller_id = etree.SubElement(seller_party, '{%s}ID' % nsmap['ram'])
-            seller_id.text = seller_info['siret']
-
-        seller_address = etree.SubElement(seller_party, '{%s}PostalTradeAddress' % nsmap['ram'])
-        seller_address_line = etree.SubElement(seller_address, '{%s}LineOne' % nsmap['ram'])
-        seller_address_line.text = seller_info.get('address', '')
-        seller_city = etree.SubElement(seller_address, '{%s}CityName' % nsmap['ram'])
-        seller_city.text = seller_info.get('city', '')
-        seller_postal = etree.SubElement(seller_address, '{%s}PostcodeCode' % nsmap['ram'])
-        seller_postal.text = seller_info.get('postal_code', '')
-        seller_country = etree.SubElement(seller_address, '{%s}CountryID' % nsmap['ram'])
-        seller_country.text = 'FR'
-
-        # Seller VAT ID
-        if seller_info.get('vat_number'):
-            seller_vat = etree.SubElement(seller_party, '{%s}SpecifiedTaxRegistration' % nsmap['ram'])
-            seller_vat_id = etree.SubElement(seller_vat, '{%s}ID' % nsmap['ram'], schemeID='VA')
-            seller_vat_id.text = seller_info['vat_number']
-
-        # Buyer
-        buyer_party = etree.SubElement(agreement, '{%s}BuyerTradeParty' % nsmap['ram'])
-        buyer_name_elem = etree.SubElement(buyer_party, '{%s}Name' % nsmap['ram'])
-        buyer_name_elem.text = buyer_info.get('name', '')
-
-        buyer_address = etree.SubElement(buyer_party, '{%s}PostalTradeAddress' % nsmap['ram'])
-        buyer_address_line = etree.SubElement(buyer_address, '{%s}LineOne' % nsmap['ram'])
-        buyer_address_line.text = buyer_info.get('address', '')
-        buyer_city = etree.SubElement(buyer_address, '{%s}CityName' % nsmap['ram'])
-        buyer_city.text = buyer_info.get('city', '')
-        buyer_postal = etree.SubElement(buyer_address, '{%s}PostcodeCode' % nsmap['ram'])
-        buyer_postal.text = buyer_info.get('postal_code', '')
-        buyer_country = etree.SubElement(buyer_address, '{%s}CountryID' % nsmap['ram'])
-        buyer_country.text = 'FR'
-
-        # Trade Delivery
-        delivery = etree.SubElement(transaction, '{%s}ApplicableHeaderTradeDelivery' % nsmap['ram'])
-
-        # Trade Settlement (Payment terms, totals)
-        settlement = etree.SubElement(transaction, '{%s}ApplicableHeaderTradeSettlement' % nsmap['ram'])
-
-        # Currency
-        currency = etree.SubElement(settlement, '{%s}InvoiceCurrencyCode' % nsmap['ram'])
-        currency.text = 'EUR'
-
-        # Payment means
-        payment_means = etree.SubElement(settlement, '{%s}SpecifiedTradeSettlementPaymentMeans' % nsmap['ram'])
-        payment_type = etree.SubElement(payment_means, '{%s}TypeCode' % nsmap['ram'])
-        payment_type.text = '30'  # Credit transfer
-
-        # Payment terms
-        payment_terms = invoice_data.get('payment_terms', '30')
-        payment_terms_elem = etree.SubElement(settlement, '{%s}SpecifiedTradePaymentTerms' % nsmap['ram'])
-        payment_desc = etree.SubElement(payment_terms_elem, '{%s}Description' % nsmap['ram'])
-        payment_desc.text = f'Paiement à {payment_terms} jours'
-
-        # Due date
-        if invoice_data.get('due_date'):
-            payment_due = etree.SubElement(payment_terms_elem, '{%s}DueDateDateTime' % nsmap['ram'])
-            due_date_str = etree.SubElement(payment_due, '{%s}DateTimeString' % nsmap['udt'], format='102')
-            due_date_str.text = invoice_data['due_date'].replace('-', '')
-
-        # VAT breakdown
-        tax_total = etree.SubElement(settlement, '{%s}ApplicableTradeTax' % nsmap['ram'])
-        tax_amount = etree.SubElement(tax_total, '{%s}CalculatedAmount' % nsmap['ram'])
-        tax_amount.text = f"{invoice_data.get('total_vat', 0):.2f}"
-        tax_type = etree.SubElement(tax_total, '{%s}TypeCode' % nsmap['ram'])
-        tax_type.text = 'VAT'
-        tax_basis = etree.SubElement(tax_total, '{%s}BasisAmount' % nsmap['ram'])
-        tax_basis.text = f"{invoice_data.get('subtotal_ht', 0):.2f}"
-        tax_category = etree.SubElement(tax_total, '{%s}CategoryCode' % nsmap['ram'])
-        tax_category.text = 'S'
-        tax_percent = etree.SubElement(tax_total, '{%s}RateApplicablePercent' % nsmap['ram'])
-        tax_percent.text = '20.0'
-
-        # Monetary summation
-        monetary_summation = etree.SubElement(settlement, '{%s}SpecifiedTradeSettlementHeaderMonetarySummation' % nsmap['ram'])
-
-        line_total_amount = etree.SubElement(monetary_summation, '{%s}LineTotalAmount' % nsmap['ram'])
-        line_total_amount.text = f"{invoice_data.get('subtotal_ht', 0):.2f}"
-
-        tax_basis_total = etree.SubElement(monetary_summation, '{%s}TaxBasisTotalAmount' % nsmap['ram'])
-        tax_basis_total.text = f"{invoice_data.get('subtotal_ht', 0):.2f}"
-
-        tax_total_amount = etree.SubElement(monetary_summation, '{%s}TaxTotalAmount' % nsmap['ram'], currencyID='EUR')
-        tax_total_amount.text = f"{invoice_data.get('total_vat', 0):.2f}"
-
-        grand_total = etree.SubElement(monetary_summation, '{%s}GrandTotalAmount' % nsmap['ram'])
-        grand_total.text = f"{invoice_data.get('total_ttc', 0):.2f}"
-
-        due_payable = etree.SubElement(monetary_summation, '{%s}DuePayableAmount' % nsmap['ram'])
-        due_payable.text = f"{invoice_data.get('balance_due', invoice_data.get('total_ttc', 0)):.2f}"
-
-        # Generate XML bytes
-        xml_bytes = etree.tostring(
-            root,
-            pretty_print=True,
-            xml_declaration=True,
-            encoding='UTF-8'
-        )
 
-        return xml_bytes
+@functions_framework.http
+def generate_facturx_batch(request):
+    """
+    Generate Factur-X PDFs for several invoices.
+    Payload: {"invoice_ids": [...], "profile": "basic", "refresh_profile": false, "force_render": false}.
+    Returns one result per invoice, in request order; unchanged invoices are 'cached'.
+    """
+    request_json = request.get_json(silent=True) or {}
+    invoice_ids = request_json.get('invoice_ids')
+    profile = get_profile(request_json)
+
+    if not invoice_ids or not isinstance(invoice_ids, list):
+        return {'success': False, 'error': "Missing 'invoice_ids' list"}, 400
+    if profile is None:
+        return {'success': False, 'error': f"Unknown profile, expected one of {', '.join(PROFILES)}"}, 400
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    if len(invoice_ids) > FACTURX_BATCH_MAX:
+        return {'success': False, 'error': f"Too many invoices in batch ({len(invoice_ids)} > {FACTURX_BATCH_MAX})"}, 400
+
+    try:
+        invoices, profiles = load_batch(invoice_ids, bool(request_json.get('refresh_profile')))
+
+        # Invoices that cannot be generated fail here; the others run in parallel
+        results = {}
+        futures = {}
+        for invoice_id in invoice_ids:
+            invoice = invoices.get(invoice_id)
+            if invoice is None:
+                results[invoice_id] = {'invoice_id': invoice_id, 'success': False, 'error': 'Invoice not found.'}
+            elif invoice.get('user_id') not in profiles:
+                results[invoice_id] = {'invoice_id': invoice_id, 'success': False, 'error': 'User profile not found.'}
+            else:
+                futures[invoice_id] = get_batch_pool().submit(
+                    _batch_item, invoice, profiles[invoice['user_id']], profile, bool(request_json.get('force_render'))
+                )
+        for invoice_id, future in futures.items():
+            results[invoice_id] = future.result()
+        results = [results[invoice_id] for invoice_id in invoice_ids]
+
+        try:
+            mark_invoices_electronic(results)
+        except Exception as e:
+            # Files are stored, but the invoices still point to their plain PDF
+            logger.error(f"Bulk invoice update failed: {e}")
+            for result in results:
+                if result['success'] and not result['cached']:
+                    result.update(success=False, error=f"Factur-X stored but invoice update failed: {e}")
+
+        failed = sum(1 for result in results if not result['success'])
+        logger.info(f"Factur-X batch: {len(results) - failed} succeeded, {failed} failed")
+
+        return {
+            'success': failed == 0,
+            'total': len(results),
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'facturx_level': profile,
+            'results': results,
+        }, 200
+
+    except Exception as e:
+        logger.error(f"Factur-X batch failed: {e}", exc_info=True)
+        return {'success': False, 'error': str(e)}, 500
 
 
 @functions_framework.http
 def generate_facturx(request):
-    """Generate Factur-X compliant invoice PDF with embedded XML"""
+    """
+    Generate Factur-X compliant invoice PDF with embedded XML.
+    Payload: {"invoice_id": "...", "profile": "basic"} (minimum, basic, en16931 or extended).
+    "user_id" (the invoice owner, optional) lets the seller profile be read while the invoice
+    is fetched; it is only used if it matches the invoice's user_id.
+    "refresh_profile": true rereads the seller profile instead of using the cached one.
+    When nothing changed since the last generation (same facturx_hash), the stored files
+    are returned as they are ("cached": true); "force_render": true regenerates them.
+    """
     request_json = request.get_json(silent=True)
     invoice_id = request_json.get('invoice_id')
+    profile = get_profile(request_json)
 
     if not invoice_id:
         return {'success': False, 'error': 'Missing invoice_id'}, 400
+    if profile is None:
+        return {'success': False, 'error': f"Unknown profile, expected one of {', '.join(PROFILES)}"}, 400
 
     try:
-        # 1. Fetch invoice data from Supabase
-        invoice_response = supabase.table('invoices').select('*, clients(*)').eq('id', invoice_id).single().execute()
-        if not invoice_response.data:
+        pool = get_io_pool()
+        refresh_profile = bool(request_json.get('refresh_profile'))
+        user_id = request_json.get('user_id')
+
+        # 1. Fetch the invoice data with its client, and the seller (user profile) info
+        # concurrently when the caller names the owner
+        seller_future = pool.submit(get_seller_info, user_id, refresh_profile) if user_id else None
+        invoice_data = get_supabase().table('invoices').select('*, clients(*)').eq('id', invoice_id).single().execute().data
+        if not invoice_data:
             raise Exception('Invoice not found.')
-        invoice_data = invoice_response.data
 
-        # 2. Fetch seller (user profile) info
-        user_id = invoice_data.get('user_id')
-        profile_response = supabase.table('profiles').select('*').eq('id', user_id).single().execute()
-        if not profile_response.data:
+        # 2. Otherwise the seller is looked up while the stored PDF downloads: the
+        # profile version check of a cached seller adds no round trip to the request
+        download = download_source_pdf(invoice_data)
+        if seller_future is None or invoice_data.get('user_id') != user_id:
+            seller_future = pool.submit(get_seller_info, invoice_data.get('user_id'), refresh_profile)
+        seller_info = seller_future.result()
+        if seller_info is None:
             raise Exception('User profile not found.')
-        seller_info = profile_response.data
-
-        # 3. Get buyer info
-        buyer_info = invoice_data.get('clients', {})
-
-        # 4. Parse line items
-        line_items = invoice_data.get('line_items', [])
-        if isinstance(line_items, str):
-            import json
-            line_items = json.loads(line_items)
-
-        invoice_data_dict = {
-            'invoice_number': invoice_data.get('invoice_number'),
-            'invoice_date': invoice_data.get('invoice_date', datetime.now().strftime('%Y-%m-%d')),
-            'due_date': invoice_data.get('due_date'),
-            'payment_terms': invoice_data.get('payment_terms', '30'),
-            'subtotal_ht': invoice_data.get('subtotal_ht', 0),
-            'total_vat': invoice_data.get('total_vat', 0),
-            'total_ttc': invoice_data.get('total_ttc', 0),
-            'balance_due': invoice_data.get('balance_due', invoice_data.get('total_ttc', 0)),
-            'line_items': line_items,
-        }
 
-        # 5. Generate EN16931 XML
-        generator = FacturXGenerator()
-        xml_bytes = generator.generate_en16931_xml(invoice_data_dict, seller_info, buyer_info)
-
-        # 6. Get existing PDF or generate one
-        existing_pdf_url = invoice_data.get('pdf_url')
-        if not existing_pdf_url:
-            raise Exception('Invoice PDF must be generated before creating Factur-X')
-
-        # Download existing PDF
-        pdf_response = supabase.storage.from_('invoices').download(f"{invoice_id}.pdf")
-        pdf_bytes = pdf_response
-
-        # 7. Embed XML into PDF using factur-x library
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as pdf_temp:
-            pdf_temp.write(pdf_bytes)
-            pdf_temp_path = pdf_temp.name
-
-        with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as xml_temp:
-            xml_temp.write(xml_bytes)
-            xml_temp_path = xml_temp.name
-
-        # Generate Factur-X PDF
-        facturx_pdf_path = f"/tmp/facturx_{invoice_id}.pdf"
-        generate_facturx_from_file(
-            pdf_temp_path,
-            xml_temp_path,
-            facturx_level='basic',
-            output_pdf_file=facturx_pdf_path
+        # 3. Build the XML, embed it into the stored PDF and upload both
+        stored = generate_invoice_facturx(
+            invoice_data, seller_info, profile, bool(request_json.get('force_render')), download
         )
-
-        # 8. Upload Factur-X PDF and XML to storage
-        with open(facturx_pdf_path, 'rb') as f:
-            supabase.storage.from_('invoices').upload(
-                f"facturx_{invoice_id}.pdf",
-                f,
-                file_options={"upsert": "true"}
-            )
-
-        with open(xml_temp_path, 'rb') as f:
-            supabase.storage.from_('invoices').upload(
-                f"facturx_{invoice_id}.xml",
-                f,
-                file_options={"upsert": "true"}
-            )
-
-        # 9. Update invoice with Factur-X URLs
-        facturx_pdf_url = supabase.storage.from_('invoices').get_public_url(f"facturx_{invoice_id}.pdf")
-        facturx_xml_url = supabase.storage.from_('invoices').get_public_url(f"facturx_{invoice_id}.xml")
-
-        supabase.table('invoices').update({
-            'pdf_url': facturx_pdf_url,
-            'facturx_xml_url': facturx_xml_url,
-            'is_electronic_invoice': True,
-        }).eq('id', invoice_id).execute()
-
-        # Cleanup temp files
-        os.unlink(pdf_temp_path)
-        os.unlink(xml_temp_path)
-        os.unlink(facturx_pdf_path)
+        facturx_pdf_url = stored['pdf_url']
+        facturx_xml_url = stored['xml_url']
+
+        # 4. Update invoice with Factur-X URLs and the hash they were built from
+        if not stored['cached']:
+            get_supabase().table('invoices').update({
+                'pdf_url': facturx_pdf_url,
+                'facturx_xml_url': facturx_xml_url,
+                'facturx_hash': stored['facturx_hash'],
+                'is_electronic_invoice': True,
+            }).eq('id', invoice_id).execute()
 
         return {
             'success': True,
             'pdf_url': facturx_pdf_url,
             'xml_url': facturx_xml_url,
-            'facturx_level': 'basic'
+            'facturx_level': profile,
+            'validation_errors': stored['validation_errors'],
+            'cached': stored['cached'],
         }, 200
 
+    except FacturXValidationError as e:
+        return {'success': False, 'error': str(e), 'validation_errors': e.errors}, 422
+
     except Exception as e:
         return {'success': False, 'error': str(e)}, 500
@@ -0,0 +1,79 @@
+"""
+Process-level cache of seller profiles for Factur-X generation.
+
+Only the profile columns the XML builder reads are selected
+(SELLER_PROFILE_COLUMNS), and the resulting seller info is kept per user for
+SELLER_PROFILE_TTL_SECONDS together with the profile's updated_at. Lookups
+pass the current updated_at (read with a query on id and updated_at only), so
+an edited SIRET, VAT number or address is never served from the cache: the
+entry no longer matches and the full profile is read again.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+SELLER_PROFILE_TTL_SECONDS = int(os.environ.get("SELLER_PROFILE_TTL_SECONDS", "300"))
+SELLER_PROFILE_CACHE_MAX_ENTRIES = int(os.environ.get("SELLER_PROFILE_CACHE_MAX_ENTRIES", "1024"))
+
+# The app writes the VAT number to vat_number; tva_number comes from an older migration
+SELLER_PROFILE_COLUMNS = 'id, updated_at, company_name, siret, vat_number, tva_number, address, postal_code, city'
+
+
+def seller_info_from_profile(row):
+    """Seller info expected by FacturXGenerator, from a profiles row"""
+    return {
+        'company_name': row.get('company_name'),
+        'siret': row.get('siret'),
+        'vat_number': row.get('vat_number') or row.get('tva_number'),
+        'address': row.get('address'),
+        'postal_code': row.get('postal_code'),
+        'city': row.get('city'),
+    }
+
+
+class SellerProfileCache:
+    """LRU of seller info keyed by user id, with entries expiring after `ttl` seconds"""
+
+    def __init__(self, ttl=SELLER_PROFILE_TTL_SECONDS, max_entries=SELLER_PROFILE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, updated_at):
+        """Return the cached seller info of `user_id`, or None if missing, expired or outdated"""
+        return self.get_many({user_id: updated_at}).get(user_id)
+
+    def get_many(self, versions):
+        """
+        Return {user_id: seller info} for the users of `versions` ({user_id: profile
+        updated_at}) whose entry is fresh and was cached from that profile version
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for user_id, updated_at in versions.items():
+                entry = self._entries.get(user_id)
+                if entry is None:
+                    continue
+                seller_info, cached_updated_at, stored_at = entry
+                if now - stored_at >= self.ttl or cached_updated_at != updated_at:
+                    del self._entries[user_id]
+                    continue
+                self._entries.move_to_end(user_id)
+                found[user_id] = seller_info
+        return found
+
+    def put(self, user_id, row):
+        """Cache the seller info of a profiles row and return it"""
+        seller_info = seller_info_from_profile(row)
+        with self._lock:
+            self._entries[user_id] = (seller_info, row.get('updated_at'), time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return seller_info
+
+
+seller_profiles = SellerProfileCache()
@@ -0,0 +1,125 @@
+"""
+Import-time report for the Cloud Functions in this directory.
+
+For every function (a sub-directory with a main.py) this imports main in a
+fresh interpreter with `python -X importtime` and reports how long the import
+took, plus the slowest modules it pulled in. functions_framework and flask are
+imported first, as the runtime loads them before main, so they are not
+charged to the function. Each function is measured `--runs` times and the
+fastest run is kept.
+
+Exits with status 1 when a function exceeds its cold-start budget or fails
+to import. Functions whose dependencies are not installed locally are
+reported as skipped.
+
+Usage:
+    python import_report.py
+    python import_report.py invoice_generator ocr_processor --top 10
+    python import_report.py --budget-ms 150
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Import budget of main.py in milliseconds; BUDGETS_MS holds per-function overrides
+DEFAULT_BUDGET_MS = 200
+BUDGETS_MS = {}
+
+PRELOAD = "import functions_framework, flask"
+
+
+def discover_functions():
+    return sorted(
+        name for name in os.listdir(FUNCTIONS_DIR)
+        if name != 'shared' and os.path.isfile(os.path.join(FUNCTIONS_DIR, name, 'main.py'))
+    )
+
+
+def parse_importtime(stderr):
+    """
+    Return (main cumulative µs, [(cumulative µs, module)] of main's direct imports)
+    from `python -X importtime` output, or (None, []) if main was not imported
+    """
+    subtree = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        cumulative_us = int(cumulative_us)
+        # Nesting is shown as two extra spaces of indentation per level
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        module = name.strip()
+
+        if depth == 0:
+            if module == 'main':
+                children = [(us, child) for child_depth, us, child in subtree if child_depth == 1]
+                return cumulative_us, sorted(children, reverse=True)
+            subtree = []
+        else:
+            subtree.append((depth, cumulative_us, module))
+    return None, []
+
+
+def measure(function_name, runs):
+    """Return (status, main import ms, slowest direct imports, error line)"""
+    best = None
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"{PRELOAD}\nimport main"],
+            cwd=os.path.join(FUNCTIONS_DIR, function_name),
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'unknown error'
+            status = 'skipped' if error.startswith('ModuleNotFoundError') else 'failed'
+            return status, None, [], error
+
+        total_us, children = parse_importtime(process.stderr)
+        if best is None or total_us < best[0]:
+            best = (total_us, children)
+
+    total_us, children = best
+    return 'ok', total_us / 1000, [(us / 1000, module) for us, module in children], None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('functions', nargs='*', help='functions to measure (default: all)')
+    parser.add_argument('--runs', type=int, default=3, help='imports per function, the fastest is kept')
+    parser.add_argument('--top', type=int, default=5, help='slowest direct imports to list per function')
+    parser.add_argument('--budget-ms', type=float, default=None, help='override every function budget')
+    args = parser.parse_args()
+
+    functions = args.functions or discover_functions()
+    failures = []
+
+    for function_name in functions:
+        budget = args.budget_ms if args.budget_ms is not None else BUDGETS_MS.get(function_name, DEFAULT_BUDGET_MS)
+        status, total_ms, children, error = measure(function_name, args.runs)
+
+        if status != 'ok':
+            print(f"{function_name:<28} {status}: {error}")
+            if status == 'failed':
+                failures.append(function_name)
+            continue
+
+        over = total_ms > budget
+        verdict = 'OVER BUDGET' if over else 'ok'
+        print(f"{function_name:<28} {total_ms:>8.1f} ms  (budget {budget:.0f} ms)  {verdict}")
+        for child_ms, module in children[:args.top]:
+            print(f"{'':<30}{child_ms:>8.1f} ms  {module}")
+        if over:
+            failures.append(function_name)
+
+    if failures:
+        print(f"{len(failures)} function(s) over budget or failing: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Rendering benchmark for FrenchInvoicePDFGenerator.
+
+Renders synthetic invoices with a growing number of line items and reports
+wall time, peak RSS and PDF size for each rendering variant: the platypus
+engine with a single table ("table") or page-by-page tables ("chunked"), and
+the direct-canvas engine ("canvas"). Every case runs in a fresh process so
+peak RSS belongs to that render alone.
+
+With --stages, each case is rendered --repeat times and the p50/p90/p99 of
+every pipeline stage (logo, line_items, build, canvas...) are printed from the
+timing module's aggregates, the same figures an instance collects in production.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --lines 10,1000,10000 --variants table,chunked,canvas
+    python benchmark.py --lines 100 --variants canvas --repeat 20 --stages
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+# Variant name -> invoice fields selecting the engine and line item layout
+VARIANTS = {
+    'table': {'engine': 'platypus', 'render_mode': 'table'},
+    'chunked': {'engine': 'platypus', 'render_mode': 'chunked'},
+    'canvas': {'engine': 'canvas'},
+}
+
+
+def make_invoice(line_count, variant):
+    """Build a synthetic invoice with `line_count` line items"""
+    vat_rates = [20, 10, 5.5]
+    return {
+        **VARIANTS[variant],
+        'document_type': 'FACTURE',
+        'invoice_number': f'BENCH-{line_count}',
+        'invoice_date': '2025-11-05',
+        'due_date': '2025-12-05',
+        'company': {'name': 'Plomberie Benchmark', 'city': 'Paris', 'siret': '123 456 789 00012'},
+        'client': {'name': 'Client Benchmark', 'city': 'Lyon'},
+        'line_items': [
+            {
+                'description': f'Fourniture raccord laiton réf. {i:06d}',
+                'quantity': i % 7 + 1,
+                'unit_price_ht': 3.5 + (i % 13),
+                'vat_rate': vat_rates[i % len(vat_rates)],
+            }
+            for i in range(line_count)
+        ],
+    }
+
+
+def _run_case(line_count, variant, repeat, queue):
+    import timing
+    import pdf_generator
+
+    invoice = make_invoice(line_count, variant)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timing.reset()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with timing.request_timer():
+            pdf_bytes = pdf_generator.FrenchInvoicePDFGenerator(invoice).generate()
+    elapsed = (time.perf_counter() - start) / repeat
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        'lines': line_count,
+        'variant': variant,
+        'seconds': elapsed,
+        'peak_rss_mb': peak_kb / 1024,
+        'render_rss_mb': (peak_kb - baseline_kb) / 1024,
+        'pdf_kb': len(pdf_bytes) / 1024,
+        'stages': timing.percentiles(),
+    })
+
+
+def run_case(line_count, variant, repeat=1):
+    """Render one case `repeat` times in a child process and return its measurements (time is per render)"""
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case, args=(line_count, variant, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', default='10,1000,10000', help='comma separated line item counts')
+    parser.add_argument('--variants', default='table,chunked,canvas', help='comma separated variants: ' + ','.join(VARIANTS))
+    parser.add_argument('--repeat', type=int, default=1, help='renders per case, time is averaged')
+    parser.add_argument('--stages', action='store_true', help='print per-stage p50/p90/p99 of each case')
+    args = parser.parse_args()
+
+    line_counts = [int(value) for value in args.lines.split(',')]
+    variants = args.variants.split(',')
+    unknown = [variant for variant in variants if variant not in VARIANTS]
+    if unknown:
+        parser.error(f"unknown variants: {', '.join(unknown)}")
+
+    print(f"{'lines':>7} {'variant':>8} {'time (s)':>9} {'peak RSS':>9} {'render RSS':>11} {'PDF (KB)':>9}")
+    for line_count in line_counts:
+        for variant in variants:
+            r = run_case(line_count, variant, args.repeat)
+            print(f"{r['lines']:>7} {r['variant']:>8} {r['seconds']:>9.3f} "
+                  f"{r['peak_rss_mb']:>7.1f}MB {r['render_rss_mb']:>9.1f}MB {r['pdf_kb']:>9.1f}")
+            if args.stages:
+                for name, p in r['stages'].items():
+                    print(f"{'':>17} {name:<12} p50 {p['p50']:>8.1f} ms  p90 {p['p90']:>8.1f} ms  "
+                          f"p99 {p['p99']:>8.1f} ms  (n={p['count']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+"""
+Direct-canvas renderer for the standard invoice layout.
+
+Draws the same blocks as the platypus path (company header, client and
+invoice details boxes, line items, VAT breakdown, totals, payment
+instructions and legal footer) straight onto a reportlab canvas. All
+coordinates are fixed in advance, so there are no flowables and no table
+wrap/split passes. Line items are drawn one row at a time, and the running
+subtotal is carried from page to page like the chunked platypus table.
+
+Content that does not fit the fixed layout raises CanvasOverflow, for
+example a description taller than a page or a header taller than its area.
+The generator then renders that invoice with platypus instead.
+"""
+import io
+import logging
+from decimal import Decimal
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+from static_blocks import LEGAL_DESCENT
+from theme import ROW_ALT_COLOR
+
+logger = logging.getLogger(__name__)
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 2*cm
+LEFT = MARGIN
+RIGHT = PAGE_WIDTH - MARGIN
+TOP = PAGE_HEIGHT - MARGIN
+BOTTOM = MARGIN
+CONTENT_WIDTH = RIGHT - LEFT
+
+FONT = 'Helvetica'
+FONT_BOLD = 'Helvetica-Bold'
+GRID_COLOR = colors.grey
+ALT_ROW_COLOR = colors.HexColor(ROW_ALT_COLOR)
+
+# Header: cached company block on the left, document title on the right
+HEADER_LEFT_WIDTH = 10*cm
+HEADER_MAX_HEIGHT = 8*cm
+TITLE_SIZE, TITLE_LEADING = 20, 24
+TEXT_SIZE, TEXT_LEADING = 10, 12
+
+# Client / invoice details boxes
+BOX_WIDTH = CONTENT_WIDTH / 2
+BOX_PADDING = 8
+BOX_MAX_HEIGHT = 8*cm
+
+# Line items table, scaled to the content width
+LINE_ITEMS_COL_WIDTHS = (7.5*cm, 1.6*cm, 2.8*cm, 1.6*cm, 3.5*cm)
+LINE_ITEMS_COL_X = tuple(LEFT + sum(LINE_ITEMS_COL_WIDTHS[:i]) for i in range(len(LINE_ITEMS_COL_WIDTHS) + 1))
+LINE_ITEMS_HEADERS = ('Désignation', 'Qté', 'P.U. HT', 'TVA', 'Total HT')
+CELL_PADDING = 5
+ROW_SIZE, ROW_LEADING = 9, 11
+HEADER_ROW_HEIGHT = 23
+SUBTOTAL_ROW_HEIGHT = ROW_LEADING + 2*CELL_PADDING
+DESCRIPTION_WIDTH = LINE_ITEMS_COL_WIDTHS[0] - 2*CELL_PADDING
+
+# VAT breakdown and totals
+VAT_COL_WIDTHS = (3*cm, 4*cm, 4*cm)
+VAT_ROW_HEIGHT = 17
+TOTALS_LABEL_RIGHT = RIGHT - 4*cm - 6
+TOTALS_VALUE_RIGHT = RIGHT - 6
+TOTALS_ROW_HEIGHT = 16
+GRAND_TOTAL_ROW_HEIGHT = 28
+
+# Gap between the body and the legal footer drawn at the bottom of every page
+FOOTER_GAP = 0.5*cm
+
+
+class CanvasOverflow(Exception):
+    """Raised when content does not fit the fixed canvas layout"""
+
+
+class CanvasInvoiceRenderer:
+    """Draws a FrenchInvoicePDFGenerator's invoice directly on a canvas"""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.data = generator.data
+        self.brand_color = generator.theme.brand_color
+        self.canv = None
+        self.y = TOP
+        self.table_top = TOP
+        self.items_top = TOP
+        self.footer = generator.legal_block()
+        self.body_bottom = BOTTOM - LEGAL_DESCENT + self.footer.height + FOOTER_GAP
+
+    def render(self):
+        """Return the PDF bytes; raises CanvasOverflow before anything is written"""
+        buffer = io.BytesIO()
+        self.render_to(buffer)
+        return buffer.getvalue()
+
+    def render_to(self, buffer):
+        """Write the PDF into `buffer`; on CanvasOverflow nothing has been written to it"""
+        self.canv = canvas.Canvas(buffer, pagesize=A4)
+
+        self.draw_header()
+        self.draw_info_boxes()
+        self.draw_line_items()
+        self.draw_vat_breakdown()
+        self.draw_totals()
+        self.draw_payment_instructions()
+        self.draw_footer()
+
+        self.canv.save()
+
+    # Page handling
+
+    def new_page(self):
+        self.draw_footer()
+        self.canv.showPage()
+        self.y = TOP
+
+    def ensure_space(self, height):
+        """Start a new page unless `height` points fit above the footer"""
+        if self.y - height >= self.body_bottom:
+            return
+        if TOP - height < self.body_bottom:
+            raise CanvasOverflow(f"block of {height:.0f}pt does not fit on a page")
+        self.new_page()
+
+    def draw_footer(self):
+        # Every page references the same Form XObject
+        self.footer.draw_on(self.canv, (PAGE_WIDTH - self.footer.width) / 2, BOTTOM - LEGAL_DESCENT)
+
+    # Text helpers
+
+    def draw_text(self, x, y, text, font=FONT, size=TEXT_SIZE, color=colors.black, align='left'):
+        canv = self.canv
+        canv.setFont(font, size)
+        canv.setFillColor(color)
+        if align == 'right':
+            canv.drawRightString(x, y, text)
+        elif align == 'center':
+            canv.drawCentredString(x, y, text)
+        else:
+            canv.drawString(x, y, text)
+
+    @staticmethod
+    def wrap_labelled(label, value, width):
+        """Split "label value" into lines of `width`; the bold label only starts the first line"""
+        label_width = stringWidth(label, FONT_BOLD, TEXT_SIZE) if label else 0
+        value_lines = simpleSplit(str(value), FONT, TEXT_SIZE, width - label_width) or ['']
+        return [(label, value_lines[0])] + [('', line) for line in value_lines[1:]]
+
+    def draw_labelled_lines(self, x, y, lines):
+        """Draw (label, value) lines from baseline `y` down; returns the baseline after the last line"""
+        for label, value in lines:
+            offset = 0
+            if label:
+                self.draw_text(x, y, label, FONT_BOLD)
+                offset = stringWidth(label, FONT_BOLD, TEXT_SIZE)
+            if value:
+                self.draw_text(x + offset, y, value)
+            y -= TEXT_LEADING
+        return y
+
+    # Blocks
+
+    def draw_header(self):
+        top = self.y
+
+        company_block = self.generator.company_block()
+        company_block.draw_on(self.canv, LEFT, top - company_block.height)
+        left_y = top - company_block.height
+
+        right_y = top
+        title_width = CONTENT_WIDTH - HEADER_LEFT_WIDTH
+        doc_type = self.data.get('document_type', 'FACTURE')
+        doc_number = self.data.get('invoice_number', 'FACT-0000')
+        for title_line in (doc_type, f"N° {doc_number}"):
+            for line in simpleSplit(str(title_line), FONT_BOLD, TITLE_SIZE, title_width):
+                right_y -= TITLE_LEADING
+                self.draw_text(RIGHT, right_y + 4, line, FONT_BOLD, TITLE_SIZE, self.brand_color, 'right')
+
+        bottom = min(left_y, right_y)
+        if top - bottom > HEADER_MAX_HEIGHT:
+            raise CanvasOverflow("header block too tall")
+        self.y = bottom - 0.5*cm
+
+    def draw_info_boxes(self):
+        client = self.data.get('client', {})
+        generator = self.generator
+        inner_width = BOX_WIDTH - 2*BOX_PADDING
+
+        client_lines = [('CLIENT', '')]
+        for value in (
+            client.get('name', 'Nom du client'),
+            client.get('address', ''),
+            f"{client.get('postal_code', '')} {client.get('city', '')}",
+            f"SIRET: {client.get('siret', 'N/A')}",
+        ):
+            client_lines.extend(self.wrap_labelled('', value, inner_width))
+
+        detail_lines = []
+        for label, value in (
+            ('Date: ', generator.format_date(self.data.get('invoice_date'))),
+            ("Date d'échéance: ", generator.format_date(self.data.get('due_date'))),
+            ('Conditions de paiement: ', self.data.get('payment_terms', 'Net 30 jours')),
+        ):
+            detail_lines.extend(self.wrap_labelled(label, value, inner_width))
+
+        height = max(len(client_lines), len(detail_lines)) * TEXT_LEADING + 2*BOX_PADDING
+        if height > BOX_MAX_HEIGHT:
+            raise CanvasOverflow("client / details boxes too tall")
+
+        canv = self.canv
+        canv.setStrokeColor(GRID_COLOR)
+        canv.setLineWidth(1)
+        canv.rect(LEFT, self.y - height, BOX_WIDTH, height)
+        canv.rect(LEFT + BOX_WIDTH, self.y - height, BOX_WIDTH, height)
+
+        baseline = self.y - BOX_PADDING - TEXT_SIZE
+        self.draw_labelled_lines(LEFT + BOX_PADDING, baseline, client_lines)
+        self.draw_labelled_lines(LEFT + BOX_WIDTH + BOX_PADDING, baseline, detail_lines)
+
+        self.y -= height + 1*cm
+
+    def draw_line_items(self):
+        line_items = self.data.get('line_items', [])
+
+        if not line_items:
+            self.ensure_space(TEXT_LEADING)
+            self.y -= TEXT_LEADING
+            self.draw_text(LEFT, self.y + 2, "Aucun article")
+            self.y -= 0.5*cm
+            return
+
+        self.ensure_space(HEADER_ROW_HEIGHT + SUBTOTAL_ROW_HEIGHT)
+        self.draw_items_header()
+
+        carried_total = Decimal(0)
+        rows_on_page = 0
+        last_index = len(line_items) - 1
+        for index in range(len(line_items)):
+            values, line_total = self.generator.line_item_values(index)
+            description_lines = simpleSplit(values[0], FONT, ROW_SIZE, DESCRIPTION_WIDTH) or ['']
+            height = len(description_lines) * ROW_LEADING + 2*CELL_PADDING
+
+            # Keep room for the "À reporter" row unless this is the last item
+            reserve = SUBTOTAL_ROW_HEIGHT if index < last_index else 0
+            if self.y - height - reserve < self.body_bottom:
+                if rows_on_page == 0:
+                    raise CanvasOverflow(f"line item {index} is taller than a page")
+                self.close_item_rows()
+                self.draw_subtotal_row('À reporter', carried_total)
+                self.close_table()
+                self.new_page()
+                self.draw_items_header()
+                self.draw_subtotal_row('Report', carried_total)
+                rows_on_page = 0
+                if self.y - height - reserve < self.body_bottom:
+                    raise CanvasOverflow(f"line item {index} is taller than a page")
+
+            if rows_on_page == 0:
+                self.items_top = self.y
+            self.draw_item_row(index, values, description_lines, height)
+            carried_total += line_total
+            rows_on_page += 1
+
+        self.close_item_rows()
+        self.close_table()
+        self.y -= 0.5*cm
+
+    def draw_items_header(self):
+        canv = self.canv
+        self.table_top = self.y
+        bottom = self.y - HEADER_ROW_HEIGHT
+        canv.setFillColor(self.brand_color)
+        canv.rect(LEFT, bottom, CONTENT_WIDTH, HEADER_ROW_HEIGHT, stroke=0, fill=1)
+        canv.setStrokeColor(GRID_COLOR)
+        canv.setLineWidth(0.5)
+        canv.lines([(x, bottom, x, self.y) for x in LINE_ITEMS_COL_X[1:-1]] + [(LEFT, bottom, RIGHT, bottom)])
+
+        baseline = bottom + 8 + 1
+        for i, title in enumerate(LINE_ITEMS_HEADERS):
+            center = (LINE_ITEMS_COL_X[i] + LINE_ITEMS_COL_X[i + 1]) / 2
+            self.draw_text(center, baseline, title, FONT_BOLD, TEXT_SIZE, colors.whitesmoke, 'center')
+        self.y = bottom
+
+    def draw_item_row(self, index, values, description_lines, height):
+        """Draw the row background, its bottom rule and its text; columns are ruled by close_item_rows()"""
+        canv = self.canv
+        bottom = self.y - height
+        if index % 2:
+            canv.setFillColor(ALT_ROW_COLOR)
+            canv.rect(LEFT, bottom, CONTENT_WIDTH, height, stroke=0, fill=1)
+        canv.line(LEFT, bottom, RIGHT, bottom)
+
+        text = canv.beginText()
+        text.setFont(FONT, ROW_SIZE)
+        text.setFillColor(colors.black)
+        baseline = self.y - CELL_PADDING - ROW_SIZE + 1
+        for line in description_lines:
+            text.setTextOrigin(LEFT + CELL_PADDING, baseline)
+            text.textOut(line)
+            baseline -= ROW_LEADING
+
+        middle = bottom + height / 2 - ROW_SIZE * 0.35
+        col_x = LINE_ITEMS_COL_X
+        quantity_width = stringWidth(values[1], FONT, ROW_SIZE)
+        text.setTextOrigin((col_x[1] + col_x[2] - quantity_width) / 2, middle)
+        text.textOut(values[1])
+        for column in (2, 3, 4):
+            value = values[column]
+            text.setTextOrigin(col_x[column + 1] - CELL_PADDING - stringWidth(value, FONT, ROW_SIZE), middle)
+            text.textOut(value)
+        canv.drawText(text)
+        self.y = bottom
+
+    def close_item_rows(self):
+        """Rule the inner columns of the item rows drawn on this page"""
+        self.canv.lines([(x, self.y, x, self.items_top) for x in LINE_ITEMS_COL_X[1:4]])
+
+    def close_table(self):
+        """Rule the outer edges and the total column of the table part on this page"""
+        self.canv.lines([(x, self.y, x, self.table_top) for x in (LEFT, LINE_ITEMS_COL_X[4], RIGHT)]
+                        + [(LEFT, self.table_top, RIGHT, self.table_top)])
+
+    def draw_subtotal_row(self, label, amount):
+        bottom = self.y - SUBTOTAL_ROW_HEIGHT
+        self.canv.line(LEFT, bottom, RIGHT, bottom)
+
+        middle = bottom + SUBTOTAL_ROW_HEIGHT / 2 - ROW_SIZE * 0.35
+        self.draw_text(LINE_ITEMS_COL_X[4] - CELL_PADDING, middle, label, FONT_BOLD, ROW_SIZE, align='right')
+        self.draw_text(RIGHT - CELL_PADDING, middle, self.generator.format_currency(amount),
+                       FONT_BOLD, ROW_SIZE, align='right')
+        self.y = bottom
+
+    def draw_vat_breakdown(self):
+        vat_rows = self.generator.vat_breakdown_rows()
+        if not vat_rows:
+            return
+
+        title_height = TEXT_LEADING + 0.3*cm
+        self.ensure_space(title_height + (len(vat_rows) + 1) * VAT_ROW_HEIGHT)
+        self.draw_text(LEFT, self.y - TEXT_SIZE, 'Détail de la TVA', FONT_BOLD)
+        self.y -= title_height
+
+        canv = self.canv
+        col_x = [LEFT + sum(VAT_COL_WIDTHS[:i]) for i in range(len(VAT_COL_WIDTHS) + 1)]
+        table_width = col_x[-1] - LEFT
+        canv.setStrokeColor(GRID_COLOR)
+        canv.setLineWidth(0.5)
+
+        for row_index, row in enumerate([('Taux TVA', 'Base HT', 'Montant TVA')] + vat_rows):
+            bottom = self.y - VAT_ROW_HEIGHT
+            if row_index == 0:
+                canv.setFillColor(ALT_ROW_COLOR)
+                canv.rect(LEFT, bottom, table_width, VAT_ROW_HEIGHT, stroke=1, fill=1)
+            else:
+                canv.rect(LEFT, bottom, table_width, VAT_ROW_HEIGHT)
+            for x in col_x[1:-1]:
+                canv.line(x, bottom, x, self.y)
+
+            font = FONT_BOLD if row_index == 0 else FONT
+            middle = bottom + VAT_ROW_HEIGHT / 2 - ROW_SIZE * 0.35
+            for i, value in enumerate(row):
+                self.draw_text((col_x[i] + col_x[i + 1]) / 2, middle, value, font, ROW_SIZE, align='center')
+            self.y = bottom
+
+        self.y -= 0.5*cm
+
+    def draw_totals(self):
+        format_currency = self.generator.format_currency
+        subtotal_ht, total_vat, total_ttc = self.generator.resolved_totals()
+
+        self.ensure_space(3 * TOTALS_ROW_HEIGHT + GRAND_TOTAL_ROW_HEIGHT)
+        for label, amount in (('Total HT', subtotal_ht), ('Total TVA', total_vat)):
+            self.y -= TOTALS_ROW_HEIGHT
+            self.draw_text(TOTALS_LABEL_RIGHT, self.y + 4, label, align='right')
+            self.draw_text(TOTALS_VALUE_RIGHT, self.y + 4, format_currency(amount), align='right')
+        self.y -= TOTALS_ROW_HEIGHT
+
+        canv = self.canv
+        canv.setStrokeColor(self.brand_color)
+        canv.setLineWidth(2)
+        canv.line(RIGHT - 9*cm, self.y, RIGHT, self.y)
+        self.y -= GRAND_TOTAL_ROW_HEIGHT
+        self.draw_text(TOTALS_LABEL_RIGHT, self.y + 4, 'TOTAL TTC', FONT_BOLD, 12, self.brand_color, 'right')
+        self.draw_text(TOTALS_VALUE_RIGHT, self.y + 4, format_currency(total_ttc), FONT_BOLD, 12, self.brand_color, 'right')
+
+        self.y -= 1*cm
+
+    def draw_payment_instructions(self):
+        payment_lines = self.generator.payment_lines()
+        if not payment_lines:
+            return
+
+        lines = []
+        for label, value in payment_lines:
+            lines.extend(self.wrap_labelled(label + ' ', value, CONTENT_WIDTH))
+
+        title_height = TEXT_LEADING + 0.3*cm
+        self.ensure_space(title_height + len(lines) * TEXT_LEADING)
+        self.draw_text(LEFT, self.y - TEXT_SIZE, 'MODALITÉS DE PAIEMENT', FONT_BOLD)
+        self.y -= title_height
+
+        self.draw_labelled_lines(LEFT, self.y - TEXT_SIZE, lines)
+        self.y -= len(lines) * TEXT_LEADING + 0.5*cm
@@ -0,0 +1,263 @@
+"""
+Accountant export: every invoice of a user over a date range, streamed as one
+ZIP archive or one merged PDF.
+
+Invoices are read page by page and their PDFs fetched by a small thread pool
+(stored PDFs are downloaded from their public URL, invoices without one are
+rendered). At most EXPORT_FETCH_WORKERS * 2 documents are held in memory at
+once, whatever the size of the export. ZIP entries are written in invoice
+order to an unseekable chunk writer and sent to the client as soon as each
+entry is complete. A manifest.csv listing every invoice and its status ends
+the archive, so a failed document does not abort the export.
+
+A merged PDF cannot be written incrementally (pypdf keeps the whole document
+until it is saved), so that format is capped at EXPORT_MERGED_MAX_DOCUMENTS.
+"""
+import io
+import os
+import csv
+import logging
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FETCH_WORKERS = int(os.environ.get("INVOICE_EXPORT_FETCH_WORKERS", "8"))
+EXPORT_PAGE_SIZE = int(os.environ.get("INVOICE_EXPORT_PAGE_SIZE", "200"))
+EXPORT_MERGED_MAX_DOCUMENTS = int(os.environ.get("INVOICE_EXPORT_MERGED_MAX_DOCUMENTS", "300"))
+EXPORT_DOWNLOAD_TIMEOUT = float(os.environ.get("INVOICE_EXPORT_DOWNLOAD_TIMEOUT", "30"))
+
+EXPORT_FORMATS = ('zip', 'pdf')
+
+INVOICE_COLUMNS = (
+    'id, invoice_number, invoice_date, due_date, payment_terms, pdf_url, line_items, '
+    'subtotal_ht, total_vat, total_ttc, clients(*)'
+)
+
+_fetch_pool = None
+_download_session = None
+
+
+class ExportTooLarge(Exception):
+    """The requested export exceeds the document cap of its format"""
+
+
+class ChunkWriter:
+    """Write-only, unseekable file object collecting what zipfile/pypdf write until drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return b''.join(chunks)
+
+
+def get_fetch_pool():
+    """Return the thread pool fetching export documents, creating it on first use"""
+    global _fetch_pool
+    if _fetch_pool is None:
+        _fetch_pool = ThreadPoolExecutor(max_workers=EXPORT_FETCH_WORKERS)
+    return _fetch_pool
+
+
+def get_download_session():
+    """Session for public PDF downloads; it carries no credentials since URLs come from table rows"""
+    global _download_session
+    if _download_session is None:
+        import requests
+        _download_session = requests.Session()
+    return _download_session
+
+
+def iter_invoices(supabase, user_id, start_date, end_date):
+    """Yield the user's invoices dated within [start_date, end_date], oldest first, one page at a time"""
+    offset = 0
+    while True:
+        response = supabase.table('invoices') \
+            .select(INVOICE_COLUMNS) \
+            .eq('user_id', user_id) \
+            .gte('invoice_date', start_date) \
+            .lte('invoice_date', end_date) \
+            .order('invoice_date') \
+            .order('invoice_number') \
+            .range(offset, offset + EXPORT_PAGE_SIZE - 1) \
+            .execute()
+        rows = response.data or []
+        yield from rows
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        offset += EXPORT_PAGE_SIZE
+
+
+def count_invoices(supabase, user_id, start_date, end_date):
+    response = supabase.table('invoices') \
+        .select('id', count='exact', head=True) \
+        .eq('user_id', user_id) \
+        .gte('invoice_date', start_date) \
+        .lte('invoice_date', end_date) \
+        .execute()
+    return response.count or 0
+
+
+def invoice_data_from_row(row, profile):
+    """Build the invoice_generator payload for an invoice row and its seller profile"""
+    client = row.get('clients') or {}
+    client_name = client.get('company_name') or ' '.join(
+        part for part in (client.get('first_name'), client.get('last_name')) if part
+    )
+    return {
+        'user_id': profile.get('id'),
+        'document_type': 'FACTURE',
+        'invoice_number': row.get('invoice_number') or '',
+        'invoice_date': row.get('invoice_date'),
+        'due_date': row.get('due_date'),
+        'payment_terms': row.get('payment_terms'),
+        'company': {
+            'name': profile.get('company_name') or '',
+            'address': profile.get('address') or '',
+            'postal_code': profile.get('postal_code') or '',
+            'city': profile.get('city') or '',
+            'phone': profile.get('phone') or '',
+            'email': profile.get('email') or '',
+            'siret': profile.get('siret'),
+            'vat_number': profile.get('tva_number') or profile.get('vat_number'),
+            'logo_url': profile.get('logo_url'),
+        },
+        'client': {
+            'name': client_name,
+            'address': client.get('billing_address') or client.get('address') or '',
+            'postal_code': client.get('billing_postal_code') or client.get('postal_code') or '',
+            'city': client.get('billing_city') or client.get('city') or '',
+            'siret': client.get('siret'),
+        },
+        # Rows written by the app use unit_price / tax_rate
+        'line_items': [
+            {
+                'description': item.get('description', ''),
+                'quantity': item.get('quantity', 0),
+                'unit_price_ht': item.get('unit_price_ht', item.get('unit_price', 0)),
+                'vat_rate': item.get('vat_rate', item.get('tax_rate', 20)),
+            }
+            for item in row.get('line_items') or []
+        ],
+        'payment_instructions': {'iban': profile.get('iban'), 'bic': profile.get('bic')} if profile.get('iban') else {},
+        'subtotal_ht': row.get('subtotal_ht'),
+        'total_vat': row.get('total_vat'),
+        'total_ttc': row.get('total_ttc'),
+    }
+
+
+def fetch_invoice_pdf(row, load_profile, render):
+    """Return the PDF bytes of an invoice: its stored PDF, or a fresh render when it has none"""
+    if row.get('pdf_url'):
+        response = get_download_session().get(row['pdf_url'], timeout=EXPORT_DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    return render(invoice_data_from_row(row, load_profile()))
+
+
+def iter_fetched(rows, load_profile, render):
+    """
+    Yield (row, PDF bytes or exception) in invoice order while keeping at most
+    EXPORT_FETCH_WORKERS * 2 fetches in flight
+    """
+    pool = get_fetch_pool()
+    in_flight = deque()
+    for row in rows:
+        in_flight.append((row, pool.submit(fetch_invoice_pdf, row, load_profile, render)))
+        if len(in_flight) >= EXPORT_FETCH_WORKERS * 2:
+            yield _result(*in_flight.popleft())
+    while in_flight:
+        yield _result(*in_flight.popleft())
+
+
+def _result(row, future):
+    try:
+        return row, future.result()
+    except Exception as e:
+        logger.warning(f"Export could not fetch invoice {row.get('invoice_number')}: {e}")
+        return row, e
+
+
+def entry_name(row):
+    number = (row.get('invoice_number') or row['id']).replace('/', '-')
+    return f"{row.get('invoice_date') or 'sans-date'}_{number}.pdf"
+
+
+def stream_zip(fetched):
+    """Yield a ZIP archive of the fetched PDFs, chunk by chunk, ending with manifest.csv"""
+    writer = ChunkWriter()
+    manifest = io.StringIO()
+    manifest_writer = csv.writer(manifest, delimiter=';')
+    manifest_writer.writerow(['invoice_number', 'invoice_date', 'total_ttc', 'file', 'error'])
+
+    # PDFs are already compressed, so entries are stored as is
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for row, pdf in fetched:
+            if isinstance(pdf, Exception):
+                manifest_writer.writerow([row.get('invoice_number'), row.get('invoice_date'), row.get('total_ttc'), '', str(pdf)])
+                continue
+            name = entry_name(row)
+            archive.writestr(name, pdf)
+            manifest_writer.writerow([row.get('invoice_number'), row.get('invoice_date'), row.get('total_ttc'), name, ''])
+            yield writer.drain()
+
+        archive.writestr('manifest.csv', manifest.getvalue().encode('utf-8-sig'), compress_type=zipfile.ZIP_DEFLATED)
+    yield writer.drain()
+
+
+def stream_merged_pdf(fetched):
+    """Yield one PDF made of the fetched PDFs in order; failed documents are skipped and logged"""
+    from pypdf import PdfReader, PdfWriter
+
+    merged = PdfWriter()
+    for row, pdf in fetched:
+        if isinstance(pdf, Exception):
+            continue
+        merged.append(PdfReader(io.BytesIO(pdf)))
+
+    writer = ChunkWriter()
+    merged.write(writer)
+    yield writer.drain()
+
+
+def stream_export(supabase, user_id, start_date, end_date, export_format, render):
+    """
+    Return a generator of the export bytes. Checks the document cap of the merged
+    PDF format before anything is streamed (raises ExportTooLarge).
+    """
+    if export_format == 'pdf':
+        count = count_invoices(supabase, user_id, start_date, end_date)
+        if count > EXPORT_MERGED_MAX_DOCUMENTS:
+            raise ExportTooLarge(
+                f"Too many invoices for a merged PDF ({count} > {EXPORT_MERGED_MAX_DOCUMENTS}), use the zip format"
+            )
+
+    profile = {}
+    profile_lock = threading.Lock()
+
+    def load_profile():
+        # Only invoices without a stored PDF need the seller profile; read it once
+        with profile_lock:
+            if not profile:
+                response = supabase.table('profiles').select('*').eq('id', user_id).single().execute()
+                profile.update(response.data or {'id': user_id})
+        return profile
+
+    fetched = iter_fetched(iter_invoices(supabase, user_id, start_date, end_date), load_profile, render)
+    return stream_zip(fetched) if export_format == 'zip' else stream_merged_pdf(fetched)
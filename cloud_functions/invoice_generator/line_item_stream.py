@@ -0,0 +1,145 @@
+"""
+Memory-bounded line item table for very large invoices.
+
+A single platypus Table holding thousands of rows keeps a Paragraph per row
+alive for the whole build and is split page after page, which makes layout
+super-linear. LineItemStream instead materialises one page worth of rows at a
+time: each split emits a page-sized Table (header repeated, running subtotal
+carried over from the previous page and "À reporter" on the last row) and a
+new LineItemStream for the remaining rows. Tables already drawn are dropped by
+the doc template, so layout memory is bounded by one page.
+
+Peak memory still grows with the line count, by about 1 KB per line instead
+of 6 KB for the single table. ReportLab keeps the content stream of every page
+(about 12 KB per page, 0.4 KB per line) until the document is saved, and the
+totals keep one Decimal per line. The canvas engine grows the same way. Each
+page is measured with a probe table before it is built, so below
+CHUNKED_LINE_ITEMS_THRESHOLD lines the single table is faster.
+"""
+from reportlab.platypus import Flowable, Table
+
+# Upper bound of rows materialised per page; must exceed what fits on one A4 page
+PAGE_WINDOW_ROWS = 50
+
+
+class LineItemStream(Flowable):
+    """Flowable that lays out line items `start` to `row_count - 1` one page-sized table at a time"""
+
+    def __init__(self, row_count, build_header, build_row, col_widths, table_style,
+                 format_subtotal, start=0, carried_total=0, window_hint=PAGE_WINDOW_ROWS):
+        """
+        build_header() -> header row cells
+        build_row(index) -> (row cells, line total HT)
+        format_subtotal(label, amount) -> cells of a running subtotal row
+        """
+        super().__init__()
+        self.row_count = row_count
+        self.build_header = build_header
+        self.build_row = build_row
+        self.col_widths = col_widths
+        self.table_style = table_style
+        self.format_subtotal = format_subtotal
+        self.start = start
+        self.carried_total = carried_total
+        self.window_hint = window_hint
+        self._table = None
+
+    def _build_table(self, rows, has_carry_row, has_subtotal_row):
+        table = Table(rows, colWidths=self.col_widths)
+        table.setStyle(self.table_style)
+
+        subtotal_rows = []
+        if has_carry_row:
+            subtotal_rows.append(1)
+        if has_subtotal_row:
+            subtotal_rows.append(len(rows) - 1)
+
+        for row in subtotal_rows:
+            table.setStyle([
+                ('SPAN', (0, row), (3, row)),
+                ('ALIGN', (0, row), (-1, row), 'RIGHT'),
+                ('FONTNAME', (0, row), (-1, row), 'Helvetica-Bold'),
+            ])
+        return table
+
+    def _page_rows(self, count):
+        """Build the header/carry rows plus `count` item rows starting at self.start"""
+        rows = [self.build_header()]
+        if self.start > 0:
+            rows.append(self.format_subtotal('Report', self.carried_total))
+
+        line_totals = []
+        for index in range(self.start, min(self.start + count, self.row_count)):
+            cells, line_total = self.build_row(index)
+            rows.append(cells)
+            line_totals.append(line_total)
+        return rows, line_totals
+
+    def _remaining(self):
+        return self.row_count - self.start
+
+    def wrap(self, availWidth, availHeight):
+        if self._remaining() > PAGE_WINDOW_ROWS:
+            # Too many rows to fit on any page: always go through split()
+            self._table = None
+            return availWidth, availHeight + 1
+
+        if self._table is None:
+            rows, _ = self._page_rows(self._remaining())
+            self._table = self._build_table(rows, self.start > 0, False)
+        self.width, self.height = self._table.wrap(availWidth, availHeight)
+        return self.width, self.height
+
+    def _measure(self, rows, availWidth, availHeight):
+        """Return row heights of `rows` followed by an "À reporter" row"""
+        probe = self._build_table(rows + [self.format_subtotal('À reporter', 0)], self.start > 0, True)
+        probe.wrap(availWidth, availHeight)
+        return probe._rowHeights
+
+    def split(self, availWidth, availHeight):
+        # Cheap check first: at the bottom of a page not even one row fits
+        rows, _ = self._page_rows(1)
+        if sum(self._measure(rows, availWidth, availHeight)) > availHeight:
+            return []
+
+        # Size the window from the previous page; widen it if every row fitted
+        window = min(self._remaining(), self.window_hint)
+        while True:
+            rows, line_totals = self._page_rows(window)
+            fixed_rows = len(rows) - window
+            heights = self._measure(rows, availWidth, availHeight)
+            budget = availHeight - heights[-1]
+
+            used = sum(heights[:fixed_rows])
+            fit = 0
+            for height in heights[fixed_rows:fixed_rows + window]:
+                if used + height > budget:
+                    break
+                used += height
+                fit += 1
+
+            if fit < window or window >= min(self._remaining(), PAGE_WINDOW_ROWS):
+                break
+            window = min(self._remaining(), PAGE_WINDOW_ROWS)
+
+        if fit == 0:
+            return []
+
+        page_rows = rows[:fixed_rows + fit]
+        if fit == self._remaining():
+            return [self._build_table(page_rows, self.start > 0, False)]
+
+        running_total = self.carried_total + sum(line_totals[:fit])
+        page_rows.append(self.format_subtotal('À reporter', running_total))
+        page_table = self._build_table(page_rows, self.start > 0, True)
+
+        rest = LineItemStream(
+            self.row_count, self.build_header, self.build_row, self.col_widths,
+            self.table_style, self.format_subtotal,
+            start=self.start + fit, carried_total=running_total, window_hint=fit + 2,
+        )
+        return [page_table, rest]
+
+    def draw(self):
+        self._table.drawOn(self.canv, 0, 0)
+        self._table = None
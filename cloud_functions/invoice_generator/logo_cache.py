@@ -0,0 +1,263 @@
+"""
+Content-addressed cache for company logos embedded in invoice PDFs.
+
+Logos are downloaded once, decoded and resized to the size they are drawn at,
+then kept as PNG bytes in an in-memory LRU and on local disk. Disk files are
+named after the SHA-256 of their content so identical logos are stored once.
+Within the TTL a cached logo is served without any network access; after it
+the URL is revalidated with ETag / Last-Modified and only re-downloaded if it
+changed. A failed revalidation keeps serving the cached copy.
+"""
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import requests
+from PIL import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+LOGO_CACHE_DIR = os.environ.get("LOGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "plombipro_logos"))
+LOGO_CACHE_MAX_ENTRIES = int(os.environ.get("LOGO_CACHE_MAX_ENTRIES", "64"))
+LOGO_CACHE_MAX_DISK_ENTRIES = int(os.environ.get("LOGO_CACHE_MAX_DISK_ENTRIES", "512"))
+LOGO_CACHE_TTL_SECONDS = int(os.environ.get("LOGO_CACHE_TTL_SECONDS", "3600"))
+LOGO_DOWNLOAD_TIMEOUT = 10
+
+# Logos are drawn in a 3cm x 2cm box; 360x240 px is ~300 dpi at that size
+LOGO_MAX_PIXELS = (360, 240)
+
+
+class LogoEntry:
+    """A decoded, resized logo and the validators needed to revalidate it"""
+
+    __slots__ = ('digest', 'data', 'etag', 'last_modified', 'checked_at')
+
+    def __init__(self, digest, data, etag=None, last_modified=None, checked_at=0.0):
+        self.digest = digest
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = checked_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.checked_at < ttl
+
+
+class LogoCache:
+    """Two-level (memory + disk) LRU cache of resized logo PNGs keyed by URL"""
+
+    def __init__(self, cache_dir=LOGO_CACHE_DIR, max_entries=LOGO_CACHE_MAX_ENTRIES,
+                 max_disk_entries=LOGO_CACHE_MAX_DISK_ENTRIES, ttl=LOGO_CACHE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Return the resized logo for `url` as PNG bytes, or None if it cannot be loaded"""
+        if not url:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+
+        if entry is None:
+            entry = self._load_from_disk(url)
+
+        if entry is not None and entry.is_fresh(self.ttl):
+            if url not in self._entries:
+                self._remember(url, entry)
+            return entry.data
+
+        entry = self._fetch(url, entry)
+        if entry is None:
+            return None
+
+        self._remember(url, entry)
+        return entry.data
+
+    def clear(self):
+        """Drop the in-memory entries (disk files are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, url, stale_entry):
+        """Download (or revalidate) a logo; falls back to the stale entry on network errors"""
+        headers = {}
+        if stale_entry is not None:
+            if stale_entry.etag:
+                headers['If-None-Match'] = stale_entry.etag
+            if stale_entry.last_modified:
+                headers['If-Modified-Since'] = stale_entry.last_modified
+
+        try:
+            response = requests.get(url, headers=headers, timeout=LOGO_DOWNLOAD_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Could not download logo: {e}")
+            return stale_entry
+
+        if response.status_code == 304 and stale_entry is not None:
+            stale_entry.checked_at = time.time()
+            self._write_index(url, stale_entry)
+            return stale_entry
+
+        if response.status_code != 200:
+            logger.warning(f"Could not download logo: HTTP {response.status_code}")
+            return stale_entry
+
+        data = self._resize(response.content)
+        if data is None:
+            return stale_entry
+
+        entry = LogoEntry(
+            digest=hashlib.sha256(data).hexdigest(),
+            data=data,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            checked_at=time.time(),
+        )
+        self._write_to_disk(url, entry)
+        return entry
+
+    @staticmethod
+    def _resize(content):
+        """Decode an image and shrink it to the drawn size, returning PNG bytes"""
+        try:
+            with PILImage.open(io.BytesIO(content)) as img:
+                img.load()
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA')
+                img.thumbnail(LOGO_MAX_PIXELS)
+                output = io.BytesIO()
+                img.save(output, format='PNG')
+                return output.getvalue()
+        except Exception as e:
+            logger.warning(f"Could not decode logo: {e}")
+            return None
+
+    def _index_path(self, url):
+        return os.path.join(self.cache_dir, 'index', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, digest + '.png')
+
+    def _load_from_disk(self, url):
+        index_path = self._index_path(url)
+        try:
+            with open(index_path, 'r') as f:
+                meta = json.load(f)
+            blob_path = self._blob_path(meta['digest'])
+            with open(blob_path, 'rb') as f:
+                data = f.read()
+            os.utime(blob_path)
+            os.utime(index_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        return LogoEntry(
+            digest=meta['digest'],
+            data=data,
+            etag=meta.get('etag'),
+            last_modified=meta.get('last_modified'),
+            checked_at=meta.get('checked_at', 0.0),
+        )
+
+    def _write_to_disk(self, url, entry):
+        try:
+            os.makedirs(os.path.join(self.cache_dir, 'index'), exist_ok=True)
+            blob_path = self._blob_path(entry.digest)
+            if not os.path.exists(blob_path):
+                self._atomic_write(blob_path, entry.data)
+            self._write_index(url, entry)
+            self._prune_disk()
+        except OSError as e:
+            logger.warning(f"Could not write logo cache: {e}")
+
+    def _write_index(self, url, entry):
+        meta = {
+            'url': url,
+            'digest': entry.digest,
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'checked_at': entry.checked_at,
+        }
+        try:
+            self._atomic_write(self._index_path(url), json.dumps(meta).encode('utf-8'))
+        except OSError as e:
+            logger.warning(f"Could not write logo cache index: {e}")
+
+    @staticmethod
+    def _atomic_write(path, data):
+        # Write then rename so concurrent renders never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _prune_disk(self):
+        """
+        Remove the least recently used logo files beyond the disk budget, then the
+        index entries of removed logos; the index is held to the same budget
+        """
+        self._prune_files(self.cache_dir, '.png')
+
+        index_dir = os.path.join(self.cache_dir, 'index')
+        for name in os.listdir(index_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(index_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    if os.path.exists(self._blob_path(json.load(f)['digest'])):
+                        continue
+            except (OSError, ValueError, KeyError):
+                pass
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+        self._prune_files(index_dir, '.json')
+
+    def _prune_files(self, directory, suffix):
+        """Remove the least recently used `suffix` files of `directory` beyond the disk budget"""
+        paths = [
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(suffix)
+        ]
+        if len(paths) <= self.max_disk_entries:
+            return
+
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+# Shared by every generator in this process (and, through the disk level, by batch workers)
+logo_cache = LogoCache()
@@ -1,443 +1,470 @@
 import os
-import io
-import tempfile
+import sys
+import json
+import base64
+import hashlib
+import time
+import uuid
+import threading
 import functions_framework
-from flask import Request, jsonify
-from datetime import datetime
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import cm, mm
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
-from reportlab.pdfgen import canvas
-from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from supabase import create_client, Client
-import requests
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timezone
+from flask import Request, Response, jsonify, stream_with_context
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from totals import compute_totals, compute_totals_batch
+from timing import request_timer, stage, add_bytes, log_timer
+from shared.facturx_validation import FacturXValidationError
+from shared.supabase_client import SUPABASE_KEY, SUPABASE_URL, get_supabase
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Storage uploads stream the render buffer straight to the Storage REST API
+STORAGE_UPLOAD_TIMEOUT = float(os.environ.get("INVOICE_STORAGE_UPLOAD_TIMEOUT", "60"))
+_storage_session = None
+
+# Content hash -> (filename, public URL) of PDFs already stored; existence is still checked on lookup
+RENDER_CACHE_MAX_ENTRIES = int(os.environ.get("INVOICE_RENDER_CACHE_MAX_ENTRIES", "1024"))
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+# Batch rendering configuration
+BATCH_MAX_INVOICES = int(os.environ.get("INVOICE_BATCH_MAX_INVOICES", "500"))
+RENDER_WORKERS = int(os.environ.get("INVOICE_RENDER_WORKERS", str(os.cpu_count() or 1)))
+UPLOAD_WORKERS = int(os.environ.get("INVOICE_UPLOAD_WORKERS", "8"))
+
+# Background render jobs (mode: "async"): the job row holds the payload and its id is
+# published to Pub/Sub, which triggers invoice_render_worker on its own instance
+RENDER_JOBS_TABLE = "invoice_render_jobs"
+RENDER_JOBS_TOPIC = os.environ.get("INVOICE_RENDER_JOBS_TOPIC")  # projects/<project>/topics/<topic>
+JOB_MAX_ATTEMPTS = int(os.environ.get("INVOICE_JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = float(os.environ.get("INVOICE_JOB_RETRY_BASE_DELAY", "1.0"))
+# Pending or running jobs not updated for this long are reported as failed
+JOB_TIMEOUT_SECONDS = int(os.environ.get("INVOICE_JOB_TIMEOUT_SECONDS", "600"))
+_publisher = None
+
+# Worker pools are created on the first batch request and reused while the instance is warm
+_render_pool = None
+_upload_pool = None
+
+
+def get_storage_session():
+    """Return the HTTP session used for storage uploads (keeps connections alive between requests)"""
+    global _storage_session
+    if _storage_session is None:
+        import requests
+        session = requests.Session()
+        session.headers.update({'Authorization': f"Bearer {SUPABASE_KEY}", 'apikey': SUPABASE_KEY})
+        _storage_session = session
+    return _storage_session
+
+
+def upload_to_storage(bucket, path, body, content_type):
+    """
+    Upload (upsert) an object through the Storage REST API. `body` may be bytes or a
+    binary buffer: buffers are rewound and sent in chunks, never copied as a whole.
+    """
+    if hasattr(body, 'seek'):
+        body.seek(0)
+    response = get_storage_session().post(
+        f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}",
+        data=body,
+        headers={'Content-Type': content_type, 'x-upsert': 'true'},
+        timeout=STORAGE_UPLOAD_TIMEOUT,
+    )
+    if not response.ok:
+        logger.error(f"Supabase upload error: {response.status_code} {response.text}")
+        raise Exception(f"Storage upload failed: {response.status_code} {response.text}")
+
+
+def compute_content_hash(invoice_data):
+    """
+    SHA-256 of the canonical JSON of invoice_data and the template version. The raw
+    payload is hashed: empty values and number formats change the rendered PDF.
+    """
+    from pdf_generator import TEMPLATE_VERSION
+
+    canonical = json.dumps(
+        {'template_version': TEMPLATE_VERSION, 'invoice_data': invoice_data},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
-class FrenchInvoicePDFGenerator:
+
+def get_storage_path(invoice_data, content_hash=None):
     """
-    Professional French invoice/quote PDF generator with legal compliance
+    Return (filename, storage path) of the PDF for an invoice in the documents bucket.
+    With a content hash the filename is content-addressed: {doc_type}_{number}_{hash}.pdf
     """
+    user_id = invoice_data.get('user_id', 'anonymous')
+    invoice_id = invoice_data.get('invoice_number', 'INV-0000').replace('/', '-')
+    doc_type = invoice_data.get('document_type', 'FACTURE').lower()
+    if content_hash:
+        pdf_filename = f"{doc_type}_{invoice_id}_{content_hash[:16]}.pdf"
+    else:
+        pdf_filename = f"{doc_type}_{invoice_id}.pdf"
+    return pdf_filename, f"{user_id}/{pdf_filename}"
 
-    def __init__(self, invoice_data):
-        self.data = invoice_data
-        self.buffer = io.BytesIO()
-        self.width, self.height = A4
-        self.styles = getSampleStyleSheet()
-
-        # Define custom styles
-        self.styles.add(ParagraphStyle(
-            name='CompanyName',
-            parent=self.styles['Heading1'],
-            fontSize=16,
-            textColor=colors.HexColor('#0066CC'),
-            spaceAfter=2
-        ))
-
-        self.styles.add(ParagraphStyle(
-            name='InvoiceTitle',
-            parent=self.styles['Heading1'],
-            fontSize=20,
-            textColor=colors.HexColor('#0066CC'),
-            alignment=TA_CENTER,
-            spaceAfter=12
-        ))
-
-        self.styles.add(ParagraphStyle(
-            name='Small',
-            parent=self.styles['Normal'],
-            fontSize=8,
-            textColor=colors.grey
-        ))
-
-        self.styles.add(ParagraphStyle(
-            name='Bold',
-            parent=self.styles['Normal'],
-            fontSize=10,
-            fontName='Helvetica-Bold'
-        ))
-
-        self.styles.add(ParagraphStyle(
-            name='Legal',
-            parent=self.styles['Normal'],
-            fontSize=7,
-            textColor=colors.grey,
-            alignment=TA_CENTER
-        ))
-
-    def format_currency(self, amount):
-        """Format currency in French style"""
-        if amount is None:
-            return "0,00 €"
-        return f"{amount:,.2f} €".replace(",", " ").replace(".", ",")
-
-    def format_date(self, date_str):
-        """Format date in French style (DD/MM/YYYY)"""
-        if not date_str:
-            return datetime.now().strftime("%d/%m/%Y")
-        try:
-            if isinstance(date_str, str):
-                dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-            else:
-                dt = date_str
-            return dt.strftime("%d/%m/%Y")
-        except:
-            return date_str
 
-    def download_logo(self, logo_url):
-        """Download company logo from URL"""
-        try:
-            if not logo_url:
-                return None
-            response = requests.get(logo_url, timeout=10)
-            if response.status_code == 200:
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-                temp_file.write(response.content)
-                temp_file.close()
-                return temp_file.name
-            return None
-        except Exception as e:
-            logger.warning(f"Could not download logo: {e}")
-            return None
-
-    def create_header(self, elements):
-        """Create invoice header with company and client info"""
-        # Company logo and info
-        company = self.data.get('company', {})
-        logo_url = company.get('logo_url')
-
-        header_data = []
-
-        # Row 1: Logo and Company Info | Invoice Title
-        left_content = []
-
-        if logo_url:
-            logo_path = self.download_logo(logo_url)
-            if logo_path:
-                try:
-                    img = Image(logo_path, width=3*cm, height=2*cm, kind='proportional')
-                    left_content.append([img])
-                except Exception as e:
-                    logger.warning(f"Could not add logo: {e}")
-
-        # Company details
-        company_name = Paragraph(f"<b>{company.get('name', 'Nom de l\\'entreprise')}</b>", self.styles['CompanyName'])
-        company_address = Paragraph(
-            f"{company.get('address', '')}<br/>"
-            f"{company.get('postal_code', '')} {company.get('city', '')}<br/>"
-            f"Tél: {company.get('phone', '')}<br/>"
-            f"Email: {company.get('email', '')}",
-            self.styles['Normal']
-        )
+def remember_rendered_pdf(content_hash, pdf_filename, public_url):
+    with _render_cache_lock:
+        _render_cache[content_hash] = (pdf_filename, public_url)
+        _render_cache.move_to_end(content_hash)
+        while len(_render_cache) > RENDER_CACHE_MAX_ENTRIES:
+            _render_cache.popitem(last=False)
 
-        left_content.append([company_name])
-        left_content.append([company_address])
-
-        # Invoice type and number
-        doc_type = self.data.get('document_type', 'FACTURE')
-        doc_number = self.data.get('invoice_number', 'FACT-0000')
-
-        invoice_title = Paragraph(f"<b>{doc_type}</b><br/>N° {doc_number}", self.styles['InvoiceTitle'])
-
-        header_table = Table([[left_content, invoice_title]], colWidths=[10*cm, 9*cm])
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-        ]))
-
-        elements.append(header_table)
-        elements.append(Spacer(1, 0.5*cm))
-
-        # Row 2: Client info and Invoice details
-        client = self.data.get('client', {})
-        client_info = Paragraph(
-            f"<b>CLIENT</b><br/>"
-            f"{client.get('name', 'Nom du client')}<br/>"
-            f"{client.get('address', '')}<br/>"
-            f"{client.get('postal_code', '')} {client.get('city', '')}<br/>"
-            f"SIRET: {client.get('siret', 'N/A')}",
-            self.styles['Normal']
-        )
 
-        invoice_details = Paragraph(
-            f"<b>Date:</b> {self.format_date(self.data.get('invoice_date'))}<br/>"
-            f"<b>Date d'échéance:</b> {self.format_date(self.data.get('due_date'))}<br/>"
-            f"<b>Conditions de paiement:</b> {self.data.get('payment_terms', 'Net 30 jours')}",
-            self.styles['Normal']
-        )
+def forget_rendered_pdfs(pdf_filenames):
+    """Drop the cache entries of PDFs that were deleted from storage"""
+    with _render_cache_lock:
+        for content_hash, (pdf_filename, _) in list(_render_cache.items()):
+            if pdf_filename in pdf_filenames:
+                del _render_cache[content_hash]
 
-        info_table = Table([[client_info, invoice_details]], colWidths=[10*cm, 9*cm])
-        info_table.setStyle(TableStyle([
-            ('BOX', (0, 0), (0, 0), 1, colors.grey),
-            ('BOX', (1, 0), (1, 0), 1, colors.grey),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 8),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ]))
-
-        elements.append(info_table)
-        elements.append(Spacer(1, 1*cm))
-
-    def create_line_items_table(self, elements):
-        """Create table with line items"""
-        line_items = self.data.get('line_items', [])
-
-        if not line_items:
-            elements.append(Paragraph("Aucun article", self.styles['Normal']))
-            return
-
-        # Table headers
-        table_data = [[
-            Paragraph('<b>Désignation</b>', self.styles['Bold']),
-            Paragraph('<b>Qté</b>', self.styles['Bold']),
-            Paragraph('<b>P.U. HT</b>', self.styles['Bold']),
-            Paragraph('<b>TVA</b>', self.styles['Bold']),
-            Paragraph('<b>Total HT</b>', self.styles['Bold'])
-        ]]
-
-        # Add line items
-        for item in line_items:
-            description = item.get('description', '')
-            quantity = item.get('quantity', 0)
-            unit_price = item.get('unit_price_ht', 0)
-            vat_rate = item.get('vat_rate', 20)
-            line_total = quantity * unit_price
-
-            table_data.append([
-                Paragraph(description, self.styles['Normal']),
-                str(quantity),
-                self.format_currency(unit_price),
-                f"{vat_rate}%",
-                self.format_currency(line_total)
-            ])
-
-        # Create table
-        line_items_table = Table(
-            table_data,
-            colWidths=[8*cm, 2*cm, 3*cm, 2*cm, 3.5*cm]
-        )
 
-        line_items_table.setStyle(TableStyle([
-            # Header styling
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0066CC')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-
-            # Body styling
-            ('ALIGN', (1, 1), (1, -1), 'CENTER'),  # Quantity
-            ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),   # Prices
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('LEFTPADDING', (0, 0), (-1, -1), 5),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-            ('TOPPADDING', (0, 0), (-1, -1), 5),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-
-            # Grid
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F5F5F5')]),
-        ]))
-
-        elements.append(line_items_table)
-        elements.append(Spacer(1, 0.5*cm))
-
-    def create_vat_breakdown(self, elements):
-        """Create VAT breakdown table"""
-        vat_breakdown = self.data.get('vat_breakdown', [])
-
-        if not vat_breakdown:
-            # Calculate from line items
-            vat_dict = {}
-            for item in self.data.get('line_items', []):
-                vat_rate = item.get('vat_rate', 20)
-                quantity = item.get('quantity', 0)
-                unit_price = item.get('unit_price_ht', 0)
-                line_total_ht = quantity * unit_price
-
-                if vat_rate not in vat_dict:
-                    vat_dict[vat_rate] = {'base': 0, 'vat': 0}
-
-                vat_dict[vat_rate]['base'] += line_total_ht
-                vat_dict[vat_rate]['vat'] += line_total_ht * (vat_rate / 100)
-
-            vat_breakdown = [
-                {'vat_rate': rate, 'base_amount': data['base'], 'vat_amount': data['vat']}
-                for rate, data in vat_dict.items()
-            ]
-
-        if vat_breakdown:
-            vat_data = [['<b>Taux TVA</b>', '<b>Base HT</b>', '<b>Montant TVA</b>']]
-
-            for breakdown in vat_breakdown:
-                vat_data.append([
-                    f"{breakdown['vat_rate']}%",
-                    self.format_currency(breakdown['base_amount']),
-                    self.format_currency(breakdown['vat_amount'])
-                ])
-
-            vat_table = Table(vat_data, colWidths=[3*cm, 4*cm, 4*cm])
-            vat_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#F5F5F5')),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ]))
-
-            elements.append(Paragraph('<b>Détail de la TVA</b>', self.styles['Bold']))
-            elements.append(Spacer(1, 0.3*cm))
-            elements.append(vat_table)
-            elements.append(Spacer(1, 0.5*cm))
-
-    def create_totals(self, elements):
-        """Create totals section"""
-        subtotal_ht = self.data.get('subtotal_ht', 0)
-        total_vat = self.data.get('total_vat', 0)
-        total_ttc = self.data.get('total_ttc', 0)
-
-        # Calculate if not provided
-        if subtotal_ht == 0:
-            for item in self.data.get('line_items', []):
-                subtotal_ht += item.get('quantity', 0) * item.get('unit_price_ht', 0)
-
-        if total_vat == 0:
-            for item in self.data.get('line_items', []):
-                line_total = item.get('quantity', 0) * item.get('unit_price_ht', 0)
-                total_vat += line_total * (item.get('vat_rate', 20) / 100)
-
-        if total_ttc == 0:
-            total_ttc = subtotal_ht + total_vat
-
-        totals_data = [
-            ['Total HT', self.format_currency(subtotal_ht)],
-            ['Total TVA', self.format_currency(total_vat)],
-            ['', ''],  # Spacer
-            ['<b>TOTAL TTC</b>', f'<b>{self.format_currency(total_ttc)}</b>']
+def find_rendered_pdf(invoice_data, content_hash):
+    """
+    Return (filename, public URL) of an already stored PDF with this content hash, or None.
+    Storage is always checked: another instance may have deleted the object since it was cached.
+    """
+    pdf_filename, storage_path = get_storage_path(invoice_data, content_hash)
+    folder = storage_path.rsplit('/', 1)[0]
+    try:
+        objects = get_supabase().storage.from_('documents').list(folder, {'search': pdf_filename})
+    except Exception as e:
+        logger.warning(f"Could not look up stored PDF {storage_path}: {e}")
+        return None
+
+    if not any(obj.get('name') == pdf_filename for obj in objects or []):
+        forget_rendered_pdfs({pdf_filename})
+        return None
+
+    with _render_cache_lock:
+        cached = _render_cache.get(content_hash)
+    if cached:
+        return cached
+
+    public_url = get_supabase().storage.from_('documents').get_public_url(storage_path)
+    remember_rendered_pdf(content_hash, pdf_filename, public_url)
+    return pdf_filename, public_url
+
+
+def remove_stale_renders(invoice_data, content_hash):
+    """Delete previous content-addressed renders of the same document (best effort)"""
+    pdf_filename, storage_path = get_storage_path(invoice_data, content_hash)
+    folder = storage_path.rsplit('/', 1)[0]
+    prefix = pdf_filename[:-len(content_hash[:16]) - len('.pdf')]
+    try:
+        objects = get_supabase().storage.from_('documents').list(folder, {'search': prefix})
+        stale = [
+            obj['name'] for obj in objects or []
+            if obj.get('name', '').startswith(prefix) and obj['name'] != pdf_filename
         ]
+        if stale:
+            forget_rendered_pdfs(set(stale))
+            get_supabase().storage.from_('documents').remove([f"{folder}/{name}" for name in stale])
+    except Exception as e:
+        logger.warning(f"Could not remove stale renders for {pdf_filename}: {e}")
 
-        totals_table = Table(totals_data, colWidths=[5*cm, 4*cm])
-        totals_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('LINEABOVE', (0, 3), (-1, 3), 2, colors.HexColor('#0066CC')),
-            ('FONTNAME', (0, 3), (-1, 3), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 3), (-1, 3), 12),
-            ('TEXTCOLOR', (0, 3), (-1, 3), colors.HexColor('#0066CC')),
-            ('TOPPADDING', (0, 3), (-1, 3), 10),
-        ]))
 
-        # Align to right
-        total_container = Table([[None, totals_table]], colWidths=[10*cm, 9*cm])
+def upload_invoice_pdf(invoice_data, pdf, content_hash=None):
+    """Upload a rendered PDF (bytes or buffer) to Supabase Storage and return (filename, public URL)"""
+    pdf_filename, storage_path = get_storage_path(invoice_data, content_hash)
 
-        elements.append(total_container)
-        elements.append(Spacer(1, 1*cm))
+    with stage('upload'):
+        upload_to_storage('documents', storage_path, pdf, 'application/pdf')
+    add_bytes('upload', pdf.getbuffer().nbytes if hasattr(pdf, 'getbuffer') else len(pdf))
 
-    def create_payment_instructions(self, elements):
-        """Create payment instructions section"""
-        payment = self.data.get('payment_instructions', {})
+    with stage('public_url'):
+        public_url = get_supabase().storage.from_('documents').get_public_url(storage_path)
 
-        if not payment:
-            return
+    if content_hash:
+        remember_rendered_pdf(content_hash, pdf_filename, public_url)
+        get_upload_pool().submit(remove_stale_renders, invoice_data, content_hash)
 
-        elements.append(Paragraph('<b>MODALITÉS DE PAIEMENT</b>', self.styles['Bold']))
-        elements.append(Spacer(1, 0.3*cm))
+    return pdf_filename, public_url
 
-        payment_text = f"<b>Mode de paiement:</b> {payment.get('method', 'Virement bancaire')}<br/>"
 
-        if payment.get('iban'):
-            payment_text += f"<b>IBAN:</b> {payment['iban']}<br/>"
+def render_invoice_pdf(invoice_data, totals=None):
+    """Render one invoice to PDF bytes (runs inside the batch worker processes)"""
+    from pdf_generator import FrenchInvoicePDFGenerator
 
-        if payment.get('bic'):
-            payment_text += f"<b>BIC:</b> {payment['bic']}<br/>"
+    return FrenchInvoicePDFGenerator(invoice_data, totals).generate()
 
-        if payment.get('bank_name'):
-            payment_text += f"<b>Banque:</b> {payment['bank_name']}<br/>"
 
-        payment_para = Paragraph(payment_text, self.styles['Normal'])
-        elements.append(payment_para)
-        elements.append(Spacer(1, 0.5*cm))
+def render_invoice_buffer(invoice_data):
+    """Render one invoice into an in-memory buffer that can be uploaded without copying"""
+    from pdf_generator import FrenchInvoicePDFGenerator
 
-    def create_footer(self, elements):
-        """Create footer with legal mentions"""
-        company = self.data.get('company', {})
+    return FrenchInvoicePDFGenerator(invoice_data).generate_buffer()
 
-        legal_mentions = []
 
-        if company.get('siret'):
-            legal_mentions.append(f"SIRET: {company['siret']}")
+def compute_batch_totals(invoices):
+    """
+    Totals for every invoice in one columnar pass. If some invoice has invalid
+    amounts, falls back to per-invoice computation and returns the error in its slot.
+    """
+    try:
+        return compute_totals_batch([invoice_data.get('line_items', []) for invoice_data in invoices])
+    except ValueError:
+        results = []
+        for invoice_data in invoices:
+            try:
+                results.append(compute_totals(invoice_data.get('line_items', [])))
+            except ValueError as e:
+                results.append(e)
+        return results
+
+
+def generate_and_store(invoice_data, force_render=False):
+    """
+    Render and upload one invoice, reusing the stored PDF when its content hash is unchanged.
+    Returns a dict with invoice_url, filename, content_hash and cached.
+    """
+    with stage('hash'):
+        content_hash = compute_content_hash(invoice_data)
+    if not force_render:
+        with stage('lookup'):
+            stored = find_rendered_pdf(invoice_data, content_hash)
+        if stored:
+            pdf_filename, public_url = stored
+            logger.info(f"PDF unchanged, reusing stored render: {pdf_filename}")
+            return {"invoice_url": public_url, "filename": pdf_filename, "content_hash": content_hash, "cached": True}
+
+    # Generate PDF
+    with stage('render'):
+        pdf_buffer = render_invoice_buffer(invoice_data)
+
+    # Stream it to Supabase Storage (transient storage errors are retried)
+    try:
+        pdf_filename, public_url = with_retry(lambda: upload_invoice_pdf(invoice_data, pdf_buffer, content_hash))
+    finally:
+        pdf_buffer.close()
 
-        if company.get('vat_number'):
-            legal_mentions.append(f"N° TVA: {company['vat_number']}")
+    logger.info(f"PDF generated successfully: {pdf_filename}")
+    return {"invoice_url": public_url, "filename": pdf_filename, "content_hash": content_hash, "cached": False}
 
-        if company.get('rcs'):
-            legal_mentions.append(f"RCS: {company['rcs']}")
 
-        if company.get('share_capital'):
-            legal_mentions.append(f"Capital social: {self.format_currency(company['share_capital'])}")
+def with_retry(operation, attempts=None, base_delay=None):
+    """Call operation(), retrying with exponential backoff; re-raises the last error"""
+    attempts = attempts or JOB_MAX_ATTEMPTS
+    base_delay = JOB_RETRY_BASE_DELAY if base_delay is None else base_delay
+    for attempt in range(1, attempts + 1):
+        try:
+            return operation()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = base_delay * 2 ** (attempt - 1)
+            logger.warning(f"Attempt {attempt}/{attempts} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
 
-        if company.get('insurance'):
-            legal_mentions.append(f"Assurance: {company['insurance']}")
 
-        # Add standard legal text
-        legal_text = " | ".join(legal_mentions)
-        legal_text += "<br/>En cas de retard de paiement, une pénalité de 3 fois le taux d'intérêt légal sera exigible."
-        legal_text += "<br/>En cas de non-paiement à la date d'échéance, une indemnité forfaitaire de 40€ pour frais de recouvrement sera due."
+def get_publisher():
+    """Return the Pub/Sub publisher used to hand off render jobs, creating it on first use"""
+    global _publisher
+    if _publisher is None:
+        from google.cloud import pubsub_v1
+        _publisher = pubsub_v1.PublisherClient()
+    return _publisher
 
-        legal_para = Paragraph(legal_text, self.styles['Legal'])
-        elements.append(Spacer(1, 1*cm))
-        elements.append(legal_para)
 
-    def generate(self):
-        """Generate the complete PDF"""
+def update_render_job(job_id, **fields):
+    """Write job status fields; status updates are retried since clients poll this row"""
+    with_retry(lambda: get_supabase().table(RENDER_JOBS_TABLE).update(fields).eq('id', job_id).execute())
+
+
+def create_render_job(invoice_data, force_render=False):
+    """
+    Record a pending job with its payload and publish its id for invoice_render_worker.
+    Returns the job id; a job that cannot be published is marked failed and the error re-raised.
+    """
+    if not RENDER_JOBS_TOPIC:
+        raise RuntimeError("INVOICE_RENDER_JOBS_TOPIC is not configured")
+
+    job_id = str(uuid.uuid4())
+    get_supabase().table(RENDER_JOBS_TABLE).insert({
+        'id': job_id,
+        'user_id': invoice_data.get('user_id'),
+        'invoice_number': invoice_data.get('invoice_number'),
+        'status': 'pending',
+        'invoice_data': invoice_data,
+        'force_render': force_render,
+    }).execute()
+
+    try:
+        message = json.dumps({'job_id': job_id}).encode('utf-8')
+        with_retry(lambda: get_publisher().publish(RENDER_JOBS_TOPIC, message).result(timeout=30))
+    except Exception as e:
+        update_render_job(job_id, status='failed', error=f"Could not queue render job: {e}")
+        raise
+    return job_id
+
+
+def claim_render_job(job_id):
+    """
+    Move a pending job to running and return its row, or None if another delivery already
+    claimed it or it no longer exists. The status filter makes the claim a single atomic update.
+    """
+    response = get_supabase().table(RENDER_JOBS_TABLE) \
+        .update({'status': 'running'}) \
+        .eq('id', job_id) \
+        .eq('status', 'pending') \
+        .execute()
+    return response.data[0] if response.data else None
+
+
+def run_render_job(job_id, invoice_data, force_render=False):
+    """Body of a claimed render job: render, upload with retry, then record the outcome"""
+    try:
+        with request_timer() as timer:
+            result = generate_and_store(invoice_data, force_render)
+        log_timer(timer, "invoice render job timing", job_id=job_id, invoice_number=invoice_data.get('invoice_number'))
+        update_render_job(
+            job_id,
+            status='completed',
+            invoice_url=result['invoice_url'],
+            filename=result['filename'],
+            content_hash=result['content_hash'],
+        )
+    except Exception as e:
+        logger.error(f"Render job {job_id} failed: {e}", exc_info=True)
         try:
-            doc = SimpleDocTemplate(
-                self.buffer,
-                pagesize=A4,
-                rightMargin=2*cm,
-                leftMargin=2*cm,
-                topMargin=2*cm,
-                bottomMargin=2*cm
-            )
-
-            elements = []
-
-            # Build PDF content
-            self.create_header(elements)
-            self.create_line_items_table(elements)
-            self.create_vat_breakdown(elements)
-            self.create_totals(elements)
-            self.create_payment_instructions(elements)
-            self.create_footer(elements)
-
-            # Build PDF
-            doc.build(elements)
-
-            # Get PDF bytes
-            pdf_bytes = self.buffer.getvalue()
-            self.buffer.close()
-
-            return pdf_bytes
+            update_render_job(job_id, status='failed', error=str(e))
+        except Exception as update_error:
+            logger.error(f"Could not record failure of render job {job_id}: {update_error}")
+
+
+def expire_stale_job(job):
+    """
+    Mark a pending or running job failed when it has not been updated for JOB_TIMEOUT_SECONDS
+    (its worker was lost). Returns the job as it should be reported.
+    """
+    if job['status'] not in ('pending', 'running') or not job.get('updated_at'):
+        return job
+    age = (datetime.now(timezone.utc) - datetime.fromisoformat(job['updated_at'])).total_seconds()
+    if age < JOB_TIMEOUT_SECONDS:
+        return job
+
+    error = f"Job timed out after {int(age)}s in status '{job['status']}'"
+    try:
+        get_supabase().table(RENDER_JOBS_TABLE) \
+            .update({'status': 'failed', 'error': error}) \
+            .eq('id', job['id']) \
+            .eq('status', job['status']) \
+            .execute()
+    except Exception as e:
+        logger.warning(f"Could not mark render job {job['id']} as timed out: {e}")
+    return {**job, 'status': 'failed', 'error': error}
+
+
+def get_render_pool():
+    """Return the process pool used for batch rendering, creating it on first use"""
+    global _render_pool
+    if _render_pool is None:
+        # Load the PDF layout before the workers are forked so they inherit it
+        import pdf_generator  # noqa: F401
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return _render_pool
+
+
+def get_upload_pool():
+    """Return the thread pool used for concurrent storage uploads, creating it on first use"""
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    return _upload_pool
+
+
+def reset_render_pool():
+    """Drop a broken process pool so the next batch starts fresh workers"""
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def render_and_upload_batch(invoices, force_render=False):
+    """
+    Render invoices in parallel worker processes and upload each PDF as soon as it is ready.
+    Invoices whose content hash is already stored are returned without rendering.
+    Returns one result dict per invoice, in request order; failures are reported per document.
+    """
+    results = [None] * len(invoices)
+    render_pool = get_render_pool()
+    upload_pool = get_upload_pool()
+
+    content_hashes = [compute_content_hash(invoice_data) for invoice_data in invoices]
 
+    to_render = list(range(len(invoices)))
+    if not force_render:
+        lookup_futures = {
+            upload_pool.submit(find_rendered_pdf, invoices[index], content_hashes[index]): index
+            for index in to_render
+        }
+        to_render = []
+        for future in as_completed(lookup_futures):
+            index = lookup_futures[future]
+            stored = future.result()
+            if stored:
+                pdf_filename, public_url = stored
+                results[index] = {"success": True, "cached": True, "invoice_url": public_url, "filename": pdf_filename}
+            else:
+                to_render.append(index)
+
+    # Totals are computed here in one pass so invalid amounts fail before using a worker
+    batch_totals = compute_batch_totals([invoices[index] for index in to_render])
+    render_futures = {}
+    for index, totals in zip(to_render, batch_totals):
+        if isinstance(totals, Exception):
+            results[index] = {"success": False, "error": str(totals)}
+            continue
+        render_futures[render_pool.submit(render_invoice_pdf, invoices[index], totals)] = index
+
+    upload_futures = {}
+    for future in as_completed(render_futures):
+        index = render_futures[future]
+        invoice_data = invoices[index]
+        try:
+            pdf_bytes = future.result()
+        except BrokenProcessPool as e:
+            logger.error(f"Render worker crashed: {e}")
+            reset_render_pool()
+            results[index] = {"success": False, "error": f"Render worker crashed: {e}"}
+            continue
         except Exception as e:
-            logger.error(f"PDF generation error: {e}", exc_info=True)
-            raise
+            logger.warning(f"Batch render failed for invoice #{index}: {e}")
+            results[index] = {"success": False, "error": str(e)}
+            continue
+
+        upload = partial(upload_invoice_pdf, invoice_data, pdf_bytes, content_hashes[index])
+        upload_futures[upload_pool.submit(with_retry, upload)] = index
+
+    for future in as_completed(upload_futures):
+        index = upload_futures[future]
+        try:
+            pdf_filename, public_url = future.result()
+            results[index] = {"success": True, "cached": False, "invoice_url": public_url, "filename": pdf_filename}
+        except Exception as e:
+            logger.warning(f"Batch upload failed for invoice #{index}: {e}")
+            results[index] = {"success": False, "error": str(e)}
+
+    for index, result in enumerate(results):
+        result['index'] = index
+        result['invoice_number'] = invoices[index].get('invoice_number')
+        result['content_hash'] = content_hashes[index]
+
+    return results
+
 
 @functions_framework.http
 def invoice_generator(request: Request):
@@ -466,43 +493,226 @@ def invoice_generator(request: Request):
         if not invoice_data:
             return jsonify({"error": "Missing 'invoice_data' in payload"}), 400, headers
 
-        # Generate PDF
-        generator = FrenchInvoicePDFGenerator(invoice_data)
-        pdf_bytes = generator.generate()
+        force_render = bool(request_json.get('force_render'))
 
-        # Upload to Supabase Storage
-        user_id = invoice_data.get('user_id', 'anonymous')
-        invoice_id = invoice_data.get('invoice_number', 'INV-0000').replace('/', '-')
-        doc_type = invoice_data.get('document_type', 'FACTURE').lower()
-        pdf_filename = f"{doc_type}_{invoice_id}.pdf"
-        storage_path = f"{user_id}/{pdf_filename}"
+        # Job mode: answer immediately, render and upload in the background
+        if request_json.get('mode') == 'async':
+            job_id = create_render_job(invoice_data, force_render)
+            return jsonify({
+                "success": True,
+                "message": "PDF generation started",
+                "job_id": job_id,
+                "status": "pending"
+            }), 202, headers
 
-        response = supabase.storage.from_('documents').upload(
-            file=pdf_bytes,
-            path=storage_path,
-            file_options={"content-type": "application/pdf", "upsert": "true"}
-        )
+        with request_timer() as timer:
+            result = generate_and_store(invoice_data, force_render)
+        log_timer(timer, "invoice_generator timing", invoice_number=invoice_data.get('invoice_number'), cached=result['cached'])
 
-        if hasattr(response, 'error') and response.error:
-            logger.error(f"Supabase upload error: {response.error}")
-            return jsonify({"error": f"Storage upload failed: {response.error}"}), 500, headers
+        return jsonify({
+            "success": True,
+            "message": "PDF unchanged, existing document returned" if result['cached'] else "PDF generated and stored successfully",
+            **result
+        }), 200, {**headers, 'Server-Timing': timer.server_timing(), 'Timing-Allow-Origin': '*',
+                  'Access-Control-Expose-Headers': 'Server-Timing'}
 
-        # Get public URL
-        public_url = supabase.storage.from_('documents').get_public_url(storage_path)
+    except FacturXValidationError as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "validation_errors": e.errors
+        }), 422, headers
 
-        logger.info(f"PDF generated successfully: {pdf_filename}")
+    except Exception as e:
+        logger.error(f"Invoice generation failed: {e}", exc_info=True)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500, headers
+
+
+
+@functions_framework.http
+def invoice_generator_batch(request: Request):
+    """
+    HTTP Cloud Function that renders a list of invoices in parallel and uploads them concurrently.
+    Payload: {"invoices": [invoice_data, ...]}. Returns one result per invoice, in request order.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*'
+    }
+
+    try:
+        request_json = request.get_json(silent=True)
+        if not request_json:
+            return jsonify({"error": "Invalid JSON payload"}), 400, headers
+
+        invoices = request_json.get('invoices')
+        if not invoices or not isinstance(invoices, list):
+            return jsonify({"error": "Missing 'invoices' list in payload"}), 400, headers
+
+        if len(invoices) > BATCH_MAX_INVOICES:
+            return jsonify({
+                "error": f"Too many invoices in batch ({len(invoices)} > {BATCH_MAX_INVOICES})"
+            }), 400, headers
+
+        results = render_and_upload_batch(invoices, force_render=bool(request_json.get('force_render')))
+        failed = sum(1 for result in results if not result['success'])
+
+        logger.info(f"Batch generated: {len(results) - failed} succeeded, {failed} failed")
 
         return jsonify({
-            "success": True,
-            "message": "PDF generated and stored successfully",
-            "invoice_url": public_url,
-            "filename": pdf_filename
+            "success": failed == 0,
+            "total": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "results": results
         }), 200, headers
 
     except Exception as e:
-        logger.error(f"Invoice generation failed: {e}", exc_info=True)
+        logger.error(f"Batch invoice generation failed: {e}", exc_info=True)
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500, headers
+
+
+@functions_framework.http
+def invoice_job_status(request: Request):
+    """
+    HTTP Cloud Function returning the status of a background render job.
+    GET ?job_id=... or POST {"job_id": ...}. Clients may also read the invoice_render_jobs row directly.
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*'
+    }
+
+    try:
+        request_json = request.get_json(silent=True) or {}
+        job_id = request.args.get('job_id') or request_json.get('job_id')
+        if not job_id:
+            return jsonify({"error": "Missing 'job_id'"}), 400, headers
+
+        response = get_supabase().table(RENDER_JOBS_TABLE) \
+            .select('id, status, invoice_url, filename, content_hash, error, created_at, updated_at') \
+            .eq('id', job_id) \
+            .limit(1) \
+            .execute()
+        if not response.data:
+            return jsonify({"error": "Job not found"}), 404, headers
+
+        job = expire_stale_job(response.data[0])
+        return jsonify({
+            "success": job['status'] != 'failed',
+            "job_id": job['id'],
+            **{key: value for key, value in job.items() if key != 'id'}
+        }), 200, headers
+
+    except Exception as e:
+        logger.error(f"Job status lookup failed: {e}", exc_info=True)
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500, headers
 
+
+@functions_framework.cloud_event
+def invoice_render_worker(cloud_event):
+    """
+    Pub/Sub-triggered Cloud Function running the render jobs queued by invoice_generator
+    ("mode": "async"). The message carries {"job_id": ...}; the payload is read from the job row.
+    """
+    message = json.loads(base64.b64decode(cloud_event.data['message']['data']))
+    job_id = message['job_id']
+
+    job = claim_render_job(job_id)
+    if job is None:
+        logger.info(f"Render job {job_id} already claimed or missing, skipping")
+        return
+
+    run_render_job(job_id, job['invoice_data'], bool(job.get('force_render')))
+
+
+def handle_invoice_export(request: Request):
+    """Authenticated body of invoice_export (request.user_id is set by require_auth)"""
+    import export
+
+    headers = {
+        'Access-Control-Allow-Origin': '*'
+    }
+
+    params = {**request.args, **(request.get_json(silent=True) or {})}
+    export_format = params.get('format', 'zip')
+    if export_format not in export.EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format {export_format!r}, expected one of {', '.join(export.EXPORT_FORMATS)}"}), 400, headers
+
+    try:
+        start_date = date.fromisoformat(params.get('start_date', ''))
+        end_date = date.fromisoformat(params.get('end_date', ''))
+    except ValueError:
+        return jsonify({"error": "'start_date' and 'end_date' must be dates (YYYY-MM-DD)"}), 400, headers
+    if end_date < start_date:
+        return jsonify({"error": "'end_date' is before 'start_date'"}), 400, headers
+
+    try:
+        chunks = export.stream_export(
+            get_supabase(), request.user_id, start_date.isoformat(), end_date.isoformat(),
+            export_format, render_invoice_pdf
+        )
+    except export.ExportTooLarge as e:
+        return jsonify({"error": str(e)}), 400, headers
+
+    filename = f"factures_{start_date.isoformat()}_{end_date.isoformat()}.{export_format}"
+    logger.info(f"Streaming {export_format} export {filename} for user {request.user_id}")
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/zip' if export_format == 'zip' else 'application/pdf',
+        headers={**headers, 'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@functions_framework.http
+def invoice_export(request: Request):
+    """
+    HTTP Cloud Function streaming every invoice of the authenticated user over a date range.
+    GET or POST with start_date, end_date (YYYY-MM-DD) and format ("zip", default, or "pdf").
+    """
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    headers = {
+        'Access-Control-Allow-Origin': '*'
+    }
+
+    # PyJWT and cryptography are only loaded by this entry point, to keep cold starts short
+    from shared.auth_utils import require_auth
+
+    result = require_auth(handle_invoice_export)(request)
+    # Auth failures come back as (body, status) without CORS headers, which browsers would hide
+    if isinstance(result, tuple) and len(result) == 2:
+        return (*result, headers)
+    return result
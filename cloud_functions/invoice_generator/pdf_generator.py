@@ -0,0 +1,482 @@
+"""
+French invoice/quote PDF layout.
+
+Imports ReportLab, Pillow and the logo cache, so main.py only loads this
+module when a PDF is actually rendered.
+"""
+import io
+import os
+import sys
+import logging
+from datetime import datetime
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from logo_cache import logo_cache
+from theme import get_theme
+from line_item_stream import LineItemStream
+from canvas_renderer import CanvasInvoiceRenderer, CanvasOverflow
+from static_blocks import StaticBlockFlowable, get_company_block, get_legal_block
+from totals import compute_totals, format_rate
+from timing import stage, add_bytes
+from shared.amounts import to_decimal
+from shared.facturx_xml import PROFILES, FacturXGenerator, embed_facturx_buffer
+from shared.facturx_validation import check_facturx_xml
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the rendered layout or the embedded Factur-X XML changes so stored PDFs are not reused
+TEMPLATE_VERSION = "2.3.2"
+
+# Invoices with more line items than this are laid out one page at a time (LineItemStream). Up to
+# this size the single table is faster, since it does not measure every page twice, and it costs
+# under 10 MB more memory
+CHUNKED_LINE_ITEMS_THRESHOLD = int(os.environ.get("INVOICE_CHUNKED_LINE_ITEMS_THRESHOLD", "1500"))
+LINE_ITEMS_COL_WIDTHS = [8*cm, 2*cm, 3*cm, 2*cm, 3.5*cm]
+
+# Rendering engine used when the payload does not set "engine": "platypus" or "canvas"
+DEFAULT_ENGINE = os.environ.get("INVOICE_DEFAULT_ENGINE", "platypus")
+
+
+class FrenchInvoicePDFGenerator:
+    """
+    Professional French invoice/quote PDF generator with legal compliance
+    """
+
+    def __init__(self, invoice_data, totals=None):
+        self.data = invoice_data
+        self.totals = totals or compute_totals(invoice_data.get('line_items', []))
+        self.facturx_profile = invoice_data.get('facturx_profile') or 'basic'
+        self.buffer = io.BytesIO()
+        self.width, self.height = A4
+        self.theme = get_theme(invoice_data.get('company', {}).get('brand_color'))
+        self.styles = self.theme.styles
+
+    def format_currency(self, amount):
+        """Format currency in French style"""
+        if amount is None:
+            return "0,00 €"
+        return f"{amount:,.2f} €".replace(",", " ").replace(".", ",")
+
+    def format_date(self, date_str):
+        """Format date in French style (DD/MM/YYYY)"""
+        if not date_str:
+            return datetime.now().strftime("%d/%m/%Y")
+        try:
+            if isinstance(date_str, str):
+                dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+            else:
+                dt = date_str
+            return dt.strftime("%d/%m/%Y")
+        except:
+            return date_str
+
+    def download_logo(self, logo_url):
+        """Load company logo from the logo cache (downloads it on first use)"""
+        try:
+            if not logo_url:
+                return None
+            with stage('logo'):
+                logo_bytes = logo_cache.get(logo_url)
+            if logo_bytes is None:
+                return None
+            add_bytes('logo', len(logo_bytes))
+            return io.BytesIO(logo_bytes)
+        except Exception as e:
+            logger.warning(f"Could not download logo: {e}")
+            return None
+
+    def company_block(self):
+        """Cached static block with the company logo, name and contact lines"""
+        company = self.data.get('company', {})
+        logo_file = self.download_logo(company.get('logo_url'))
+        logo = logo_file.getvalue() if logo_file else None
+        return get_company_block(TEMPLATE_VERSION, company, self.theme.brand_color, logo)
+
+    def legal_block(self):
+        """Cached static block with the legal mentions footer"""
+        return get_legal_block(TEMPLATE_VERSION, self.legal_lines())
+
+    def create_header(self, elements):
+        """Create invoice header with company and client info"""
+        # Company logo and info, laid out once per tenant
+        left_content = [StaticBlockFlowable(self.company_block())]
+
+        # Invoice type and number
+        doc_type = self.data.get('document_type', 'FACTURE')
+        doc_number = self.data.get('invoice_number', 'FACT-0000')
+
+        invoice_title = Paragraph(f"<b>{doc_type}</b><br/>N° {doc_number}", self.styles['InvoiceTitle'])
+
+        header_table = Table([[left_content, invoice_title]], colWidths=[10*cm, 9*cm])
+        header_table.setStyle(self.theme.header_table_style)
+
+        elements.append(header_table)
+        elements.append(Spacer(1, 0.5*cm))
+
+        # Row 2: Client info and Invoice details
+        client = self.data.get('client', {})
+        client_info = Paragraph(
+            f"<b>CLIENT</b><br/>"
+            f"{client.get('name', 'Nom du client')}<br/>"
+            f"{client.get('address', '')}<br/>"
+            f"{client.get('postal_code', '')} {client.get('city', '')}<br/>"
+            f"SIRET: {client.get('siret', 'N/A')}",
+            self.styles['Normal']
+        )
+
+        invoice_details = Paragraph(
+            f"<b>Date:</b> {self.format_date(self.data.get('invoice_date'))}<br/>"
+            f"<b>Date d'échéance:</b> {self.format_date(self.data.get('due_date'))}<br/>"
+            f"<b>Conditions de paiement:</b> {self.data.get('payment_terms', 'Net 30 jours')}",
+            self.styles['Normal']
+        )
+
+        info_table = Table([[client_info, invoice_details]], colWidths=[10*cm, 9*cm])
+        info_table.setStyle(self.theme.info_table_style)
+
+        elements.append(info_table)
+        elements.append(Spacer(1, 1*cm))
+
+    def line_items_header(self):
+        """Header row of the line items table"""
+        return [
+            Paragraph('<b>Désignation</b>', self.styles['Bold']),
+            Paragraph('<b>Qté</b>', self.styles['Bold']),
+            Paragraph('<b>P.U. HT</b>', self.styles['Bold']),
+            Paragraph('<b>TVA</b>', self.styles['Bold']),
+            Paragraph('<b>Total HT</b>', self.styles['Bold'])
+        ]
+
+    def line_item_values(self, index):
+        """Return (description, quantity, unit price, VAT rate, total) display strings and the line total HT"""
+        item = self.data['line_items'][index]
+        line_total = self.totals.line_totals[index]
+
+        values = (
+            item.get('description', ''),
+            str(item.get('quantity', 0)),
+            self.format_currency(item.get('unit_price_ht', 0)),
+            format_rate(item.get('vat_rate', 20)),
+            self.format_currency(line_total)
+        )
+        return values, line_total
+
+    def line_item_row(self, index):
+        """Return (table row, line total HT) for the line item at `index`"""
+        values, line_total = self.line_item_values(index)
+        row = [Paragraph(values[0], self.styles['Normal']), *values[1:]]
+        return row, line_total
+
+    def subtotal_row(self, label, amount):
+        """Running subtotal row used between pages of large invoices"""
+        return [label, '', '', '', self.format_currency(amount)]
+
+    def use_chunked_line_items(self):
+        """Large invoices (or an explicit render_mode) use the memory-bounded line item table"""
+        render_mode = self.data.get('render_mode')
+        if render_mode == 'chunked':
+            return True
+        if render_mode == 'table':
+            return False
+        return len(self.data.get('line_items', [])) > CHUNKED_LINE_ITEMS_THRESHOLD
+
+    def use_canvas_engine(self):
+        """The standard layout can be drawn directly on the canvas (engine: 'canvas')"""
+        return self.data.get('engine', DEFAULT_ENGINE) == 'canvas'
+
+    def create_line_items_table(self, elements):
+        """Create table with line items"""
+        line_items = self.data.get('line_items', [])
+
+        if not line_items:
+            elements.append(Paragraph("Aucun article", self.styles['Normal']))
+            return
+
+        if self.use_chunked_line_items():
+            elements.append(LineItemStream(
+                len(line_items),
+                build_header=self.line_items_header,
+                build_row=self.line_item_row,
+                col_widths=LINE_ITEMS_COL_WIDTHS,
+                table_style=self.theme.line_items_table_style,
+                format_subtotal=self.subtotal_row,
+            ))
+            elements.append(Spacer(1, 0.5*cm))
+            return
+
+        # Table headers
+        table_data = [self.line_items_header()]
+
+        # Add line items
+        for index in range(len(line_items)):
+            row, _ = self.line_item_row(index)
+            table_data.append(row)
+
+        # Create table
+        line_items_table = Table(
+            table_data,
+            colWidths=LINE_ITEMS_COL_WIDTHS
+        )
+
+        line_items_table.setStyle(self.theme.line_items_table_style)
+
+        elements.append(line_items_table)
+        elements.append(Spacer(1, 0.5*cm))
+
+    def vat_breakdown_rows(self):
+        """VAT breakdown as (rate, base HT, VAT amount) display strings"""
+        vat_breakdown = self.data.get('vat_breakdown', [])
+
+        if not vat_breakdown:
+            # Use the per-rate groups computed by the totals engine
+            vat_breakdown = [
+                {'vat_rate': group.rate, 'base_amount': group.base, 'vat_amount': group.vat}
+                for group in self.totals.vat_groups
+            ]
+
+        return [
+            (
+                format_rate(breakdown['vat_rate']),
+                self.format_currency(breakdown['base_amount']),
+                self.format_currency(breakdown['vat_amount'])
+            )
+            for breakdown in vat_breakdown
+        ]
+
+    def create_vat_breakdown(self, elements):
+        """Create VAT breakdown table"""
+        vat_rows = self.vat_breakdown_rows()
+
+        if vat_rows:
+            vat_data = [['Taux TVA', 'Base HT', 'Montant TVA']]
+            vat_data.extend(list(row) for row in vat_rows)
+
+            vat_table = Table(vat_data, colWidths=[3*cm, 4*cm, 4*cm])
+            vat_table.setStyle(self.theme.vat_table_style)
+
+            elements.append(Paragraph('<b>Détail de la TVA</b>', self.styles['Bold']))
+            elements.append(Spacer(1, 0.3*cm))
+            elements.append(vat_table)
+            elements.append(Spacer(1, 0.5*cm))
+
+    def resolved_totals(self):
+        """Return (subtotal HT, total VAT, total TTC), preferring amounts given in the payload"""
+        subtotal_ht = self.data.get('subtotal_ht', 0)
+        total_vat = self.data.get('total_vat', 0)
+        total_ttc = self.data.get('total_ttc', 0)
+
+        # Use the totals engine if not provided
+        if not subtotal_ht:
+            subtotal_ht = self.totals.subtotal_ht
+
+        if not total_vat:
+            total_vat = self.totals.total_vat
+
+        if not total_ttc:
+            total_ttc = subtotal_ht + total_vat
+
+        return subtotal_ht, total_vat, total_ttc
+
+    def create_totals(self, elements):
+        """Create totals section"""
+        subtotal_ht, total_vat, total_ttc = self.resolved_totals()
+
+        totals_data = [
+            ['Total HT', self.format_currency(subtotal_ht)],
+            ['Total TVA', self.format_currency(total_vat)],
+            ['', ''],  # Spacer
+            ['TOTAL TTC', self.format_currency(total_ttc)]
+        ]
+
+        totals_table = Table(totals_data, colWidths=[5*cm, 4*cm])
+        totals_table.setStyle(self.theme.totals_table_style)
+
+        # Align to right
+        total_container = Table([[None, totals_table]], colWidths=[10*cm, 9*cm])
+
+        elements.append(total_container)
+        elements.append(Spacer(1, 1*cm))
+
+    def payment_lines(self):
+        """Payment instructions as (label, value) pairs; empty when the payload has none"""
+        payment = self.data.get('payment_instructions', {})
+
+        if not payment:
+            return []
+
+        lines = [('Mode de paiement:', payment.get('method', 'Virement bancaire'))]
+
+        if payment.get('iban'):
+            lines.append(('IBAN:', payment['iban']))
+
+        if payment.get('bic'):
+            lines.append(('BIC:', payment['bic']))
+
+        if payment.get('bank_name'):
+            lines.append(('Banque:', payment['bank_name']))
+
+        return lines
+
+    def create_payment_instructions(self, elements):
+        """Create payment instructions section"""
+        payment_lines = self.payment_lines()
+
+        if not payment_lines:
+            return
+
+        elements.append(Paragraph('<b>MODALITÉS DE PAIEMENT</b>', self.styles['Bold']))
+        elements.append(Spacer(1, 0.3*cm))
+
+        payment_text = "".join(f"<b>{label}</b> {value}<br/>" for label, value in payment_lines)
+
+        payment_para = Paragraph(payment_text, self.styles['Normal'])
+        elements.append(payment_para)
+        elements.append(Spacer(1, 0.5*cm))
+
+    def legal_lines(self):
+        """Legal mentions line followed by the mandatory late payment notices"""
+        company = self.data.get('company', {})
+
+        legal_mentions = []
+
+        if company.get('siret'):
+            legal_mentions.append(f"SIRET: {company['siret']}")
+
+        if company.get('vat_number'):
+            legal_mentions.append(f"N° TVA: {company['vat_number']}")
+
+        if company.get('rcs'):
+            legal_mentions.append(f"RCS: {company['rcs']}")
+
+        if company.get('share_capital'):
+            legal_mentions.append(f"Capital social: {self.format_currency(company['share_capital'])}")
+
+        if company.get('insurance'):
+            legal_mentions.append(f"Assurance: {company['insurance']}")
+
+        # Add standard legal text
+        return [
+            " | ".join(legal_mentions),
+            "En cas de retard de paiement, une pénalité de 3 fois le taux d'intérêt légal sera exigible.",
+            "En cas de non-paiement à la date d'échéance, une indemnité forfaitaire de 40€ pour frais de recouvrement sera due.",
+        ]
+
+    def create_footer(self, elements):
+        """Create footer with legal mentions"""
+        elements.append(Spacer(1, 1*cm))
+        elements.append(StaticBlockFlowable(self.legal_block(), hAlign='CENTER'))
+
+    def facturx_xml(self):
+        """Factur-X XML of the invoice in its facturx_profile (BASIC by default), from the same payload and totals as the PDF"""
+        company = self.data.get('company', {})
+        client = self.data.get('client', {})
+        subtotal_ht, total_vat, total_ttc = self.resolved_totals()
+
+        invoice_data = {
+            'invoice_number': self.data.get('invoice_number', ''),
+            'invoice_date': (self.data.get('invoice_date') or datetime.now().strftime('%Y-%m-%d'))[:10],
+            'due_date': (self.data.get('due_date') or '')[:10],
+            'subtotal_ht': to_decimal(subtotal_ht),
+            'total_vat': to_decimal(total_vat),
+            'total_ttc': to_decimal(total_ttc),
+            'line_items': [
+                {
+                    'description': item.get('description', ''),
+                    'quantity': item.get('quantity', 0),
+                    'unit_price': to_decimal(item.get('unit_price_ht', 0), 'unit_price_ht'),
+                    'vat_rate': item.get('vat_rate', 20),
+                    'line_total': line_total,
+                }
+                for item, line_total in zip(self.data.get('line_items', []), self.totals.line_totals)
+            ],
+        }
+        if self.data.get('payment_terms'):
+            invoice_data['payment_terms'] = self.data['payment_terms']
+
+        seller_info = {
+            'company_name': company.get('name', ''),
+            'siret': (company.get('siret') or '').replace(' ', ''),
+            'vat_number': (company.get('vat_number') or '').replace(' ', ''),
+            'address': company.get('address', ''),
+            'postal_code': company.get('postal_code', ''),
+            'city': company.get('city', ''),
+        }
+        return FacturXGenerator.generate_en16931_xml(invoice_data, seller_info, client, profile=self.facturx_profile)
+
+    def generate(self):
+        """Generate the complete PDF and return its bytes"""
+        return self.generate_buffer().getvalue()
+
+    def generate_buffer(self):
+        """
+        Generate the complete PDF into an in-memory buffer, rewound to the start, so it
+        can be streamed without copying. With "facturx": true in the payload the Factur-X
+        XML (profile "facturx_profile", BASIC by default) is embedded and a
+        Factur-X (PDF/A-3) invoice is returned.
+        """
+        buffer = self.render()
+        if self.data.get('facturx'):
+            if self.data.get('document_type', 'FACTURE') != 'FACTURE':
+                raise ValueError("Factur-X is only available for invoices (document_type FACTURE)")
+            if self.facturx_profile not in PROFILES:
+                raise ValueError(f"Unknown facturx_profile '{self.facturx_profile}', expected one of {', '.join(PROFILES)}")
+            xml_bytes = self.facturx_xml()
+            # Raises FacturXValidationError in enforce mode; the compiled XSD replaces factur-x's own check
+            with stage('validate'):
+                self.facturx_validation_errors = check_facturx_xml(xml_bytes, level=self.facturx_profile)
+            with stage('facturx'):
+                facturx_buffer = embed_facturx_buffer(
+                    buffer.getvalue(), xml_bytes, level=self.facturx_profile, check_xsd=False
+                )
+            buffer.close()
+            buffer = facturx_buffer
+
+        add_bytes('pdf', buffer.getbuffer().nbytes)
+        return buffer
+
+    def render(self):
+        """Render the PDF with the selected engine into self.buffer and return it rewound"""
+        try:
+            if self.use_canvas_engine():
+                try:
+                    with stage('canvas'):
+                        CanvasInvoiceRenderer(self).render_to(self.buffer)
+                    self.buffer.seek(0)
+                    return self.buffer
+                except CanvasOverflow as e:
+                    logger.info(f"Canvas layout overflow ({e}), rendering with platypus")
+
+            doc = SimpleDocTemplate(
+                self.buffer,
+                pagesize=A4,
+                rightMargin=2*cm,
+                leftMargin=2*cm,
+                topMargin=2*cm,
+                bottomMargin=2*cm
+            )
+
+            elements = []
+
+            # Build PDF content
+            self.create_header(elements)
+            with stage('line_items'):
+                self.create_line_items_table(elements)
+            self.create_vat_breakdown(elements)
+            self.create_totals(elements)
+            self.create_payment_instructions(elements)
+            self.create_footer(elements)
+
+            # Build PDF
+            with stage('build'):
+                doc.build(elements)
+
+            self.buffer.seek(0)
+            return self.buffer
+
+        except Exception as e:
+            logger.error(f"PDF generation error: {e}", exc_info=True)
+            raise
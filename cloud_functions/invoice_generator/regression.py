@@ -0,0 +1,416 @@
+"""
+Rendering regression suite for FrenchInvoicePDFGenerator.
+
+Renders a fixed synthetic corpus (small to large invoices, with and without
+logo, mixed VAT rates, long descriptions) with both engines, plus two
+end-to-end generate_and_store() cases. It records wall time, peak traced
+memory and PDF size for each case and compares them with a stored baseline.
+The logo server and Supabase Storage are replaced by local stand-ins (uploads
+go to a local HTTP server), so the suite runs offline. It exits with status 1
+when any metric is worse than the baseline by more than its threshold.
+
+Each case is measured in `--runs` fresh processes, and the median of their
+results is compared. A process does one warm-up render (fills the logo and
+static block caches like a warm instance), then at least `--repeat` timed
+renders, more for fast cases. The first process also renders once under
+tracemalloc for peak memory. Every timed render is followed by a fixed
+pure-Python calibration loop. Time is compared as render time / calibration
+time ("relative"), the median over the renders of a process. This cancels
+most of the CPU speed drift of shared machines and keeps a baseline usable
+on another machine. Cases that render in a few milliseconds stay noisy even
+so, and get a wider time threshold (SHORT_CASE_TIME_THRESHOLD). The spread
+column shows how far the runs of a case were apart.
+
+Usage:
+    python regression.py                      # compare with regression_baseline.json
+    python regression.py --update-baseline    # record a new baseline on this machine
+    python regression.py --cases small,large --time-threshold 0.5 --runs 9
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+import functools
+import threading
+import tracemalloc
+import http.server
+import multiprocessing
+
+# Renders must not depend on logos cached by earlier local runs
+os.environ["LOGO_CACHE_DIR"] = tempfile.mkdtemp(prefix="plombipro_regression_logos_")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression_baseline.json")
+
+# Allowed relative increase per metric before a case counts as a regression
+DEFAULT_THRESHOLDS = {'relative_time': 0.25, 'peak_kb': 0.15, 'pdf_bytes': 0.05}
+# Time differences below this are scheduler noise, whatever the ratio
+MIN_TIME_DELTA = 0.005
+# Cases whose baseline render is faster than this are compared with at least SHORT_CASE_TIME_THRESHOLD
+SHORT_CASE_SECONDS = 0.15
+SHORT_CASE_TIME_THRESHOLD = 0.5
+# Processes per case; the median of their results is compared
+DEFAULT_RUNS = 5
+# Fast cases are repeated until the timed renders of a process add up to at least this long
+MIN_TIMED_SECONDS = 0.25
+MAX_REPEAT = 200
+
+LONG_DESCRIPTION = (
+    "Remplacement complet du ballon d'eau chaude électrique 200 L vertical, "
+    "dépose et évacuation de l'ancien appareil, fourniture et pose du groupe "
+    "de sécurité, raccordements cuivre et PER, mise en eau, contrôle "
+    "d'étanchéité et réglage du thermostat. Garantie pièces et main d'oeuvre."
+)
+
+# name -> (line count, VAT rates cycled over the lines, logo, long descriptions)
+CORPUS = {
+    'small': (5, [20], False, False),
+    'small_logo': (5, [20], True, False),
+    'mixed_vat': (100, [20, 10, 5.5, 2.1, 0], True, False),
+    'long_descriptions': (60, [20, 10], False, True),
+    'large': (2000, [20, 10, 5.5], True, False),
+}
+ENGINES = ('platypus', 'canvas')
+
+
+class LocalBucket:
+    """In-memory stand-in for a Supabase Storage bucket"""
+
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+
+    def list(self, path, options=None):
+        search = (options or {}).get('search', '')
+        prefix = path.rstrip('/') + '/'
+        return [
+            {'name': key[len(prefix):]} for key in self.objects
+            if key.startswith(prefix) and key[len(prefix):].startswith(search)
+        ]
+
+    def remove(self, paths):
+        for path in paths:
+            self.objects.pop(path, None)
+        return []
+
+    def get_public_url(self, path):
+        return f"http://storage.local/{self.name}/{path}"
+
+
+class LocalStorage:
+    def __init__(self):
+        self.buckets = {}
+
+    def from_(self, name):
+        return self.buckets.setdefault(name, LocalBucket(name))
+
+
+class LocalSupabase:
+    """Just enough of the Supabase client for generate_and_store() (uploads go to the storage server)"""
+
+    def __init__(self):
+        self.storage = LocalStorage()
+
+
+def start_server(handler):
+    """Serve `handler` on a free localhost port in a daemon thread; returns the base URL"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def start_logo_server():
+    """Serve a generated PNG logo on localhost; returns its URL"""
+    from PIL import Image
+
+    directory = tempfile.mkdtemp(prefix="plombipro_regression_www_")
+    Image.new('RGB', (800, 400), (0, 102, 204)).save(os.path.join(directory, 'logo.png'))
+    return start_server(functools.partial(QuietHandler, directory=directory)) + "/logo.png"
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalStorageHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Stand-in for the Storage REST upload endpoint. Keeps only object sizes, in the
+    process running the server; HEAD returns the size of a stored object.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    sizes = {}
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 65536)))
+        self.sizes[self.path] = int(self.headers['Content-Length'])
+        key = self.path.split('/storage/v1/object/', 1)[-1]
+        self.reply(200, json.dumps({'Key': key}).encode())
+
+    def do_HEAD(self):
+        size = self.sizes.get(self.path)
+        self.send_response(200 if size is not None else 404)
+        self.send_header('Content-Length', str(size or 0))
+        self.end_headers()
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_invoice(name, engine, logo_url):
+    """Build the corpus invoice `name` for `engine`"""
+    line_count, vat_rates, with_logo, long_descriptions = CORPUS[name]
+    company = {
+        'name': 'Plomberie Régression',
+        'address': '12 rue des Artisans',
+        'postal_code': '69003',
+        'city': 'Lyon',
+        'phone': '04 72 00 00 00',
+        'email': 'contact@plomberie-regression.fr',
+        'siret': '123 456 789 00012',
+        'vat_number': 'FR12123456789',
+        'rcs': 'Lyon B 123 456 789',
+    }
+    if with_logo:
+        company['logo_url'] = logo_url
+
+    return {
+        'user_id': 'regression',
+        'engine': engine,
+        'document_type': 'FACTURE',
+        'invoice_number': f'REG-{name}',
+        'invoice_date': '2025-11-05',
+        'due_date': '2025-12-05',
+        'company': company,
+        'client': {'name': 'Client Régression', 'address': '3 place Bellecour', 'postal_code': '69002', 'city': 'Lyon'},
+        'payment_instructions': {'iban': 'FR76 3000 6000 0112 3456 7890 189', 'bic': 'AGRIFRPP'},
+        'line_items': [
+            {
+                'description': LONG_DESCRIPTION if long_descriptions else f'Fourniture raccord laiton réf. {i:06d}',
+                'quantity': i % 7 + 1,
+                'unit_price_ht': 3.5 + (i % 13),
+                'vat_rate': vat_rates[i % len(vat_rates)],
+            }
+            for i in range(line_count)
+        ],
+    }
+
+
+def calibrate():
+    """Time a fixed pure-Python workload used to normalise render times"""
+    start = time.perf_counter()
+    table = {}
+    for i in range(60000):
+        table[i % 97] = str(i) * 2
+    return time.perf_counter() - start
+
+
+def suite_cases(selected=None):
+    """(case id, corpus name, engine, end-to-end) for every case of the suite"""
+    cases = [(f"{name}/{engine}", name, engine, False) for name in CORPUS for engine in ENGINES]
+    cases.append(('mixed_vat/store', 'mixed_vat', 'platypus', True))
+    cases.append(('large/store', 'large', 'canvas', True))
+    if selected:
+        cases = [case for case in cases if case[0] in selected or case[1] in selected]
+    return cases
+
+
+def _measure(case, logo_url, storage_url, repeat, trace_memory, queue):
+    from reportlab import rl_config
+    rl_config.invariant = 1  # no timestamps or random IDs, so PDF sizes are stable
+    logging.disable(logging.INFO)
+
+    import main
+    import pdf_generator
+
+    case_id, name, engine, end_to_end = case
+    invoice = make_invoice(name, engine, logo_url)
+
+    if end_to_end:
+        import requests
+
+        from shared import supabase_client
+        supabase_client._supabase = LocalSupabase()
+        main.SUPABASE_URL = storage_url
+
+        def run():
+            result = main.generate_and_store(invoice, force_render=True)
+            stored = requests.head(f"{storage_url}/storage/v1/object/documents/regression/{result['filename']}")
+            return int(stored.headers['Content-Length'])
+    else:
+        def run():
+            return len(pdf_generator.FrenchInvoicePDFGenerator(invoice).generate())
+
+    run()
+
+    seconds = []
+    ratios = []
+    while len(seconds) < repeat or (sum(seconds) < MIN_TIMED_SECONDS and len(seconds) < MAX_REPEAT):
+        start = time.perf_counter()
+        pdf_bytes = run()
+        elapsed = time.perf_counter() - start
+        seconds.append(elapsed)
+        # Each render is paired with the calibration run right after it, under the same CPU conditions
+        ratios.append(elapsed / calibrate())
+
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    queue.put({
+        'seconds': statistics.median(seconds),
+        'relative_time': statistics.median(ratios),
+        'peak_kb': peak / 1024 if peak is not None else None,
+        'pdf_bytes': pdf_bytes,
+    })
+
+
+def _measure_once(case, logo_url, storage_url, repeat, trace_memory):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(case, logo_url, storage_url, repeat, trace_memory, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def measure_case(case, logo_url, storage_url, repeat, runs):
+    """Run one case in `runs` child processes and return the median of their metrics"""
+    results = [_measure_once(case, logo_url, storage_url, repeat, run == 0) for run in range(runs)]
+    relative_times = [result['relative_time'] for result in results]
+    relative_time = statistics.median(relative_times)
+    return {
+        'seconds': statistics.median(result['seconds'] for result in results),
+        'relative_time': relative_time,
+        'relative_spread': (max(relative_times) - min(relative_times)) / relative_time,
+        'peak_kb': results[0]['peak_kb'],
+        'pdf_bytes': results[0]['pdf_bytes'],
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def environment():
+    from reportlab import Version as reportlab_version
+    return {
+        'python': platform.python_version(),
+        'reportlab': reportlab_version,
+        'machine': platform.machine(),
+    }
+
+
+def compare(metrics, baseline, thresholds):
+    """Return the metrics of one case that regressed: [(metric, baseline value, ratio)]"""
+    regressions = []
+    for metric, limit in thresholds.items():
+        reference = baseline.get(metric)
+        if not reference:
+            continue
+        ratio = metrics[metric] / reference
+        if metric == 'relative_time':
+            if metrics['seconds'] - baseline.get('seconds', 0) < MIN_TIME_DELTA:
+                continue
+            if baseline.get('seconds', 0) < SHORT_CASE_SECONDS:
+                limit = max(limit, SHORT_CASE_TIME_THRESHOLD)
+        if ratio > 1 + limit:
+            regressions.append((metric, reference, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--update-baseline', action='store_true', help='record the results as the new baseline')
+    parser.add_argument('--cases', default='', help='comma separated case ids or corpus names (default: all)')
+    parser.add_argument('--repeat', type=int, default=2, help='minimum timed renders per process')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='processes per case, their median is compared')
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_THRESHOLDS['relative_time'])
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_THRESHOLDS['peak_kb'])
+    parser.add_argument('--size-threshold', type=float, default=DEFAULT_THRESHOLDS['pdf_bytes'])
+    args = parser.parse_args()
+
+    thresholds = {
+        'relative_time': args.time_threshold,
+        'peak_kb': args.memory_threshold,
+        'pdf_bytes': args.size_threshold,
+    }
+    selected = set(filter(None, args.cases.split(',')))
+    cases = suite_cases(selected)
+    if not cases:
+        parser.error(f"no case matches {args.cases!r}")
+
+    baseline = None if args.update_baseline else load_baseline(args.baseline)
+    baseline_cases = (baseline or {}).get('cases', {})
+    if baseline is not None and baseline.get('environment') != environment():
+        print(f"warning: baseline recorded on {baseline.get('environment')}, running on {environment()}")
+
+    logo_url = start_logo_server()
+    storage_url = start_server(LocalStorageHandler)
+    results = {}
+    failures = []
+
+    print(f"{'case':<28} {'time (s)':>9} {'relative':>9} {'spread':>7} {'peak (KB)':>10} {'PDF (B)':>9}  status")
+    for case in cases:
+        case_id = case[0]
+        metrics = measure_case(case, logo_url, storage_url, args.repeat, args.runs)
+        results[case_id] = metrics
+
+        status = 'new'
+        if case_id in baseline_cases:
+            regressions = compare(metrics, baseline_cases[case_id], thresholds)
+            if regressions:
+                status = 'REGRESSION ' + ', '.join(f"{metric} x{ratio:.2f}" for metric, _, ratio in regressions)
+                failures.append(case_id)
+            else:
+                status = 'ok'
+        print(f"{case_id:<28} {metrics['seconds']:>9.3f} {metrics['relative_time']:>9.2f} "
+              f"{metrics['relative_spread']:>6.0%} {metrics['peak_kb']:>10.0f} {metrics['pdf_bytes']:>9}  {status}")
+
+    if args.update_baseline:
+        previous = load_baseline(args.baseline) or {}
+        recorded = previous.get('cases', {}) if selected else {}
+        recorded.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'cases': recorded}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+        return 0
+
+    if failures:
+        print(f"{len(failures)} case(s) regressed: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Tenant-level static blocks of the invoice layout, drawn as PDF Form XObjects.
+
+The company block (logo, name, address) and the legal footer depend only on
+the tenant's company data. Their layout (text wrapping, line positions, logo
+placement) is computed once per tenant and TEMPLATE_VERSION and cached
+in-process as a small display list, so documents of the same tenant skip the
+text wrapping. Each document replays a block once into a named Form XObject
+and references it with doForm wherever it appears: the canvas engine draws
+the footer on every page, so there the footer of a 70 page invoice is
+serialized once instead of 70 times. The platypus engine draws each block
+once per document anyway.
+
+A Form XObject belongs to the PDF file that defines it, and ReportLab cannot
+import prebuilt ones into a new document. The cache therefore holds the
+laid-out drawing operations, not serialized PDF bytes.
+"""
+import io
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from reportlab.lib import colors
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.platypus import Flowable
+
+logger = logging.getLogger(__name__)
+
+STATIC_BLOCK_CACHE_MAX_ENTRIES = int(os.environ.get("INVOICE_STATIC_BLOCK_CACHE_MAX_ENTRIES", "256"))
+
+FONT = 'Helvetica'
+FONT_BOLD = 'Helvetica-Bold'
+
+# Company block: logo, name and contact lines, left column of the header
+COMPANY_BLOCK_WIDTH = 9.5*cm
+LOGO_WIDTH, LOGO_HEIGHT = 3*cm, 2*cm
+COMPANY_NAME_SIZE, COMPANY_NAME_LEADING = 16, 19
+TEXT_SIZE, TEXT_LEADING = 10, 12
+
+# Legal footer
+LEGAL_BLOCK_WIDTH = 16.5*cm
+LEGAL_SIZE, LEGAL_LEADING = 7, 8.5
+LEGAL_DESCENT = 2
+
+_blocks = OrderedDict()
+_blocks_lock = threading.Lock()
+
+
+class StaticBlock:
+    """A laid-out block: drawing operations in block coordinates (origin at the bottom left)"""
+
+    __slots__ = ('form_name', 'width', 'height', 'ops', 'logo')
+
+    def __init__(self, form_name, width, height, ops, logo=None):
+        self.form_name = form_name
+        self.width = width
+        self.height = height
+        self.ops = ops
+        self.logo = logo
+
+    def _define_form(self, canv):
+        canv.beginForm(self.form_name, 0, 0, self.width, self.height)
+        for method, args in self.ops:
+            if method == 'drawLogo':
+                try:
+                    canv.drawImage(ImageReader(io.BytesIO(self.logo)), *args,
+                                   preserveAspectRatio=True, anchor='sw', mask='auto')
+                except Exception as e:
+                    logger.warning(f"Could not add logo: {e}")
+            else:
+                getattr(canv, method)(*args)
+        canv.endForm()
+
+    def draw_on(self, canv, x, y):
+        """Draw the block with its bottom left corner at (x, y), defining the form on first use"""
+        if not canv.hasForm(self.form_name):
+            self._define_form(canv)
+        canv.saveState()
+        canv.translate(x, y)
+        canv.doForm(self.form_name)
+        canv.restoreState()
+
+
+class StaticBlockFlowable(Flowable):
+    """Platypus wrapper so the platypus engine shares the same cached blocks"""
+
+    def __init__(self, block, hAlign='LEFT'):
+        super().__init__()
+        self.block = block
+        self.hAlign = hAlign
+
+    def wrap(self, availWidth, availHeight):
+        return self.block.width, self.block.height
+
+    def draw(self):
+        self.block.draw_on(self.canv, 0, 0)
+
+
+def _finish(kind, key, ops, height, width, logo=None):
+    """Shift ops laid out downwards from y=0 to block coordinates (origin at the bottom left)"""
+    shifted = []
+    for method, args in ops:
+        if method in ('drawString', 'drawCentredString', 'drawLogo'):
+            args = (args[0], args[1] + height, *args[2:])
+        shifted.append((method, args))
+    return StaticBlock(f"{kind}{key[:16]}", width, height, tuple(shifted), logo)
+
+
+def _layout_company_block(key, company, brand_color, logo):
+    default_company_name = "Nom de l'entreprise"
+    ops = []
+    y = 0
+    if logo:
+        y -= LOGO_HEIGHT
+        ops.append(('drawLogo', (0, y, LOGO_WIDTH, LOGO_HEIGHT)))
+        y -= 6
+
+    ops.append(('setFont', (FONT_BOLD, COMPANY_NAME_SIZE)))
+    ops.append(('setFillColor', (brand_color,)))
+    # Columns of the profile may be present but null
+    company_name = company.get('name') or default_company_name
+    for line in simpleSplit(company_name, FONT_BOLD, COMPANY_NAME_SIZE, COMPANY_BLOCK_WIDTH):
+        y -= COMPANY_NAME_LEADING
+        ops.append(('drawString', (0, y + 4, line)))
+    y -= 2
+
+    ops.append(('setFont', (FONT, TEXT_SIZE)))
+    ops.append(('setFillColor', (colors.black,)))
+    address_lines = [
+        company.get('address') or '',
+        f"{company.get('postal_code') or ''} {company.get('city') or ''}",
+        f"Tél: {company.get('phone') or ''}",
+        f"Email: {company.get('email') or ''}",
+    ]
+    for address_line in address_lines:
+        for line in simpleSplit(address_line, FONT, TEXT_SIZE, COMPANY_BLOCK_WIDTH) or ['']:
+            y -= TEXT_LEADING
+            ops.append(('drawString', (0, y + 2, line)))
+    return _finish('Company', key, ops, -y, COMPANY_BLOCK_WIDTH, logo)
+
+
+def _layout_legal_block(key, legal_lines):
+    ops = [('setFont', (FONT, LEGAL_SIZE)), ('setFillColor', (colors.grey,))]
+    y = 0
+    for legal_line in legal_lines:
+        for line in simpleSplit(legal_line, FONT, LEGAL_SIZE, LEGAL_BLOCK_WIDTH) or ['']:
+            y -= LEGAL_LEADING
+            ops.append(('drawCentredString', (LEGAL_BLOCK_WIDTH / 2, y + LEGAL_DESCENT, line)))
+    return _finish('Legal', key, ops, -y, LEGAL_BLOCK_WIDTH)
+
+
+def _cached(key, build):
+    with _blocks_lock:
+        block = _blocks.get(key)
+        if block is not None:
+            _blocks.move_to_end(key)
+            return block
+
+    block = build()
+    with _blocks_lock:
+        _blocks[key] = block
+        while len(_blocks) > STATIC_BLOCK_CACHE_MAX_ENTRIES:
+            _blocks.popitem(last=False)
+    return block
+
+
+def _block_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_company_block(template_version, company, brand_color, logo=None):
+    """Cached company block for a tenant; `logo` is the resized PNG from the logo cache"""
+    logo_digest = hashlib.sha256(logo).hexdigest() if logo else None
+    fields = {name: company.get(name) for name in ('name', 'address', 'postal_code', 'city', 'phone', 'email')}
+    key = _block_key('company', template_version, fields, brand_color.hexval(), logo_digest)
+    return _cached(key, lambda: _layout_company_block(key, company, brand_color, logo))
+
+
+def get_legal_block(template_version, legal_lines):
+    """Cached legal footer block for a tenant's legal mentions"""
+    key = _block_key('legal', template_version, legal_lines)
+    return _cached(key, lambda: _layout_legal_block(key, legal_lines))
+
+
+def clear_static_blocks():
+    """Drop every cached block"""
+    with _blocks_lock:
+        _blocks.clear()
@@ -0,0 +1,161 @@
+"""
+Process-wide style registry for the invoice PDF generator.
+
+Paragraph styles and TableStyles are built once per brand colour and shared by
+every FrenchInvoicePDFGenerator in the process, so constructing a generator no
+longer rebuilds the sample stylesheet or the table style command lists.
+Themes are read-only: `styles` is a mapping proxy and TableStyle objects are
+only ever passed to Table.setStyle, which copies their commands.
+"""
+import logging
+from functools import lru_cache
+from types import MappingProxyType
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import TableStyle
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BRAND_COLOR = '#0066CC'
+ROW_ALT_COLOR = '#F5F5F5'
+
+
+class InvoiceTheme:
+    """Immutable set of paragraph and table styles for one brand colour"""
+
+    __slots__ = (
+        'key', 'brand_color', 'styles', 'header_table_style', 'info_table_style',
+        'line_items_table_style', 'vat_table_style', 'totals_table_style',
+    )
+
+    def __init__(self, brand_color):
+        primary = colors.HexColor(brand_color)
+        alt_row = colors.HexColor(ROW_ALT_COLOR)
+
+        stylesheet = getSampleStyleSheet()
+        stylesheet.add(ParagraphStyle(
+            name='CompanyName',
+            parent=stylesheet['Heading1'],
+            fontSize=16,
+            textColor=primary,
+            spaceAfter=2
+        ))
+
+        stylesheet.add(ParagraphStyle(
+            name='InvoiceTitle',
+            parent=stylesheet['Heading1'],
+            fontSize=20,
+            textColor=primary,
+            alignment=TA_CENTER,
+            spaceAfter=12
+        ))
+
+        stylesheet.add(ParagraphStyle(
+            name='Small',
+            parent=stylesheet['Normal'],
+            fontSize=8,
+            textColor=colors.grey
+        ))
+
+        stylesheet.add(ParagraphStyle(
+            name='Bold',
+            parent=stylesheet['Normal'],
+            fontSize=10,
+            fontName='Helvetica-Bold'
+        ))
+
+        stylesheet.add(ParagraphStyle(
+            name='Legal',
+            parent=stylesheet['Normal'],
+            fontSize=7,
+            textColor=colors.grey,
+            alignment=TA_CENTER
+        ))
+
+        self.key = brand_color
+        self.brand_color = primary
+        self.styles = MappingProxyType(dict(stylesheet.byName))
+
+        self.header_table_style = TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+        ])
+
+        self.info_table_style = TableStyle([
+            ('BOX', (0, 0), (0, 0), 1, colors.grey),
+            ('BOX', (1, 0), (1, 0), 1, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 8),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+            ('TOPPADDING', (0, 0), (-1, -1), 8),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ])
+
+        self.line_items_table_style = TableStyle([
+            # Header styling
+            ('BACKGROUND', (0, 0), (-1, 0), primary),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+
+            # Body styling
+            ('ALIGN', (1, 1), (1, -1), 'CENTER'),  # Quantity
+            ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),   # Prices
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('FONTSIZE', (0, 1), (-1, -1), 9),
+            ('LEFTPADDING', (0, 0), (-1, -1), 5),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 5),
+            ('TOPPADDING', (0, 0), (-1, -1), 5),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+
+            # Grid
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, alt_row]),
+        ])
+
+        self.vat_table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), alt_row),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ])
+
+        self.totals_table_style = TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('LINEABOVE', (0, 3), (-1, 3), 2, primary),
+            ('FONTNAME', (0, 3), (-1, 3), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 3), (-1, 3), 12),
+            ('TEXTCOLOR', (0, 3), (-1, 3), primary),
+            ('TOPPADDING', (0, 3), (-1, 3), 10),
+        ])
+
+
+def normalize_brand_color(brand_color):
+    """Return brand_color as '#RRGGBB', or the default colour if it is missing or invalid"""
+    if not brand_color or not isinstance(brand_color, str):
+        return DEFAULT_BRAND_COLOR
+    value = brand_color.strip().upper()
+    if not value.startswith('#'):
+        value = '#' + value
+    try:
+        colors.HexColor(value)
+    except ValueError:
+        logger.warning(f"Invalid brand colour {brand_color!r}, using default")
+        return DEFAULT_BRAND_COLOR
+    return value
+
+
+@lru_cache(maxsize=128)
+def _build_theme(key):
+    return InvoiceTheme(key)
+
+
+def get_theme(brand_color=None):
+    """Return the shared theme for a tenant brand colour, building it on first use"""
+    return _build_theme(normalize_brand_color(brand_color))
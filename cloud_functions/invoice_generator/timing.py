@@ -0,0 +1,131 @@
+"""
+Per-stage timing of the invoice pipeline.
+
+A request opens a StageTimer with request_timer(). Code anywhere below it
+(logo download, line items layout, doc.build, upload, public URL lookup)
+wraps its work in stage(name) and reports sizes with add_bytes(name, n),
+without the timer being passed around: the current timer lives in a
+context variable, and both helpers do nothing when no timer is active.
+
+Finished timers are logged as one JSON entry and sent as a Server-Timing
+header, and their stage durations are kept in a bounded window per stage so
+percentiles() can report p50/p90/p99 for the instance (the benchmark reads
+them the same way).
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Stage durations kept per stage for percentiles
+TIMING_WINDOW = int(os.environ.get("INVOICE_TIMING_WINDOW", "1000"))
+
+_current_timer = contextvars.ContextVar('invoice_stage_timer', default=None)
+_samples = {}
+_samples_lock = threading.Lock()
+
+
+class StageTimer:
+    """Durations (seconds) and byte counters of the stages of one request, in first-seen order"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {}
+        self.bytes = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_bytes(self, name, count):
+        self.bytes[name] = self.bytes.get(name, 0) + count
+
+    def total(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds"""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def log_fields(self):
+        return {
+            'stages_ms': {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            'bytes': dict(self.bytes),
+            'total_ms': round(self.total() * 1000, 2),
+        }
+
+
+@contextmanager
+def request_timer():
+    """Time the stages run inside the block; the timer is recorded for percentiles on exit"""
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        timer.finished = time.perf_counter()
+        _current_timer.reset(token)
+        record(timer)
+
+
+@contextmanager
+def stage(name):
+    """Add the duration of the block to stage `name` of the current timer, if any"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def add_bytes(name, count):
+    """Add `count` bytes to counter `name` of the current timer, if any"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add_bytes(name, count)
+
+
+def record(timer):
+    with _samples_lock:
+        for name, seconds in (*timer.stages.items(), ('total', timer.total())):
+            samples = _samples.get(name)
+            if samples is None:
+                samples = _samples[name] = deque(maxlen=TIMING_WINDOW)
+            samples.append(seconds)
+
+
+def _percentile(ordered, quantile):
+    index = min(len(ordered) - 1, max(0, round(quantile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def percentiles(quantiles=(50, 90, 99)):
+    """{stage: {'count': n, 'p50': ms, 'p90': ms, 'p99': ms}} over the recorded window"""
+    with _samples_lock:
+        snapshot = {name: sorted(samples) for name, samples in _samples.items()}
+    return {
+        name: {'count': len(ordered), **{f"p{q}": round(_percentile(ordered, q) * 1000, 2) for q in quantiles}}
+        for name, ordered in snapshot.items()
+    }
+
+
+def reset():
+    with _samples_lock:
+        _samples.clear()
+
+
+def log_timer(timer, message, **fields):
+    """Log the timer at INFO as one JSON message, with the stage durations and byte counts as fields"""
+    logger.info(json.dumps({'message': message, **fields, **timer.log_fields()}, default=str))
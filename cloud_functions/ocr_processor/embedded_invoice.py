@@ -0,0 +1,172 @@
+"""
+Fast path for supplier invoices that are Factur-X / ZUGFeRD PDFs.
+
+These PDFs carry the whole invoice as CII XML in an attachment. Reading it
+takes milliseconds and gives exact values, so process_ocr looks for it before
+sending the document to OCR.space. Elements are matched on their local name:
+Factur-X, ZUGFeRD 2.x and XRechnung CII share the same names, and the older
+ZUGFeRD 1.0 names are listed as alternatives in the same paths.
+"""
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Attachment names of the invoice XML (factur-x matches them case-insensitively)
+EMBEDDED_XML_FILENAMES = ['factur-x.xml', 'zugferd-invoice.xml', 'xrechnung.xml']
+
+# A PDF header may be preceded by up to 1 KB of garbage
+PDF_MAGIC = b'%PDF-'
+PDF_HEADER_WINDOW = 1024
+
+
+def _path(*steps):
+    """Relative XPath of nested elements by local name; a step lists alternative names separated by '|'"""
+    return '/'.join(
+        '*[' + ' or '.join(f"local-name()='{name}'" for name in step.split('|')) + ']'
+        for step in steps
+    )
+
+
+# CII name | ZUGFeRD 1.0 name
+DOCUMENT = _path('ExchangedDocument|HeaderExchangedDocument')
+TRANSACTION = _path('SupplyChainTradeTransaction|SpecifiedSupplyChainTradeTransaction')
+SELLER = _path('ApplicableHeaderTradeAgreement|ApplicableSupplyChainTradeAgreement', 'SellerTradeParty')
+SETTLEMENT = _path('ApplicableHeaderTradeSettlement|ApplicableSupplyChainTradeSettlement')
+SUMMATION = _path('SpecifiedTradeSettlementHeaderMonetarySummation|SpecifiedTradeSettlementMonetarySummation')
+LINE_ITEM = _path('IncludedSupplyChainTradeLineItem')
+NET_PRICE = _path('SpecifiedLineTradeAgreement|SpecifiedSupplyChainTradeAgreement', 'NetPriceProductTradePrice')
+LINE_DELIVERY = _path('SpecifiedLineTradeDelivery|SpecifiedSupplyChainTradeDelivery')
+LINE_SETTLEMENT = _path('SpecifiedLineTradeSettlement|SpecifiedSupplyChainTradeSettlement')
+LINE_SUMMATION = _path('SpecifiedTradeSettlementLineMonetarySummation|SpecifiedTradeSettlementMonetarySummation')
+
+
+def is_pdf(data: bytes) -> bool:
+    return PDF_MAGIC in data[:PDF_HEADER_WINDOW]
+
+
+def find_embedded_xml(pdf_bytes: bytes):
+    """Return (filename, xml_bytes) of the invoice XML attached to a PDF, or None if it has none"""
+    # pypdf and the schemas are only loaded for PDFs
+    from facturx import get_xml_from_pdf
+
+    try:
+        filename, xml_bytes = get_xml_from_pdf(pdf_bytes, check_xsd=False, filenames=EMBEDDED_XML_FILENAMES)
+    except Exception as e:
+        logger.warning(f"Could not read PDF attachments: {e}")
+        return None
+    return (filename, xml_bytes) if xml_bytes else None
+
+
+def _text(node, path):
+    found = node.xpath(path)
+    if not found:
+        return None
+    return (found[0].text or '').strip() or None
+
+
+def _number(node, path):
+    text = _text(node, path)
+    return float(text) if text is not None else None
+
+
+def _date(node, path):
+    """ISO date of a CII DateTimeString in format 102 (YYYYMMDD)"""
+    text = _text(node, path)
+    match = re.fullmatch(r'(\d{4})(\d{2})(\d{2})', text or '')
+    return '-'.join(match.groups()) if match else text
+
+
+def _tax_total(summation, currency):
+    """VAT total in the invoice currency; a second TaxTotalAmount may give it in the accounting currency"""
+    amounts = summation.xpath(_path('TaxTotalAmount'))
+    for amount in amounts:
+        if amount.get('currencyID') in (None, currency):
+            return float(amount.text)
+    return float(amounts[0].text) if amounts else None
+
+
+def _line_item(line):
+    price = _number(line, f"{NET_PRICE}/{_path('ChargeAmount')}")
+    basis_quantity = _number(line, f"{NET_PRICE}/{_path('BasisQuantity')}")
+    if price is not None and basis_quantity:
+        # Prices may be given per 10, 100... units
+        price = price / basis_quantity
+    return {
+        'description': _text(line, _path('SpecifiedTradeProduct', 'Name')),
+        'quantity': _number(line, f"{LINE_DELIVERY}/{_path('BilledQuantity')}"),
+        'unit_price': price,
+        'line_total': _number(line, f"{LINE_SETTLEMENT}/{LINE_SUMMATION}/{_path('LineTotalAmount')}"),
+        'vat_rate': _number(line, f"{LINE_SETTLEMENT}/{_path('ApplicableTradeTax', 'RateApplicablePercent|ApplicablePercent')}"),
+    }
+
+
+def _confidence(found):
+    """Values read from the XML are exact: 1.0 when present, 0.0 when the XML lacks them"""
+    return 1.0 if found else 0.0
+
+
+def map_cii_invoice(xml_bytes: bytes) -> dict:
+    """
+    Map a CII invoice to the extracted_data of process_ocr. Values are read,
+    not guessed, so a field's confidence is 1.0 when the XML has it and 0.0
+    when it does not; overall is computed as for OCR text.
+    """
+    from lxml import etree
+
+    root = etree.fromstring(xml_bytes)
+    seller = (root.xpath(f"{TRANSACTION}/{SELLER}") or [root])[0]
+    settlement = (root.xpath(f"{TRANSACTION}/{SETTLEMENT}") or [root])[0]
+    summation = (settlement.xpath(SUMMATION) or [settlement])[0]
+    currency = _text(settlement, _path('InvoiceCurrencyCode'))
+
+    extracted_data = {
+        'invoice_number': _text(root, f"{DOCUMENT}/{_path('ID')}"),
+        'invoice_date': _date(root, f"{DOCUMENT}/{_path('IssueDateTime', 'DateTimeString')}"),
+        'supplier_name': _text(seller, _path('Name')),
+        'supplier_siret': (
+            _text(seller, _path('SpecifiedLegalOrganization', 'ID'))
+            or _text(seller, _path('GlobalID') + "[@schemeID='0009' or @schemeID='0002']")
+        ),
+        'supplier_vat_number': _text(seller, _path('SpecifiedTaxRegistration', 'ID') + "[@schemeID='VA']"),
+        'subtotal_ht': _number(summation, _path('TaxBasisTotalAmount')),
+        'vat_amount': _tax_total(summation, currency),
+        'total_ttc': _number(summation, _path('GrandTotalAmount')),
+        'line_items': [_line_item(line) for line in root.xpath(f"{TRANSACTION}/{LINE_ITEM}")],
+        'raw_text': None,
+    }
+
+    confidence = {
+        'invoice_number': _confidence(extracted_data['invoice_number'] is not None),
+        'invoice_date': _confidence(extracted_data['invoice_date'] is not None),
+        'supplier_info': _confidence(
+            extracted_data['supplier_name'] is not None
+            and (extracted_data['supplier_siret'] is not None or extracted_data['supplier_vat_number'] is not None)
+        ),
+        'total_amount': _confidence(extracted_data['total_ttc'] is not None),
+        'vat_amount': _confidence(extracted_data['vat_amount'] is not None),
+        'line_items': _confidence(extracted_data['line_items']),
+    }
+    confidence['overall'] = (confidence['invoice_number'] + confidence['invoice_date'] + confidence['supplier_info'] +
+                             confidence['total_amount'] + confidence['line_items']) / 5
+    extracted_data['confidence_scores'] = confidence
+    return extracted_data
+
+
+def extract_embedded_invoice(pdf_bytes: bytes):
+    """
+    extracted_data of a PDF carrying Factur-X / ZUGFeRD XML, or None when it
+    has none or the XML cannot be read, so the caller falls back to OCR.
+    """
+    found = find_embedded_xml(pdf_bytes)
+    if found is None:
+        return None
+    filename, xml_bytes = found
+    try:
+        extracted_data = map_cii_invoice(xml_bytes)
+    except Exception as e:
+        logger.warning(f"Embedded invoice XML {filename} could not be mapped: {e}")
+        return None
+    extracted_data['source'] = 'embedded_xml'
+    extracted_data['xml_filename'] = filename
+    return extracted_data
@@ -1,21 +1,30 @@
 import functions_framework
-from supabase import create_client, Client
 import os
+import sys
+import time
 import requests
 import base64
+import binascii
+import logging
 import re
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from embedded_invoice import extract_embedded_invoice, is_pdf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.supabase_client import get_supabase
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # OCR.space API configuration
 OCR_SPACE_API_KEY = os.environ.get("OCR_SPACE_API_KEY", "K89208385288957")
 OCR_SPACE_URL = "https://api.ocr.space/parse/image"
 
+# PDFs given by URL are downloaded to look for embedded Factur-X XML
+PDF_DOWNLOAD_TIMEOUT = 30
+
 class OCRParser:
     """Enhanced OCR parser for French supplier invoices"""
 
@@ -229,10 +238,34 @@ class OCRParser:
         return None, 0.0
 
 
-def call_ocr_space_api(image_url: str = None, image_base64: str = None) -> str:
+def get_pdf_bytes(image_url: str = None, image_base64: str = None) -> Optional[bytes]:
+    """
+    Bytes of the submitted document if it is a PDF, else None. URLs are only
+    downloaded when their path ends in .pdf, so images go straight to OCR.
+    """
+    if image_base64:
+        try:
+            data = base64.b64decode(image_base64.split(',', 1)[-1])
+        except (ValueError, binascii.Error):
+            return None
+        return data if is_pdf(data) else None
+
+    if image_url and urlparse(image_url).path.lower().endswith('.pdf'):
+        try:
+            response = requests.get(image_url, timeout=PDF_DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"Could not download PDF for embedded XML: {e}")
+            return None
+        return response.content if is_pdf(response.content) else None
+
+    return None
+
+
+def call_ocr_space_api(image_url: str = None, image_base64: str = None, mime_type: str = 'image/jpeg') -> str:
     """
     Call OCR.space API to extract text from image
-    Supports both image URL and base64 encoded image
+    Supports both image URL and base64 encoded image (or PDF, with mime_type 'application/pdf')
     """
     payload = {
         'apikey': OCR_SPACE_API_KEY,
@@ -246,7 +279,7 @@ def call_ocr_space_api(image_url: str = None, image_base64: str = None) -> str:
     if image_url:
         payload['url'] = image_url
     elif image_base64:
-        payload['base64Image'] = f'data:image/jpeg;base64,{image_base64}'
+        payload['base64Image'] = f"data:{mime_type};base64,{image_base64.split(',', 1)[-1]}"
     else:
         raise ValueError('Either image_url or image_base64 must be provided')
 
@@ -268,9 +301,66 @@ def call_ocr_space_api(image_url: str = None, image_base64: str = None) -> str:
         raise Exception(f'OCR.space API error: {error_msg}')
 
 
+def extraction_status(confidence_scores: Dict) -> str:
+    """
+    'completed' when the extraction can be trusted as is, else 'needs_review'.
+    A missing field (confidence 0) always needs review, even when the others are certain.
+    """
+    fields = ('invoice_number', 'invoice_date', 'supplier_info', 'total_amount', 'line_items')
+    if confidence_scores['overall'] < 0.8 or any(confidence_scores[field] == 0 for field in fields):
+        return 'needs_review'
+    return 'completed'
+
+
+def parse_ocr_text(full_text: str) -> Dict:
+    """Build the extracted_data of a scan from its OCR text"""
+    parser = OCRParser()
+
+    invoice_number, invoice_number_conf = parser.extract_invoice_number(full_text)
+    invoice_date, invoice_date_conf = parser.extract_date(full_text)
+    supplier_info = parser.extract_supplier_info(full_text)
+    total_ttc, total_conf = parser.extract_total_amount(full_text)
+    vat_amount, vat_conf = parser.extract_vat_amount(full_text)
+    line_items, line_items_conf = parser.extract_line_items(full_text, [])
+
+    # Calculate subtotal if we have total and VAT
+    subtotal_ht = None
+    if total_ttc and vat_amount:
+        subtotal_ht = total_ttc - vat_amount
+
+    # Build structured data
+    extracted_data = {
+        'invoice_number': invoice_number,
+        'invoice_date': invoice_date,
+        'supplier_name': supplier_info['supplier_name'],
+        'supplier_siret': supplier_info['siret'],
+        'supplier_vat_number': supplier_info['vat_number'],
+        'subtotal_ht': subtotal_ht,
+        'vat_amount': vat_amount,
+        'total_ttc': total_ttc,
+        'line_items': line_items,
+        'raw_text': full_text,
+        'source': 'ocr',
+        'confidence_scores': {
+            'invoice_number': invoice_number_conf,
+            'invoice_date': invoice_date_conf,
+            'supplier_info': supplier_info['confidence'],
+            'total_amount': total_conf,
+            'vat_amount': vat_conf,
+            'line_items': line_items_conf,
+            'overall': (invoice_number_conf + invoice_date_conf + supplier_info['confidence'] +
+                       total_conf + line_items_conf) / 5
+        }
+    }
+    return extracted_data
+
+
 @functions_framework.http
 def process_ocr(request):
-    """Enhanced OCR processing with line items and confidence scores using OCR.space API"""
+    """
+    Enhanced OCR processing with line items and confidence scores using OCR.space API.
+    Factur-X / ZUGFeRD PDFs are read from their embedded XML instead, with confidence 1.0 per field found.
+    """
     request_json = request.get_json(silent=True)
     image_url = request_json.get('image_url')
     image_base64 = request_json.get('image_base64')
@@ -280,55 +370,30 @@ def process_ocr(request):
         return {'success': False, 'error': 'Missing image_url/image_base64 or scan_id'}, 400
 
     try:
-        # 1. Call OCR.space API for text detection
-        full_text = call_ocr_space_api(image_url=image_url, image_base64=image_base64)
-
-        if not full_text:
-            raise Exception('No text found in image.')
-
-        # 2. Parse the extracted text
-        parser = OCRParser()
-
-        invoice_number, invoice_number_conf = parser.extract_invoice_number(full_text)
-        invoice_date, invoice_date_conf = parser.extract_date(full_text)
-        supplier_info = parser.extract_supplier_info(full_text)
-        total_ttc, total_conf = parser.extract_total_amount(full_text)
-        vat_amount, vat_conf = parser.extract_vat_amount(full_text)
-        line_items, line_items_conf = parser.extract_line_items(full_text, [])
-
-        # Calculate subtotal if we have total and VAT
-        subtotal_ht = None
-        if total_ttc and vat_amount:
-            subtotal_ht = total_ttc - vat_amount
-
-        # 3. Build structured data
-        extracted_data = {
-            'invoice_number': invoice_number,
-            'invoice_date': invoice_date,
-            'supplier_name': supplier_info['supplier_name'],
-            'supplier_siret': supplier_info['siret'],
-            'supplier_vat_number': supplier_info['vat_number'],
-            'subtotal_ht': subtotal_ht,
-            'vat_amount': vat_amount,
-            'total_ttc': total_ttc,
-            'line_items': line_items,
-            'raw_text': full_text,
-            'confidence_scores': {
-                'invoice_number': invoice_number_conf,
-                'invoice_date': invoice_date_conf,
-                'supplier_info': supplier_info['confidence'],
-                'total_amount': total_conf,
-                'vat_amount': vat_conf,
-                'line_items': line_items_conf,
-                'overall': (invoice_number_conf + invoice_date_conf + supplier_info['confidence'] +
-                           total_conf + line_items_conf) / 5
-            }
-        }
-
-        # 4. Update scans table
-        update_response = supabase.table('scans').update({
+        # 1. Factur-X / ZUGFeRD PDFs carry the invoice as XML: read it instead of running OCR
+        pdf_bytes = get_pdf_bytes(image_url=image_url, image_base64=image_base64)
+        extracted_data = None
+        if pdf_bytes is not None:
+            start = time.perf_counter()
+            extracted_data = extract_embedded_invoice(pdf_bytes)
+            if extracted_data is not None:
+                logger.info(f"Scan {scan_id}: read embedded {extracted_data['xml_filename']} "
+                            f"in {(time.perf_counter() - start) * 1000:.1f} ms, OCR skipped")
+
+        # 2. Otherwise call OCR.space API for text detection and parse the text
+        if extracted_data is None:
+            mime_type = 'application/pdf' if pdf_bytes is not None else 'image/jpeg'
+            full_text = call_ocr_space_api(image_url=image_url, image_base64=image_base64, mime_type=mime_type)
+
+            if not full_text:
+                raise Exception('No text found in image.')
+
+            extracted_data = parse_ocr_text(full_text)
+
+        # 3. Update scans table
+        update_response = get_supabase().table('scans').update({
             'extracted_data': extracted_data,
-            'extraction_status': 'needs_review' if extracted_data['confidence_scores']['overall'] < 0.8 else 'completed'
+            'extraction_status': extraction_status(extracted_data['confidence_scores'])
         }).eq('id', scan_id).execute()
 
         if len(update_response.data) == 0:
@@ -338,7 +403,7 @@ def process_ocr(request):
 
     except Exception as e:
         # Update scan status to failed
-        supabase.table('scans').update({
+        get_supabase().table('scans').update({
             'extraction_status': 'failed',
             'extracted_data': {'error': str(e)}
         }).eq('id', scan_id).execute()
@@ -1,12 +1,10 @@
 import functions_framework
-from supabase import create_client, Client
 import os
+import sys
 from datetime import datetime, timedelta
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.supabase_client import get_supabase
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
 
 # Placeholder for the send_email function URL
 SEND_EMAIL_FUNCTION_URL = os.environ.get("SEND_EMAIL_FUNCTION_URL")
@@ -16,7 +14,7 @@ def schedule_payment_reminders(cloud_event):
     try:
         # 1. Query for overdue invoices
         today = datetime.utcnow().date()
-        overdue_invoices_response = supabase.table('invoices').select('*')\
+        overdue_invoices_response = get_supabase().table('invoices').select('*')\
             .lt('due_date', str(today))\
             .neq('payment_status', 'paid')\
             .execute()
@@ -38,7 +36,7 @@ def schedule_payment_reminders(cloud_event):
 
             # Update the invoice with the new reminder date and count
             reminder_count = invoice.get('reminder_sent_count', 0) + 1
-            supabase.table('invoices').update({
+            get_supabase().table('invoices').update({
                 'last_reminder_sent': str(today),
                 'reminder_sent_count': reminder_count
             }).eq('id', invoice.get('id')).execute()
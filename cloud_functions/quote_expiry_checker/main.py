@@ -1,19 +1,17 @@
 import functions_framework
-from supabase import create_client, Client
 import os
+import sys
 from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.supabase_client import get_supabase
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
 
 @functions_framework.cloud_event
 def check_quote_expiry(cloud_event):
     try:
         # 1. Query for expired quotes
         today = datetime.utcnow().date()
-        expired_quotes_response = supabase.table('quotes').select('id')\
+        expired_quotes_response = get_supabase().table('quotes').select('id')\
             .lt('expiry_date', str(today))\
             .eq('status', 'sent')\
             .execute()
@@ -24,7 +22,7 @@ def check_quote_expiry(cloud_event):
 
         # 2. For each expired quote, update the status
         for quote in expired_quotes_response.data:
-            supabase.table('quotes').update({'status': 'expired'}).eq('id', quote.get('id')).execute()
+            get_supabase().table('quotes').update({'status': 'expired'}).eq('id', quote.get('id')).execute()
 
         return {'success': True}, 200
 
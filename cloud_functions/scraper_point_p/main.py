@@ -1,6 +1,6 @@
 import functions_framework
-from supabase import create_client, Client
 import os
+import sys
 import requests
 from bs4 import BeautifulSoup
 import time
@@ -10,16 +10,13 @@ from urllib.parse import urljoin, urlparse
 from urllib.robotparser import RobotFileParser
 from datetime import datetime
 import re
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.supabase_client import get_supabase
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
-
 # User agents for rotation
 USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -299,14 +296,14 @@ class PointPScraper:
                 }
 
                 # Upsert based on supplier + reference (unique constraint)
-                existing = supabase.table('supplier_products').select('id').eq('supplier', 'point_p').eq('reference', supplier_product['reference']).execute()
+                existing = get_supabase().table('supplier_products').select('id').eq('supplier', 'point_p').eq('reference', supplier_product['reference']).execute()
 
                 if existing.data:
                     # Update existing
-                    supabase.table('supplier_products').update(supplier_product).eq('id', existing.data[0]['id']).execute()
+                    get_supabase().table('supplier_products').update(supplier_product).eq('id', existing.data[0]['id']).execute()
                 else:
                     # Insert new
-                    supabase.table('supplier_products').insert(supplier_product).execute()
+                    get_supabase().table('supplier_products').insert(supplier_product).execute()
 
                 saved_count += 1
                 self.products_scraped += 1
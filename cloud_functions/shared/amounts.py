@@ -0,0 +1,39 @@
+"""
+Decimal amounts shared by the invoice totals engine and the Factur-X model.
+
+Both read amounts from the same JSON payloads (numbers or French-formatted
+strings) and round them to the cent the same way, so a PDF and its Factur-X
+XML always agree, and a malformed amount fails the same way in both.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+DEFAULT_VAT_RATE = Decimal('20')
+
+
+def to_decimal(value, field='amount'):
+    """Convert a JSON number or French-formatted string ("1 234,5") to Decimal; NaN and infinities are rejected"""
+    if value is None or value == '':
+        return Decimal(0)
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, int):
+        amount = Decimal(value)
+    elif isinstance(value, float):
+        # str() gives the shortest repr, so 0.1 becomes Decimal('0.1') and not its binary expansion
+        amount = Decimal(str(value))
+    else:
+        try:
+            amount = Decimal(str(value).replace(' ', '').replace(' ', '').replace(',', '.'))
+        except InvalidOperation:
+            raise ValueError(f"Invalid {field}: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return amount
+
+
+def round_cent(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
@@ -0,0 +1,205 @@
+"""
+Normalized invoice model for Factur-X output.
+
+normalize_invoice() turns the payload dicts (invoice_data, seller_info,
+buyer_info) into typed values once: amounts and rates as Decimal, dates as
+YYYYMMDD, line totals computed when missing. Every profile serializer
+(MINIMUM, BASIC, EN16931, EXTENDED) reads the same model, and the VAT
+breakdown per category and rate is computed on first use and memoized, so
+producing several profiles of an invoice costs little more than one.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from functools import cached_property
+from typing import Iterable, Optional, Tuple
+
+from shared.amounts import DEFAULT_VAT_RATE, HUNDRED, round_cent, to_decimal
+
+# VAT category codes (UNTDID 5305): standard rate, zero rated
+CATEGORY_STANDARD = 'S'
+CATEGORY_ZERO = 'Z'
+
+
+def _compact_date(value):
+    return value[:10].replace('-', '') if value else None
+
+
+@dataclass(frozen=True)
+class Party:
+    """Seller or buyer; identifiers are stored without spaces"""
+    name: Optional[str]
+    siret: Optional[str] = None
+    vat_number: Optional[str] = None
+    address: Optional[str] = ''
+    postal_code: Optional[str] = ''
+    city: Optional[str] = ''
+    country: str = 'FR'
+
+
+@dataclass(frozen=True)
+class LineItem:
+    line_id: str
+    name: Optional[str]
+    quantity: Decimal
+    unit_price: Decimal
+    vat_rate: Decimal
+    line_total: Decimal
+
+    @property
+    def category(self):
+        return CATEGORY_STANDARD if self.vat_rate else CATEGORY_ZERO
+
+
+@dataclass(frozen=True)
+class TaxGroup:
+    """VAT basis and amount of one category and rate"""
+    category: str
+    rate: Decimal
+    basis: Decimal
+    amount: Decimal
+
+
+@dataclass(frozen=True)
+class Summary:
+    """VAT breakdown and header amounts of an invoice"""
+    tax_groups: Tuple[TaxGroup, ...]
+    line_total: Decimal
+    subtotal_ht: Decimal
+    total_vat: Decimal
+    total_ttc: Decimal
+    balance_due: Decimal
+
+
+class VatBreakdown:
+    """Sums line totals per (category, rate) as lines go by"""
+
+    def __init__(self):
+        self.bases = {}
+        self.line_total = Decimal(0)
+
+    def add(self, line):
+        key = (line.category, line.vat_rate)
+        self.bases[key] = self.bases.get(key, Decimal(0)) + line.line_total
+        self.line_total += line.line_total
+
+    def groups(self):
+        # VAT is computed once per rate on the sum of its bases, highest rate first
+        return tuple(
+            TaxGroup(category, rate, basis, round_cent(basis * rate / HUNDRED))
+            for (category, rate), basis in sorted(self.bases.items(), key=lambda entry: entry[0][1], reverse=True)
+        )
+
+
+@dataclass(frozen=True)
+class FacturXInvoice:
+    """
+    One invoice, normalized. Header amounts are None when the payload did not
+    give them; they are then derived from the lines (see summarize).
+    """
+    invoice_number: Optional[str]
+    issue_date: str
+    due_date: Optional[str]
+    payment_terms: str
+    seller: Party
+    buyer: Party
+    line_items: Tuple[LineItem, ...]
+    subtotal_ht: Optional[Decimal] = None
+    total_vat: Optional[Decimal] = None
+    total_ttc: Optional[Decimal] = None
+    balance_due: Optional[Decimal] = None
+
+    @cached_property
+    def summary(self):
+        """VAT breakdown and header amounts, computed once"""
+        breakdown = VatBreakdown()
+        for line in self.line_items:
+            breakdown.add(line)
+        return summarize(self, breakdown)
+
+
+def summarize(invoice, breakdown):
+    """
+    Summary of an invoice from the breakdown of its lines. Amounts given in the
+    payload win over computed ones; without lines, the header keeps one
+    standard-rate group on the given subtotal, as invoices had before.
+    """
+    groups = breakdown.groups()
+    if not groups:
+        groups = (TaxGroup(CATEGORY_STANDARD, DEFAULT_VAT_RATE, invoice.subtotal_ht or Decimal(0), invoice.total_vat or Decimal(0)),)
+
+    subtotal_ht = invoice.subtotal_ht if invoice.subtotal_ht is not None else breakdown.line_total
+    total_vat = invoice.total_vat if invoice.total_vat is not None else sum((group.amount for group in groups), Decimal(0))
+    total_ttc = invoice.total_ttc if invoice.total_ttc is not None else subtotal_ht + total_vat
+    return Summary(
+        tax_groups=groups,
+        line_total=breakdown.line_total if breakdown.bases else subtotal_ht,
+        subtotal_ht=subtotal_ht,
+        total_vat=total_vat,
+        total_ttc=total_ttc,
+        balance_due=invoice.balance_due if invoice.balance_due is not None else total_ttc,
+    )
+
+
+def normalize_line(line_id, item):
+    """LineItem of a payload line; app rows use tax_rate, and line_total is computed when missing"""
+    quantity = to_decimal(item.get('quantity', 1), 'quantity')
+    unit_price = to_decimal(item.get('unit_price', item.get('unit_price_ht', 0)), 'unit_price')
+    line_total = item.get('line_total')
+    return LineItem(
+        line_id=str(line_id),
+        name=item.get('description', ''),
+        quantity=quantity,
+        unit_price=unit_price,
+        vat_rate=to_decimal(item.get('vat_rate', item.get('tax_rate', DEFAULT_VAT_RATE)), 'vat_rate'),
+        line_total=to_decimal(line_total, 'line_total') if line_total is not None else round_cent(quantity * unit_price),
+    )
+
+
+def normalize_lines(line_items: Iterable[dict]):
+    """Yield the LineItem of each payload line, numbered from 1"""
+    for line_id, item in enumerate(line_items, 1):
+        yield normalize_line(line_id, item)
+
+
+def _optional_amount(data, key):
+    return to_decimal(data[key], key) if data.get(key) is not None else None
+
+
+def _party(info, name_key):
+    """Party of a payload dict, a profiles row (tva_number) or a clients row (no name column)"""
+    name = info.get(name_key, '')
+    if not name and (info.get('company_name') or info.get('first_name') or info.get('last_name')):
+        name = info.get('company_name') or ' '.join(part for part in (info.get('first_name'), info.get('last_name')) if part)
+    return Party(
+        name=name,
+        siret=(info.get('siret') or '').replace(' ', '') or None,
+        vat_number=(info.get('vat_number') or info.get('tva_number') or '').replace(' ', '') or None,
+        address=info.get('address') or info.get('billing_address') or '',
+        postal_code=info.get('postal_code', ''),
+        city=info.get('city', ''),
+    )
+
+
+def normalize_invoice(invoice_data: dict, seller_info: dict, buyer_info: dict, line_items=None) -> FacturXInvoice:
+    """
+    Build the model of an invoice. `line_items` overrides
+    invoice_data['line_items']; pass () when lines are streamed separately.
+    """
+    if line_items is None:
+        line_items = tuple(normalize_lines(invoice_data.get('line_items') or []))
+
+    payment_terms = str(invoice_data.get('payment_terms') or '').strip() or '30'
+    return FacturXInvoice(
+        invoice_number=invoice_data.get('invoice_number', ''),
+        issue_date=_compact_date(invoice_data.get('invoice_date') or datetime.now().strftime('%Y-%m-%d')),
+        due_date=_compact_date(invoice_data.get('due_date')),
+        payment_terms=payment_terms,
+        seller=_party(seller_info, 'company_name'),
+        buyer=_party(buyer_info, 'name'),
+        line_items=line_items,
+        subtotal_ht=_optional_amount(invoice_data, 'subtotal_ht'),
+        total_vat=_optional_amount(invoice_data, 'total_vat'),
+        total_ttc=_optional_amount(invoice_data, 'total_ttc'),
+        balance_due=_optional_amount(invoice_data, 'balance_due'),
+    )
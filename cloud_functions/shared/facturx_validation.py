@@ -0,0 +1,136 @@
+"""
+Validation of generated Factur-X XML before it is embedded.
+
+The Factur-X XSD of each level (shipped with the factur-x package) is parsed
+and compiled once per process, then reused, so validating a document costs a
+few milliseconds. An EN16931 Schematron can be added with
+FACTURX_SCHEMATRON_PATH: an ISO Schematron (.sch) or a Schematron already
+compiled to XSLT 1.0 (.xsl/.xslt). The compiled stylesheets shipped with
+factur-x need an XSLT 2 processor and cannot be run by lxml.
+
+FACTURX_VALIDATION selects what happens to an invalid document: 'enforce'
+(default) raises FacturXValidationError, 'report' returns the errors so they
+are sent back with the result, 'off' skips validation.
+
+Errors are dicts: {'source': 'xsd' or 'schematron', 'line', 'path', 'message'}.
+lxml is imported on first use, so importing this module is cheap.
+"""
+import os
+import logging
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+FACTURX_VALIDATION = os.environ.get("FACTURX_VALIDATION", "enforce")
+FACTURX_SCHEMATRON_PATH = os.environ.get("FACTURX_SCHEMATRON_PATH")
+
+VALIDATION_MODES = ('enforce', 'report', 'off')
+
+SVRL_NS = 'http://purl.oclc.org/dsdl/svrl'
+
+
+class FacturXValidationError(Exception):
+    """Generated Factur-X XML failed validation; `errors` lists where and why"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"Factur-X XML is invalid ({len(errors)} error(s)): {errors[0]['message']}")
+
+    def __reduce__(self):
+        # Rebuilt from the errors when raised in a batch worker process
+        return self.__class__, (self.errors,)
+
+
+@lru_cache(maxsize=None)
+def get_xsd_validator(level):
+    """Return (compiled XSD of the Factur-X level, lock); lxml schemas keep one error log, so validations are serialized"""
+    from importlib import resources
+    from lxml import etree
+    from facturx.facturx import FACTURX_LEVEL2xsd
+
+    if level not in FACTURX_LEVEL2xsd:
+        raise ValueError(f"Unknown Factur-X level '{level}'")
+    xsd_path = resources.files('facturx').joinpath('xsd_and_schematron', FACTURX_LEVEL2xsd[level])
+    return etree.XMLSchema(file=str(xsd_path)), threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_schematron_transform(path):
+    """Return the Schematron at `path` compiled to an XSLT transform producing an SVRL report"""
+    from lxml import etree
+
+    if path.endswith('.sch'):
+        from lxml import isoschematron
+        schematron = isoschematron.Schematron(etree.parse(path), store_xslt=True)
+        return etree.XSLT(schematron.validator_xslt)
+    return etree.XSLT(etree.parse(path))
+
+
+def _xsd_errors(document, level):
+    schema, lock = get_xsd_validator(level)
+    with lock:
+        if schema.validate(document):
+            return []
+        return [
+            {'source': 'xsd', 'line': error.line, 'path': error.path, 'message': error.message}
+            for error in schema.error_log
+        ]
+
+
+def _schematron_errors(document, path):
+    report = get_schematron_transform(path)(document)
+    errors = []
+    for failure in report.getroot().iterfind(f'{{{SVRL_NS}}}failed-assert'):
+        location = failure.get('location')
+        nodes = document.xpath(location) if location else []
+        message = ' '.join((failure.findtext(f'{{{SVRL_NS}}}text') or '').split())
+        if failure.get('id'):
+            message = f"[{failure.get('id')}] {message}"
+        errors.append({
+            'source': 'schematron',
+            'line': nodes[0].sourceline if nodes and hasattr(nodes[0], 'sourceline') else None,
+            'path': location,
+            'message': message,
+        })
+    return errors
+
+
+def validate_facturx_xml(xml_bytes, level='basic', schematron_path=None):
+    """
+    Validate Factur-X XML against the XSD of its level, then the Schematron if
+    one is configured. Returns the list of errors, empty when the XML is valid.
+    """
+    from lxml import etree
+
+    try:
+        document = etree.fromstring(xml_bytes).getroottree()
+    except etree.XMLSyntaxError as e:
+        return [{'source': 'xsd', 'line': e.lineno, 'path': None, 'message': e.msg}]
+
+    errors = _xsd_errors(document, level)
+    schematron_path = schematron_path or FACTURX_SCHEMATRON_PATH
+    # Business rules are only meaningful on a structurally valid document
+    if schematron_path and not errors:
+        errors = _schematron_errors(document, schematron_path)
+    return errors
+
+
+def check_facturx_xml(xml_bytes, level='basic', mode=None):
+    """
+    Validate according to `mode` (default FACTURX_VALIDATION). Returns the
+    errors in 'report' mode, raises FacturXValidationError in 'enforce' mode,
+    and returns [] without validating in 'off' mode.
+    """
+    mode = mode or FACTURX_VALIDATION
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown Factur-X validation mode '{mode}'")
+    if mode == 'off':
+        return []
+
+    errors = validate_facturx_xml(xml_bytes, level)
+    if errors:
+        logger.warning(f"Generated Factur-X XML is invalid: {errors[:5]}")
+        if mode == 'enforce':
+            raise FacturXValidationError(errors)
+    return errors
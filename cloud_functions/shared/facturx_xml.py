@@ -0,0 +1,492 @@
+"""
+Shared Factur-X utilities for Cloud Functions.
+Builds the CII XML of an invoice in any Factur-X profile (MINIMUM, BASIC,
+EN16931, EXTENDED) and embeds it into a PDF.
+
+Payloads are first normalized into a FacturXInvoice (shared/facturx_model.py):
+typed amounts, S/Z VAT categories and the VAT breakdown per rate, computed
+once. Each profile is a precompiled skeleton: the document structure, with its
+qualified tag names, indentation and constant values, is compiled once into
+markup strings, and each invoice only fills in its fields, parties, line items
+and tax groups. The BASIC output is byte-identical to the lxml tree builder
+kept as the reference in facturx_generator/benchmark.py.
+Large invoices are streamed, line item by line item, in UTF-8 chunks instead
+of joining every fragment into one string; write_en16931_xml streams to any
+binary file object, with line items read from an iterator.
+"""
+import io
+import os
+import re
+from functools import lru_cache
+
+from shared.amounts import round_cent
+from shared.facturx_model import FacturXInvoice, VatBreakdown, normalize_invoice, normalize_lines, summarize
+
+
+NAMESPACES = {
+    'rsm': 'urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100',
+    'qdt': 'urn:un:unece:uncefact:data:standard:QualifiedDataType:100',
+    'udt': 'urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100',
+    'ram': 'urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100',
+}
+
+# Guideline (BT-24) of each Factur-X profile, which is also its factur-x level name
+GUIDELINES = {
+    'minimum': 'urn:factur-x.eu:1p0:minimum',
+    'basic': 'urn:cen.eu:en16931:2017#compliant#urn:factur-x.eu:1p0:basic',
+    'en16931': 'urn:cen.eu:en16931:2017',
+    'extended': 'urn:cen.eu:en16931:2017#conformant#urn:factur-x.eu:1p0:extended',
+}
+PROFILES = tuple(GUIDELINES)
+BASIC_GUIDELINE = GUIDELINES['basic']
+
+# Invoices with at least this many line items are serialized through _StreamWriter
+XML_STREAM_MIN_LINES = int(os.environ.get("FACTURX_XML_STREAM_MIN_LINES", "500"))
+# Size (characters) of the chunks written when streaming
+XML_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class FacturXGenerator:
+    """Generate Factur-X compliant XML for French invoices"""
+
+    @staticmethod
+    def serialize(invoice: FacturXInvoice, profile: str = 'basic') -> bytes:
+        """
+        XML of a normalized invoice (see normalize_invoice) in one profile. From
+        XML_STREAM_MIN_LINES line items, the markup is encoded chunk by chunk
+        into a buffer, so the fragments of every line and their joined string
+        are never held in memory next to the encoded document.
+        """
+        if len(invoice.line_items) >= XML_STREAM_MIN_LINES:
+            output = io.BytesIO()
+            writer = _StreamWriter(output)
+            _render(_document(profile), _document_values(invoice), writer)
+            writer.flush()
+            return output.getvalue()
+        out = []
+        _render(_document(profile), _document_values(invoice), out)
+        return ''.join(out).encode('utf-8')
+
+    @staticmethod
+    def serialize_profiles(invoice: FacturXInvoice, profiles=PROFILES) -> dict:
+        """
+        XML of a normalized invoice in several profiles, as {profile: bytes}. The
+        VAT breakdown and the line item values are computed once for all of them.
+        """
+        values = _document_values(invoice)
+        values['line_items'] = list(values['line_items'])
+        documents = {}
+        for profile in profiles:
+            out = []
+            _render(_document(profile), values, out)
+            documents[profile] = ''.join(out).encode('utf-8')
+        return documents
+
+    @staticmethod
+    def generate_en16931_xml(invoice_data: dict, seller_info: dict, buyer_info: dict, profile: str = 'basic') -> bytes:
+        """
+        Generate the Factur-X XML of an invoice in `profile` (BASIC by default)
+        Reference: https://www.en16931-3-reader.de/
+        """
+        return FacturXGenerator.serialize(normalize_invoice(invoice_data, seller_info, buyer_info), profile)
+
+    @staticmethod
+    def write_en16931_xml(output, invoice_data: dict, seller_info: dict, buyer_info: dict, line_items=None,
+                          profile: str = 'basic') -> int:
+        """
+        Stream the XML of generate_en16931_xml to a binary file object and return
+        the number of bytes written. Line items are read from `line_items` (any
+        iterable, e.g. a generator paging through rows; defaults to
+        invoice_data['line_items']) and written as they come, so memory stays
+        flat whatever the number of lines; the VAT breakdown is summed on the way
+        and written after them. On error the output is left partial.
+        """
+        if line_items is None:
+            line_items = invoice_data.get('line_items') or []
+        invoice = normalize_invoice(invoice_data, seller_info, buyer_info, line_items=())
+        values = _streamed_values(invoice, normalize_lines(line_items))
+        if profile == 'minimum':
+            # No line items in MINIMUM, but the totals may still come from them
+            for _ in values['line_items']:
+                pass
+
+        writer = _StreamWriter(output)
+        _render(_document(profile), values, writer)
+        writer.flush()
+        return writer.written
+
+
+# Characters lxml refuses in text (XML 1.0 forbids them)
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_ESCAPED_CHARS = re.compile('[&<>\r]')
+
+
+class _Field:
+    """Skeleton placeholder for the text of an element, read from values[name]"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _Section:
+    """Skeleton placeholder repeated once per dict in values[name]: line items, optional groups"""
+
+    def __init__(self, name, children):
+        self.name = name
+        self.children = children
+
+
+def _element(tag, content=None, attributes=''):
+    """Skeleton element: content is constant text, a _Field, a list of children, or None (empty)"""
+    return (tag, attributes, content)
+
+
+def _escape(text):
+    """Serialize element text the way lxml does"""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    elif not isinstance(text, str):
+        raise TypeError(f"Argument must be bytes or unicode, got '{type(text).__name__}'")
+    if _INVALID_XML_CHARS.search(text):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    if _ESCAPED_CHARS.search(text):
+        text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+    return text
+
+
+def _compile(nodes, depth):
+    """
+    Compile skeleton nodes into a tuple of markup strings and slots. Markup is
+    written as etree.tostring(pretty_print=True) would; a slot is a field
+    (name, open tag, close tag, empty element) or a section (name, compiled).
+    """
+    compiled = []
+
+    def markup(text):
+        if compiled and isinstance(compiled[-1], str):
+            compiled[-1] += text
+        else:
+            compiled.append(text)
+
+    for node in nodes:
+        if isinstance(node, _Section):
+            compiled.append((node.name, _compile(node.children, depth)))
+            continue
+
+        tag, attributes, content = node
+        indent = '  ' * depth
+        if content is None:
+            markup(f"{indent}<{tag}{attributes}/>\n")
+        elif isinstance(content, _Field):
+            compiled.append((content.name, f"{indent}<{tag}{attributes}>", f"</{tag}>\n", f"{indent}<{tag}{attributes}/>\n"))
+        elif isinstance(content, str):
+            markup(f"{indent}<{tag}{attributes}>{_escape(content)}</{tag}>\n")
+        else:
+            markup(f"{indent}<{tag}{attributes}>\n")
+            for item in _compile(content, depth + 1):
+                if isinstance(item, str):
+                    markup(item)
+                else:
+                    compiled.append(item)
+            markup(f"{indent}</{tag}>\n")
+    return tuple(compiled)
+
+
+def _render(compiled, values, out):
+    """Append the markup of a compiled skeleton filled with `values` to `out` (a list or a _StreamWriter)"""
+    for item in compiled:
+        if isinstance(item, str):
+            out.append(item)
+        elif len(item) == 2:
+            name, section = item
+            for section_values in values[name]:
+                _render(section, section_values, out)
+        else:
+            name, open_tag, close_tag, empty = item
+            text = values[name]
+            out.append(empty if text is None else open_tag + _escape(text) + close_tag)
+
+
+class _StreamWriter:
+    """Collects rendered markup and writes it UTF-8 encoded to a binary file object, chunk by chunk"""
+
+    def __init__(self, output):
+        self.output = output
+        self.pending = []
+        self.pending_size = 0
+        self.written = 0
+
+    def append(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= XML_STREAM_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            data = ''.join(self.pending).encode('utf-8')
+            self.output.write(data)
+            self.written += len(data)
+            self.pending = []
+            self.pending_size = 0
+
+
+def _amount(value):
+    """Amount rounded to the cent: Decimal('12.5') -> '12.50'"""
+    return str(round_cent(value))
+
+
+def _number(value):
+    """Rate or quantity without trailing zeros or exponent: Decimal('20.0') -> '20', Decimal('5.50') -> '5.5'"""
+    return format(value.normalize(), 'f')
+
+
+def _party(prefix, address=True):
+    """Name, SIRET, address and VAT number of the seller or the buyer"""
+    return [
+        _element('ram:Name', _Field(f'{prefix}_name')),
+        _Section(f'{prefix}_legal', [
+            _element('ram:SpecifiedLegalOrganization', [
+                _element('ram:ID', _Field('siret'), ' schemeID="0002"'),
+            ]),
+        ]),
+        _element('ram:PostalTradeAddress', [
+            _element('ram:PostcodeCode', _Field(f'{prefix}_postal_code')),
+            _element('ram:LineOne', _Field(f'{prefix}_address')),
+            _element('ram:CityName', _Field(f'{prefix}_city')),
+            _element('ram:CountryID', _Field(f'{prefix}_country')),
+        ] if address else [
+            _element('ram:CountryID', _Field(f'{prefix}_country')),
+        ]),
+        _Section(f'{prefix}_tax', [
+            _element('ram:SpecifiedTaxRegistration', [
+                _element('ram:ID', _Field('vat_number'), ' schemeID="VA"'),
+            ]),
+        ]),
+    ]
+
+
+_LINE_ITEM = _element('ram:IncludedSupplyChainTradeLineItem', [
+    _element('ram:AssociatedDocumentLineDocument', [
+        _element('ram:LineID', _Field('line_id')),
+    ]),
+    _element('ram:SpecifiedTradeProduct', [
+        _element('ram:Name', _Field('name')),
+    ]),
+    _element('ram:SpecifiedLineTradeAgreement', [
+        _element('ram:NetPriceProductTradePrice', [
+            _element('ram:ChargeAmount', _Field('charge_amount')),
+        ]),
+    ]),
+    _element('ram:SpecifiedLineTradeDelivery', [
+        _element('ram:BilledQuantity', _Field('quantity'), ' unitCode="C62"'),
+    ]),
+    _element('ram:SpecifiedLineTradeSettlement', [
+        _element('ram:ApplicableTradeTax', [
+            _element('ram:TypeCode', 'VAT'),
+            _element('ram:CategoryCode', _Field('category')),
+            _element('ram:RateApplicablePercent', _Field('vat_rate')),
+        ]),
+        _element('ram:SpecifiedTradeSettlementLineMonetarySummation', [
+            _element('ram:LineTotalAmount', _Field('line_total')),
+        ]),
+    ]),
+])
+
+_TAX_GROUP = _element('ram:ApplicableTradeTax', [
+    _element('ram:CalculatedAmount', _Field('amount')),
+    _element('ram:TypeCode', 'VAT'),
+    _element('ram:BasisAmount', _Field('basis')),
+    _element('ram:CategoryCode', _Field('category')),
+    _element('ram:RateApplicablePercent', _Field('rate')),
+])
+
+
+def _skeleton(profile):
+    """
+    Document skeleton of a profile. BASIC, EN16931 and EXTENDED share one
+    structure; MINIMUM only has the parties and the header totals: no line
+    items, addresses, VAT breakdown or payment terms.
+    """
+    minimum = profile == 'minimum'
+    buyer = _party('buyer')
+    if minimum:
+        buyer = [_element('ram:Name', _Field('buyer_name'))]
+
+    settlement = [_element('ram:InvoiceCurrencyCode', 'EUR')]
+    if not minimum:
+        settlement += [
+            _element('ram:SpecifiedTradeSettlementPaymentMeans', [
+                _element('ram:TypeCode', '30'),
+            ]),
+            _Section('tax_groups', [_TAX_GROUP]),
+            _element('ram:SpecifiedTradePaymentTerms', [
+                _element('ram:Description', _Field('payment_description')),
+                _Section('due_date', [
+                    _element('ram:DueDateDateTime', [
+                        _element('udt:DateTimeString', _Field('due_date'), ' format="102"'),
+                    ]),
+                ]),
+            ]),
+        ]
+    summation = [
+        _element('ram:TaxBasisTotalAmount', _Field('subtotal_ht')),
+        _element('ram:TaxTotalAmount', _Field('total_vat'), ' currencyID="EUR"'),
+        _element('ram:GrandTotalAmount', _Field('total_ttc')),
+        _element('ram:DuePayableAmount', _Field('balance_due')),
+    ]
+    if not minimum:
+        summation.insert(0, _element('ram:LineTotalAmount', _Field('line_total')))
+    settlement.append(_element('ram:SpecifiedTradeSettlementHeaderMonetarySummation', summation))
+
+    transaction = [
+        _element('ram:ApplicableHeaderTradeAgreement', [
+            _element('ram:SellerTradeParty', _party('seller', address=not minimum)),
+            _element('ram:BuyerTradeParty', buyer),
+        ]),
+        _element('ram:ApplicableHeaderTradeDelivery'),
+        _element('ram:ApplicableHeaderTradeSettlement', settlement),
+    ]
+    if not minimum:
+        transaction.insert(0, _Section('line_items', [_LINE_ITEM]))
+
+    return [
+        _element('rsm:ExchangedDocumentContext', [
+            _element('ram:GuidelineSpecifiedDocumentContextParameter', [
+                _element('ram:ID', GUIDELINES[profile]),
+            ]),
+        ]),
+        _element('rsm:ExchangedDocument', [
+            _element('ram:ID', _Field('invoice_number')),
+            _element('ram:TypeCode', '380'),
+            _element('ram:IssueDateTime', [
+                _element('udt:DateTimeString', _Field('issue_date'), ' format="102"'),
+            ]),
+        ]),
+        _element('rsm:SupplyChainTradeTransaction', transaction),
+    ]
+
+
+_NAMESPACE_DECLARATIONS = ''.join(f' xmlns:{prefix}="{uri}"' for prefix, uri in NAMESPACES.items())
+
+
+@lru_cache(maxsize=None)
+def _document(profile):
+    """Markup and slots of the whole document of a profile, compiled on first use"""
+    if profile not in GUIDELINES:
+        raise ValueError(f"Unknown Factur-X profile '{profile}'")
+    compiled = _compile([_element('rsm:CrossIndustryInvoice', _skeleton(profile), _NAMESPACE_DECLARATIONS)], 0)
+    return ("<?xml version='1.0' encoding='UTF-8'?>\n" + compiled[0],) + compiled[1:]
+
+
+def _line_values(line):
+    return {
+        'line_id': line.line_id,
+        'name': line.name,
+        'charge_amount': _amount(line.unit_price),
+        'quantity': _number(line.quantity),
+        'category': line.category,
+        'vat_rate': _number(line.vat_rate),
+        'line_total': _amount(line.line_total),
+    }
+
+
+def _party_values(prefix, party):
+    return {
+        f'{prefix}_name': party.name,
+        f'{prefix}_legal': [{'siret': party.siret}] if party.siret else (),
+        f'{prefix}_postal_code': party.postal_code,
+        f'{prefix}_address': party.address,
+        f'{prefix}_city': party.city,
+        f'{prefix}_country': party.country,
+        f'{prefix}_tax': [{'vat_number': party.vat_number}] if party.vat_number else (),
+    }
+
+
+def _payment_description(payment_terms):
+    """Payment terms text: 'Paiement à N jours' for a number of days, free text (e.g. 'Net 30 jours') as is"""
+    if payment_terms.isascii() and payment_terms.isdigit():
+        return f"Paiement à {payment_terms} jours"
+    return payment_terms
+
+
+def _header_values(invoice):
+    """Field values that do not depend on the line items"""
+    return {
+        'invoice_number': invoice.invoice_number,
+        'issue_date': invoice.issue_date,
+        **_party_values('seller', invoice.seller),
+        **_party_values('buyer', invoice.buyer),
+        'payment_description': _payment_description(invoice.payment_terms),
+        'due_date': [{'due_date': invoice.due_date}] if invoice.due_date else (),
+    }
+
+
+def _summary_values(summary):
+    return {
+        'tax_groups': [
+            {
+                'amount': _amount(group.amount),
+                'basis': _amount(group.basis),
+                'category': group.category,
+                'rate': _number(group.rate),
+            }
+            for group in summary.tax_groups
+        ],
+        'line_total': _amount(summary.line_total),
+        'subtotal_ht': _amount(summary.subtotal_ht),
+        'total_vat': _amount(summary.total_vat),
+        'total_ttc': _amount(summary.total_ttc),
+        'balance_due': _amount(summary.balance_due),
+    }
+
+
+def _document_values(invoice):
+    """Field values of the skeletons for a normalized invoice; line item values are produced lazily"""
+    values = _header_values(invoice)
+    values.update(_summary_values(invoice.summary))
+    values['line_items'] = (_line_values(line) for line in invoice.line_items)
+    return values
+
+
+def _streamed_values(invoice, lines):
+    """
+    Field values for lines streamed from an iterator. The VAT breakdown is
+    summed as line items are rendered, and the summary fields, which come after
+    them in the document, are filled in once the lines are exhausted.
+    """
+    values = _header_values(invoice)
+    breakdown = VatBreakdown()
+
+    def line_items():
+        for line in lines:
+            breakdown.add(line)
+            yield _line_values(line)
+        values.update(_summary_values(summarize(invoice, breakdown)))
+
+    values['line_items'] = line_items()
+    return values
+
+
+def embed_facturx(pdf_bytes: bytes, xml_bytes: bytes, level: str = 'basic', check_xsd: bool = True) -> bytes:
+    """
+    Embed Factur-X XML into a PDF and return the PDF/A-3 Factur-X bytes, with
+    factur-x's binary API. It stages the PDF in a temporary file that it always
+    deletes, failures included, so nothing is left behind in /tmp.
+    """
+    # Heavy import (pypdf, schemas), loaded on first use
+    from facturx import generate_from_binary
+
+    return generate_from_binary(
+        pdf_bytes,
+        xml_bytes,
+        flavor='factur-x',
+        level=level,
+        check_xsd=check_xsd,
+        lang='fr-FR',
+    )
+
+
+def embed_facturx_buffer(pdf_bytes, xml_bytes: bytes, level: str = 'basic', check_xsd: bool = True) -> io.BytesIO:
+    """Same as embed_facturx, returning the Factur-X PDF as a buffer rewound to the start"""
+    return io.BytesIO(embed_facturx(pdf_bytes, xml_bytes, level, check_xsd))
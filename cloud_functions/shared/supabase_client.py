@@ -0,0 +1,24 @@
+"""
+Shared Supabase client for Cloud Functions.
+The client is created on first use, so importing a function's main module
+stays fast on cold starts, and is then reused for the life of the instance.
+"""
+import os
+import threading
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+
+_supabase = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase():
+    """Return the Supabase client, creating it on first use (thread-safe)"""
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
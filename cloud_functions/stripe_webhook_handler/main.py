@@ -1,13 +1,11 @@
 import functions_framework
 import os
+import sys
 import stripe
 from datetime import datetime
-from supabase import create_client, Client
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from shared.supabase_client import get_supabase
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
 
 # Initialize Stripe client
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
@@ -33,8 +31,8 @@ def stripe_webhook_handler(request):
     if event['type'] == 'customer.subscription.created':
         subscription = event['data']['object']
         user_id = subscription['metadata']['user_id']
-        supabase.table('profiles').update({'subscription_plan': 'pro'}).eq('id', user_id).execute()
-        supabase.table('stripe_subscriptions').insert({
+        get_supabase().table('profiles').update({'subscription_plan': 'pro'}).eq('id', user_id).execute()
+        get_supabase().table('stripe_subscriptions').insert({
             'user_id': user_id,
             'stripe_customer_id': subscription['customer'],
             'stripe_subscription_id': subscription['id'],
@@ -46,8 +44,8 @@ def stripe_webhook_handler(request):
     elif event['type'] == 'customer.subscription.deleted':
         subscription = event['data']['object']
         user_id = subscription['metadata']['user_id']
-        supabase.table('profiles').update({'subscription_plan': 'free'}).eq('id', user_id).execute()
-        supabase.table('stripe_subscriptions').update({'status': 'canceled'}).eq('stripe_subscription_id', subscription['id']).execute()
+        get_supabase().table('profiles').update({'subscription_plan': 'free'}).eq('id', user_id).execute()
+        get_supabase().table('stripe_subscriptions').update({'status': 'canceled'}).eq('stripe_subscription_id', subscription['id']).execute()
     else:
         print('Unhandled event type {}'.format(event['type']))
 
@@ -11,9 +11,14 @@ class FacturXService {
   static Future<Map<String, String>?> generateFacturX(String invoiceId) async {
     try {
       // Call the cloud function
+      final userId = _supabase.auth.currentUser?.id;
       final response = await _supabase.functions.invoke(
         'generate-facturx',
-        body: {'invoice_id': invoiceId},
+        body: {
+          'invoice_id': invoiceId,
+          // Lets the function read the seller profile while it fetches the invoice
+          if (userId != null) 'user_id': userId,
+        },
       );
 
       if (response.data == null) {
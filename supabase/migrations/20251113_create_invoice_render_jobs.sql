@@ -0,0 +1,56 @@
+-- Create invoice_render_jobs table for background PDF generation
+-- Migration: 20251113_create_invoice_render_jobs
+-- Description: Status rows for invoice_generator jobs started with "mode": "async"
+
+CREATE TABLE IF NOT EXISTS invoice_render_jobs (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  -- invoice_data.user_id as sent by the client (may be 'anonymous')
+  user_id TEXT,
+  invoice_number TEXT,
+
+  -- Status
+  status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+
+  -- Result
+  invoice_url TEXT,
+  filename TEXT,
+  content_hash TEXT,
+  error TEXT,
+
+  -- Metadata
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+-- Indexes for performance
+CREATE INDEX IF NOT EXISTS idx_invoice_render_jobs_user_id ON invoice_render_jobs(user_id);
+CREATE INDEX IF NOT EXISTS idx_invoice_render_jobs_created_at ON invoice_render_jobs(created_at);
+
+-- Enable Row Level Security (the cloud function writes with the service key)
+ALTER TABLE invoice_render_jobs ENABLE ROW LEVEL SECURITY;
+
+-- RLS Policies
+DROP POLICY IF EXISTS "Users can view own render jobs" ON invoice_render_jobs;
+CREATE POLICY "Users can view own render jobs"
+  ON invoice_render_jobs FOR SELECT
+  USING (auth.uid()::text = user_id);
+
+-- Function to automatically update updated_at timestamp
+CREATE OR REPLACE FUNCTION update_invoice_render_jobs_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = now();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Trigger to call the function
+DROP TRIGGER IF EXISTS set_invoice_render_jobs_updated_at ON invoice_render_jobs;
+CREATE TRIGGER set_invoice_render_jobs_updated_at
+  BEFORE UPDATE ON invoice_render_jobs
+  FOR EACH ROW
+  EXECUTE FUNCTION update_invoice_render_jobs_updated_at();
+
+-- Add helpful comments
+COMMENT ON TABLE invoice_render_jobs IS 'Background invoice PDF generation jobs started by the invoice_generator cloud function';
+COMMENT ON COLUMN invoice_render_jobs.status IS 'Job status: pending, running, completed, failed';
@@ -0,0 +1,27 @@
+-- Bulk Factur-X update for the facturx_generator batch endpoint
+-- Migration: 20251114_mark_invoices_facturx
+-- Description: Records the Factur-X PDF and XML URLs of many invoices in one statement
+
+-- p_updates: [{"id": "<invoice uuid>", "pdf_url": "...", "facturx_xml_url": "..."}, ...]
+CREATE OR REPLACE FUNCTION mark_invoices_facturx(p_updates JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_updated INTEGER;
+BEGIN
+    UPDATE invoices AS i
+    SET pdf_url = u.pdf_url,
+        facturx_xml_url = u.facturx_xml_url,
+        is_electronic_invoice = TRUE
+    FROM jsonb_to_recordset(p_updates) AS u(id UUID, pdf_url TEXT, facturx_xml_url TEXT)
+    WHERE i.id = u.id;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Only the cloud function (service key) may call it: it bypasses row ownership checks
+REVOKE EXECUTE ON FUNCTION mark_invoices_facturx(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION mark_invoices_facturx(JSONB) TO service_role;
+
+COMMENT ON FUNCTION mark_invoices_facturx(JSONB) IS 'Bulk update of Factur-X URLs, used by the facturx_generator batch endpoint';
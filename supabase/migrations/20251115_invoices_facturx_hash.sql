@@ -0,0 +1,29 @@
+-- Content hash of the stored Factur-X files of an invoice
+-- Migration: 20251115_invoices_facturx_hash
+-- Description: Lets facturx_generator skip the embed, upload and update when nothing changed
+
+ALTER TABLE invoices
+ADD COLUMN IF NOT EXISTS facturx_hash TEXT;
+
+COMMENT ON COLUMN invoices.facturx_hash IS 'SHA-256 of the normalized invoice, profile and source PDF the Factur-X files were built from';
+
+-- p_updates: [{"id": "<invoice uuid>", "pdf_url": "...", "facturx_xml_url": "...", "facturx_hash": "..."}, ...]
+CREATE OR REPLACE FUNCTION mark_invoices_facturx(p_updates JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_updated INTEGER;
+BEGIN
+    UPDATE invoices AS i
+    SET pdf_url = u.pdf_url,
+        facturx_xml_url = u.facturx_xml_url,
+        facturx_hash = u.facturx_hash,
+        is_electronic_invoice = TRUE
+    FROM jsonb_to_recordset(p_updates) AS u(id UUID, pdf_url TEXT, facturx_xml_url TEXT, facturx_hash TEXT)
+    WHERE i.id = u.id;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$ LANGUAGE plpgsql;
+
+-- CREATE OR REPLACE keeps the grants of 20251114_mark_invoices_facturx
@@ -0,0 +1,10 @@
+-- Payload of background render jobs
+-- Migration: 20251116_invoice_render_jobs_payload
+-- Description: invoice_render_worker reads the job payload from the row instead of the request's memory
+
+ALTER TABLE invoice_render_jobs
+ADD COLUMN IF NOT EXISTS invoice_data JSONB,
+ADD COLUMN IF NOT EXISTS force_render BOOLEAN NOT NULL DEFAULT FALSE;
+
+COMMENT ON COLUMN invoice_render_jobs.invoice_data IS 'invoice_data sent with "mode": "async", rendered by invoice_render_worker';
+COMMENT ON COLUMN invoice_render_jobs.force_render IS 'Render even if a PDF with the same content hash is stored';